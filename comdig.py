@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+"""
+🛠️ CLI COMDIG: очередь заданий и воркеры пайплайна
+
+Команды:
+  python comdig.py enqueue <YOUTUBE_URL> [<YOUTUBE_URL> ...]   - поставить видео в очередь
+  python comdig.py worker [--once]                             - запустить воркер
+  python comdig.py jobs [--status queued|running|done|dead]    - показать задания
+  python comdig.py stages <VIDEO_DB_ID> [--rerun STAGE]        - состояние этапов видео / повтор этапа
+  python comdig.py progress <VIDEO_DB_ID> [--json] [--top N]   - прогресс ранжирования и текущий топ
+  python comdig.py rank-shards <VIDEO_DB_ID> [--processes N]    - ранжировать видео шардами
+  python comdig.py shard-worker [--video ID] [--drain]          - воркер шардов ранжирования
+  python comdig.py tail <YOUTUBE_URL> [--top N] [--max-minutes M] - следить за новыми комментариями
+  python comdig.py recrawl-plan [--budget N] [--json]          - план повторных загрузок
+  python comdig.py recrawl [--budget N] [--once]               - выполнять повторные загрузки по плану
+
+Воркеров можно запускать сколько угодно и на разных узлах - они делят таблицы jobs и ranking_shards.
+"""
+
+import argparse
+import json
+import sys
+
+from models import Comment, get_db_session
+from job_queue import JOB_POLL_SECONDS, Worker, enqueue, list_jobs
+from rank_store import ranking_progress
+from ranking_shards import RANK_PROCESSES, ShardWorker, rank_video_sharded
+from recrawl_scheduler import RECRAWL_BUDGET_PER_HOUR, RecrawlScheduler, planned_fetch_rate
+from stage_state import STAGES, StageTracker
+
+
+def cmd_enqueue(args):
+    session = get_db_session()
+    try:
+        for url in args.urls:
+            job = enqueue(session, url, max_attempts=args.max_attempts)
+            print(f"📥 Задание {job.id}: {url} ({job.status})")
+    finally:
+        session.close()
+
+
+def cmd_worker(args):
+    try:
+        Worker(args.api_key, poll_interval=args.poll).run(once=args.once)
+    except KeyboardInterrupt:
+        print("\n⏹️ Воркер остановлен")
+
+
+def cmd_jobs(args):
+    session = get_db_session()
+    try:
+        jobs = list_jobs(session, args.status, args.limit)
+        if not jobs:
+            print("📭 Заданий нет")
+            return
+        for job in jobs:
+            error = f" | {job.last_error.splitlines()[0][:80]}" if job.last_error else ""
+            print(f"{job.id:>6} {job.status:<8} {job.stage:<10} попыток {job.attempts}/{job.max_attempts} "
+                  f"{job.video_url}{error}")
+    finally:
+        session.close()
+
+
+def cmd_stages(args):
+    session = get_db_session()
+    try:
+        tracker = StageTracker(session, args.video_id)
+        if args.rerun:
+            tracker.invalidate(args.rerun)
+            print(f"🔄 Этап {args.rerun} будет выполнен заново при следующей обработке")
+        for stage in STAGES:
+            state = tracker.states[stage]
+            stale = " (устарел)" if tracker.is_stale(stage) else ""
+            print(f"{stage:<11} {state.status:<8}{stale} начат: {state.started_at or '-'} "
+                  f"завершен: {state.finished_at or '-'} выход: {state.output_hash or '-'}")
+            if state.error:
+                print(f"            ошибка: {state.error}")
+        print(f"▶️ Осталось выполнить: {', '.join(tracker.pending_stages()) or 'ничего'}")
+    finally:
+        session.close()
+
+
+def cmd_progress(args):
+    session = get_db_session()
+    try:
+        progress = ranking_progress(session, args.video_id)
+        if args.json:
+            print(json.dumps(progress, ensure_ascii=False))
+            return
+        print(f"📊 Видео {args.video_id}: проранжировано {progress['ranked']}/{progress['comments']} "
+              f"({progress['coverage']:.1%}), верхний уровень {progress['top_level_coverage']:.1%}, "
+              f"лайки {progress['likes_coverage']:.1%}")
+        run = progress["run"]
+        if run:
+            speed = f"{run['ranks_per_second']:.2f} ранг/сек" if run["ranks_per_second"] else "-"
+            print(f"   запуск {run['id']} ({run['ranker']}): {run['status']}, {run['ranked']}/{run['total']} "
+                  f"за {run['batches']} батчей, скорость {speed}, обновлен {run['updated_at']}")
+            if run["shards"]:
+                print(f"   шарды: {', '.join(f'{status} {count}' for status, count in sorted(run['shards'].items()))}")
+            if run["error"]:
+                print(f"   ошибка: {run['error']}")
+        if args.top:
+            # Ранги коммитятся по батчам - топ доступен и во время ранжирования
+            top = session.query(Comment.comment_rank, Comment.likes, Comment.text).filter(
+                Comment.video_id == args.video_id, Comment.comment_rank.isnot(None)
+            ).order_by(Comment.comment_rank.desc()).limit(args.top).all()
+            for i, (rank, likes, text) in enumerate(top, 1):
+                print(f"{i:>3}. {rank:.3f} 👍 {likes or 0}: {(text or '')[:100]}")
+    finally:
+        session.close()
+
+
+def cmd_rank_shards(args):
+    success = rank_video_sharded(args.video_id, args.api_key, args.processes)
+    return 0 if success else 1
+
+
+def cmd_shard_worker(args):
+    try:
+        ShardWorker(args.api_key, poll_interval=args.poll).run(video_id=args.video, drain=args.drain)
+    except KeyboardInterrupt:
+        print("\n⏹️ Воркер шардов остановлен")
+
+
+def cmd_tail(args):
+    # Импорт здесь: режим слежения тянет загрузчик комментариев и весь пайплайн
+    from live_tail import tail_video
+
+    max_duration = args.max_minutes * 60 if args.max_minutes else None
+    try:
+        total = tail_video(args.url, args.api_key, args.top, max_duration)
+        print(f"✅ Слежение завершено: сохранено {total} новых комментариев")
+    except KeyboardInterrupt:
+        print("\n⏹️ Слежение остановлено")
+
+
+def cmd_recrawl_plan(args):
+    scheduler = RecrawlScheduler(args.budget)
+    try:
+        plan = scheduler.plan()
+    finally:
+        scheduler.session.close()
+    rate = planned_fetch_rate(plan)
+    if args.json:
+        print(json.dumps({
+            "budget_per_hour": args.budget,
+            "planned_requests_per_hour": rate,
+            "planned_requests_per_second": rate / 3600,
+            "videos": [item.as_dict() for item in plan],
+        }, ensure_ascii=False))
+        return
+    print(f"🗓️ {len(plan)} видео, запланировано {rate:.1f} запросов/ч ({rate / 3600:.3f}/сек), "
+          f"бюджет {args.budget:.0f}/ч")
+    for item in plan[:args.limit]:
+        print(f"{item.video_id:>6} скорость {item.velocity:>9.2f}/ч  интервал {item.interval_hours:>7.2f} ч  "
+              f"~{item.cost:.0f} запросов  следующая {item.next_crawl_at:%Y-%m-%d %H:%M}")
+
+
+def cmd_recrawl(args):
+    try:
+        RecrawlScheduler(args.budget, args.api_key).run(once=args.once)
+    except KeyboardInterrupt:
+        print("\n⏹️ Планировщик остановлен")
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="comdig", description="Очередь заданий ComDig")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    enqueue_parser = subparsers.add_parser("enqueue", help="Поставить видео в очередь")
+    enqueue_parser.add_argument("urls", nargs="+", help="URL YouTube видео")
+    enqueue_parser.add_argument("--max-attempts", type=int, default=5)
+    enqueue_parser.set_defaults(func=cmd_enqueue)
+
+    worker_parser = subparsers.add_parser("worker", help="Запустить воркер пайплайна")
+    worker_parser.add_argument("--api-key", default=None, help="GEMINI_API_KEY (по умолчанию из окружения)")
+    worker_parser.add_argument("--poll", type=float, default=JOB_POLL_SECONDS, help="Пауза при пустой очереди (сек)")
+    worker_parser.add_argument("--once", action="store_true", help="Обработать одно задание и выйти")
+    worker_parser.set_defaults(func=cmd_worker)
+
+    jobs_parser = subparsers.add_parser("jobs", help="Показать задания")
+    jobs_parser.add_argument("--status", choices=("queued", "running", "done", "dead"))
+    jobs_parser.add_argument("--limit", type=int, default=50)
+    jobs_parser.set_defaults(func=cmd_jobs)
+
+    stages_parser = subparsers.add_parser("stages", help="Состояние этапов обработки видео")
+    stages_parser.add_argument("video_id", type=int, help="ID видео в БД")
+    stages_parser.add_argument("--rerun", choices=STAGES, help="Выполнить этап заново")
+    stages_parser.set_defaults(func=cmd_stages)
+
+    progress_parser = subparsers.add_parser("progress", help="Прогресс ранжирования комментариев видео")
+    progress_parser.add_argument("video_id", type=int, help="ID видео в БД")
+    progress_parser.add_argument("--json", action="store_true", help="Вывести в JSON")
+    progress_parser.add_argument("--top", type=int, default=0, help="Показать N лучших комментариев")
+    progress_parser.set_defaults(func=cmd_progress)
+
+    rank_shards_parser = subparsers.add_parser("rank-shards", help="Ранжировать комментарии видео шардами")
+    rank_shards_parser.add_argument("video_id", type=int, help="ID видео в БД")
+    rank_shards_parser.add_argument("--processes", type=int, default=RANK_PROCESSES,
+                                    help="Локальных процессов ранжирования")
+    rank_shards_parser.add_argument("--api-key", default=None, help="GEMINI_API_KEY (по умолчанию из окружения)")
+    rank_shards_parser.set_defaults(func=cmd_rank_shards)
+
+    shard_worker_parser = subparsers.add_parser("shard-worker", help="Воркер шардов ранжирования")
+    shard_worker_parser.add_argument("--video", type=int, default=None, help="Только шарды этого видео")
+    shard_worker_parser.add_argument("--drain", action="store_true", help="Выйти, когда шардов не останется")
+    shard_worker_parser.add_argument("--api-key", default=None, help="GEMINI_API_KEY (по умолчанию из окружения)")
+    shard_worker_parser.add_argument("--poll", type=float, default=JOB_POLL_SECONDS, help="Пауза при пустой очереди (сек)")
+    shard_worker_parser.set_defaults(func=cmd_shard_worker)
+
+    tail_parser = subparsers.add_parser("tail", help="Следить за новыми комментариями премьеры или трансляции")
+    tail_parser.add_argument("url", help="URL YouTube видео")
+    tail_parser.add_argument("--top", type=int, default=20, help="Размер скользящего топа")
+    tail_parser.add_argument("--max-minutes", type=float, default=None, help="Максимальная длительность слежения")
+    tail_parser.add_argument("--api-key", default=None, help="GEMINI_API_KEY (по умолчанию из окружения)")
+    tail_parser.set_defaults(func=cmd_tail)
+
+    recrawl_plan_parser = subparsers.add_parser("recrawl-plan", help="План повторных загрузок комментариев")
+    recrawl_plan_parser.add_argument("--budget", type=float, default=RECRAWL_BUDGET_PER_HOUR,
+                                     help="Бюджет запросов к YouTube в час")
+    recrawl_plan_parser.add_argument("--limit", type=int, default=50)
+    recrawl_plan_parser.add_argument("--json", action="store_true", help="Вывести в JSON")
+    recrawl_plan_parser.set_defaults(func=cmd_recrawl_plan)
+
+    recrawl_parser = subparsers.add_parser("recrawl", help="Повторные загрузки комментариев по плану")
+    recrawl_parser.add_argument("--budget", type=float, default=RECRAWL_BUDGET_PER_HOUR,
+                                help="Бюджет запросов к YouTube в час")
+    recrawl_parser.add_argument("--once", action="store_true", help="Один проход по плану")
+    recrawl_parser.add_argument("--api-key", default=None, help="GEMINI_API_KEY (по умолчанию из окружения)")
+    recrawl_parser.set_defaults(func=cmd_recrawl)
+
+    args = parser.parse_args()
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -2,19 +2,22 @@ import requests
 import json
 import time
 import random
-from typing import List, Dict, Optional
-from sqlalchemy.orm import Session
+from typing import List, Dict, Optional, Tuple
 from models import Video, Comment, get_db_session
+from http_client import shared_client
+from ranking_driver import CommentRow, RankingDriver, RankWindow, count_unranked
 
 class CommentRanker:
     """Система ранжирования комментариев по информативности"""
     
     def __init__(self, llm_service_url: str = "http://summarizer-llm:8000", use_fallback: bool = True):
         self.llm_service_url = llm_service_url
-        self.batch_size = 5  # Размер батча для обработки
+        self.batch_size = 16  # Размер батча: комментарии батча ранжируются одним запросом к /rank
         self.use_fallback = use_fallback  # Использовать fallback при ошибках LLM
-        self.timeout = 30  # Таймаут для запросов к LLM
+        self.timeout = 120  # Таймаут для запросов к LLM (на весь батч)
         self.max_retries = 2  # Максимальное количество попыток
+        # logits - оценка за один проход модели по вероятностям цифр (детерминированно, без генерации)
+        self.llm_scoring_method = "logits"
         
     def rank_comments_for_video(self, video_id: int) -> bool:
         """
@@ -38,39 +41,26 @@ class CommentRanker:
                 print(f"❌ У видео {video_id} нет summary для ранжирования")
                 return False
                 
-            # Получаем комментарии без ранга
-            comments = session.query(Comment).filter_by(
-                video_id=video_id, 
-                comment_rank=None
-            ).all()
+            # Считаем комментарии без ранга; сами тексты читаются окнами в RankingDriver
+            total = count_unranked(session, video_id)
             
-            if not comments:
+            if not total:
                 print(f"✅ Все комментарии для видео {video_id} уже проранжированы")
                 return True
+            video_summary = video.summary
+            session.expunge_all()
                 
-            print(f"🔄 Начинаю ранжирование {len(comments)} комментариев для видео {video_id}")
+            print(f"🔄 Начинаю ранжирование {total} комментариев для видео {video_id}")
             
-            # Проверяем доступность LLM
-            llm_available = self._check_llm_availability()
-            if not llm_available and self.use_fallback:
-                print("⚠️ LLM недоступна, переключаюсь на эвристический алгоритм")
-            elif not llm_available:
-                print("❌ LLM недоступна и fallback отключен")
+            window_ranker = self.make_window_ranker(video_summary)
+            if window_ranker is None:
                 return False
+            ranker_name, rank_window = window_ranker
             
-            # Обрабатываем комментарии батчами
-            successful_ranks = 0
-            for i in range(0, len(comments), self.batch_size):
-                batch = comments[i:i + self.batch_size]
-                batch_success = self._process_batch(batch, video.summary, session, llm_available)
-                successful_ranks += batch_success
-                
-                # Небольшая пауза между батчами
-                time.sleep(1)
-                
-            session.commit()
+            driver = RankingDriver(session, video_id)
+            successful_ranks = driver.run(ranker_name, total, rank_window)
             print(f"✅ Ранжирование завершено для видео {video_id}")
-            print(f"📊 Успешно проранжировано: {successful_ranks}/{len(comments)} комментариев")
+            print(f"📊 Успешно проранжировано: {successful_ranks}/{total} комментариев")
             return True
             
         except Exception as e:
@@ -80,23 +70,41 @@ class CommentRanker:
         finally:
             session.close()
     
+    def make_window_ranker(self, video_summary: str) -> Optional[Tuple[str, RankWindow]]:
+        """
+        Проверяет доступность LLM и готовит функцию ранжирования окна для RankingDriver
+        
+        Returns:
+            (имя ранжировщика, функция) или None, если LLM недоступна и fallback отключен
+        """
+        llm_available = self._check_llm_availability()
+        if not llm_available and self.use_fallback:
+            print("⚠️ LLM недоступна, переключаюсь на эвристический алгоритм")
+        elif not llm_available:
+            print("❌ LLM недоступна и fallback отключен")
+            return None
+        
+        def rank_window(window: List[CommentRow]):
+            # Обрабатываем комментарии батчами; ранги каждого батча сохраняются сразу
+            for i in range(0, len(window), self.batch_size):
+                yield self._process_batch(window[i:i + self.batch_size], video_summary, llm_available)
+                
+                # Небольшая пауза между батчами
+                time.sleep(1)
+        
+        return ("llm" if llm_available else "heuristic"), rank_window
+    
     def _check_llm_availability(self) -> bool:
         """Проверяет доступность LLM сервиса"""
         try:
             print(f"🔍 Проверяю доступность LLM: {self.llm_service_url}")
-            # Проверяем доступность через endpoint /summarize с коротким тестовым запросом
-            response = requests.post(
-                f"{self.llm_service_url}/summarize",
-                json={"text": "test"},
-                timeout=60
-            )
+            # /ready отвечает 200 только когда модель загружена в память
+            response = shared_client.get(f"{self.llm_service_url}/ready", timeout=10, retries=0,
+                                         endpoint="summarizer /ready")
             print(f"📡 Ответ LLM: статус {response.status_code}")
             if response.status_code == 200:
-                result = response.json()
-                print(f"📄 Содержимое ответа: {result}")
-                has_summary = result.get("summary") is not None
-                print(f"✅ LLM доступна: {has_summary}")
-                return has_summary
+                print(f"✅ LLM доступна: {response.json()}")
+                return True
             else:
                 print(f"❌ LLM недоступна: неверный статус {response.status_code}")
                 return False
@@ -104,20 +112,22 @@ class CommentRanker:
             print(f"❌ Ошибка при проверке LLM: {e}")
             return False
     
-    def _process_batch(self, comments: List[Comment], video_summary: str, session: Session, llm_available: bool) -> int:
-        """Обрабатывает батч комментариев"""
-        successful_ranks = 0
-        for comment in comments:
+    def _process_batch(self, comments: List[CommentRow], video_summary: str, llm_available: bool) -> List[Tuple[int, float]]:
+        """Обрабатывает батч комментариев и возвращает пары (id комментария, ранг)"""
+        ranks = []
+        llm_ranks = self._rank_batch_llm([c.text for c in comments], video_summary) if llm_available else None
+        for i, comment in enumerate(comments):
             try:
-                if llm_available:
-                    rank = self._rank_single_comment_llm(comment.text, video_summary)
-                else:
+                if llm_ranks and llm_ranks[i] is not None:
+                    rank = llm_ranks[i]
+                elif not llm_available or self.use_fallback:
                     rank = self._rank_single_comment_fallback(comment.text, video_summary)
+                else:
+                    rank = None
                     
                 if rank is not None:
-                    comment.comment_rank = rank
-                    successful_ranks += 1
-                    method = "LLM" if llm_available else "эвристика"
+                    ranks.append((comment.id, rank))
+                    method = "LLM" if llm_ranks and llm_ranks[i] is not None else "эвристика"
                     print(f"📊 Комментарий ID {comment.id}: ранг {rank:.3f} ({method})")
                 else:
                     print(f"⚠️ Не удалось проранжировать комментарий ID {comment.id}")
@@ -125,47 +135,56 @@ class CommentRanker:
             except Exception as e:
                 print(f"❌ Ошибка при обработке комментария ID {comment.id}: {e}")
         
-        return successful_ranks
+        return ranks
     
-    def _rank_single_comment_llm(self, comment_text: str, video_summary: str) -> Optional[float]:
+    def _rank_batch_llm(self, comment_texts: List[str], video_summary: str) -> Optional[List[Optional[float]]]:
         """
-        Ранжирует один комментарий с помощью LLM
+        Ранжирует батч комментариев одним запросом к /rank сервиса LLM.
+        Summary видео - общий префикс промптов, сервис переиспользует его KV-кэш
         
         Args:
-            comment_text: Текст комментария
+            comment_texts: Тексты комментариев
             video_summary: Краткое содержание видео
             
         Returns:
-            float: Ранг от 0.0 до 1.0 или None при ошибке
+            List[Optional[float]]: Ранги от 0.0 до 1.0 (None - модель не дала оценку) или None при ошибке
         """
-        prompt = self._create_ranking_prompt(comment_text, video_summary)
+        try:
+            # Таймауты, обрывы и 429/503 повторяются общим клиентом с backoff и учетом Retry-After
+            response = shared_client.post(
+                f"{self.llm_service_url}/rank",
+                json={"summary": video_summary, "comments": comment_texts, "method": self.llm_scoring_method},
+                timeout=self.timeout,
+                retries=self.max_retries,
+                endpoint="summarizer /rank"
+            )
+        except requests.exceptions.RequestException as e:
+            print(f"❌ Ошибка соединения с LLM: {e}")
+            return None
         
-        for attempt in range(self.max_retries):
-            try:
-                response = requests.post(
-                    f"{self.llm_service_url}/summarize",
-                    json={"text": prompt},
-                    timeout=self.timeout
-                )
-                
-                if response.status_code == 200:
-                    result = response.json()
-                    content = result.get("summary", "").strip()
-                    
-                    # Извлекаем числовую оценку из ответа
-                    rank = self._extract_rank_from_response(content)
-                    if rank is not None:
-                        return rank
-                else:
-                    print(f"❌ Ошибка LLM сервиса: {response.status_code}")
-                    
-            except requests.exceptions.Timeout:
-                print(f"⏰ Таймаут LLM (попытка {attempt + 1}/{self.max_retries})")
-                if attempt < self.max_retries - 1:
-                    time.sleep(2)  # Пауза перед повторной попыткой
-            except requests.exceptions.RequestException as e:
-                print(f"❌ Ошибка соединения с LLM: {e}")
-                break
+        if response.status_code != 200:
+            print(f"❌ Ошибка LLM сервиса: {response.status_code}")
+            return None
+        result = response.json()
+        ranks = result.get("ranks")
+        if ranks and len(ranks) == len(comment_texts):
+            cache = result.get("prefix_cache", {})
+            print(f"⚡ KV-кэш префикса: {cache.get('hits', 0)}/{len(comment_texts)} попаданий, "
+                  f"переиспользовано {cache.get('reused_tokens', 0)}/{cache.get('prompt_tokens', 0)} токенов")
+            return ranks
+        print(f"❌ Ошибка LLM сервиса: {result.get('error')}")
+        return None
+    
+    def _rank_single_comment_llm(self, comment_text: str, video_summary: str) -> Optional[float]:
+        """
+        Ранжирует один комментарий с помощью LLM
+        
+        Returns:
+            float: Ранг от 0.0 до 1.0 или None при ошибке
+        """
+        ranks = self._rank_batch_llm([comment_text], video_summary)
+        if ranks and ranks[0] is not None:
+            return ranks[0]
         
         # Если LLM не сработала, используем fallback
         if self.use_fallback:
@@ -207,43 +226,6 @@ class CommentRanker:
         # Ограничиваем диапазон
         return max(0.0, min(1.0, rank))
     
-    def _create_ranking_prompt(self, comment_text: str, video_summary: str) -> str:
-        """Создает промпт для ранжирования комментария"""
-        return f"""Оцени информативность комментария относительно содержания видео по шкале от 0.0 до 1.0.
-
-Содержание видео: {video_summary}
-
-Комментарий: {comment_text}
-
-Критерии оценки:
-- 1.0: Комментарий добавляет значительную ценность, дополняет или уточняет содержание видео
-- 0.7-0.9: Комментарий релевантен и содержит полезную информацию
-- 0.4-0.6: Комментарий частично связан с темой видео
-- 0.1-0.3: Комментарий слабо связан с содержанием
-- 0.0: Комментарий не связан с видео (спам, оффтоп, эмоции без содержания)
-
-Ответь только числом от 0.0 до 1.0: """
-    
-    def _extract_rank_from_response(self, response: str) -> Optional[float]:
-        """Извлекает числовую оценку из ответа LLM"""
-        try:
-            # Ищем число от 0.0 до 1.0 в ответе
-            import re
-            
-            # Паттерн для поиска числа от 0.0 до 1.0
-            pattern = r'([0-1]\.?\d*)'
-            matches = re.findall(pattern, response)
-            
-            if matches:
-                rank = float(matches[0])
-                # Убеждаемся что ранг в допустимых пределах
-                return max(0.0, min(1.0, rank))
-            
-            return None
-            
-        except (ValueError, IndexError):
-            return None
-    
     def get_ranked_comments(self, video_id: int, min_rank: float = 0.0) -> List[Dict]:
         """
         Получает проранжированные комментарии для видео
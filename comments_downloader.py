@@ -1,29 +1,16 @@
 import os
 import json
 import requests
-from youtube_comment_downloader import YoutubeCommentDownloader
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
-from models import Base, Video, Comment, Transcript
-from datetime import datetime
-from youtube_transcript_api import YouTubeTranscriptApi, TranscriptsDisabled, NoTranscriptFound
+from models import Video, Transcript, get_db_session
 from urllib.parse import urlparse, parse_qs
 import time
-
-def get_db_session():
-    db_host = os.getenv("DB_HOST", "localhost")
-    db_port = os.getenv("DB_PORT", "5432")
-    db_name = os.getenv("DB_NAME", "comments")
-    db_user = os.getenv("DB_USER", "postgres")
-    db_password = os.getenv("DB_PASSWORD", "postgres")
-    db_url = f"postgresql+psycopg2://{db_user}:{db_password}@{db_host}:{db_port}/{db_name}"
-    engine = create_engine(db_url)
-    Base.metadata.create_all(engine)
-    Session = sessionmaker(bind=engine)
-    return Session()
+from summarizer_client import SUMMARIZER_URL, stream_summary
+from rate_limit import youtube_downloader
+from transcript_engine import get_transcript
+from live_tail import comment_values, insert_comments
 
 def download_comments(video_url):
-    downloader = YoutubeCommentDownloader()
+    downloader = youtube_downloader()
     comments = []
     for i, comment in enumerate(downloader.get_comments_from_url(video_url), 1):
         comments.append(comment)
@@ -49,29 +36,9 @@ def save_to_db(video_url, comments):
         )
         session.add(video)
         session.commit()
-    # Сохраняем комментарии, избегая дубликатов
-    for c in comments:
-        # Проверяем, есть ли уже такой comment_id
-        exists = session.query(Comment).filter_by(comment_id=c.get('cid')).first()
-        if exists:
-            continue  # пропускаем дубликат
-        published_at = None
-        if c.get('time'):
-            try:
-                # updated_at: преобразуем в datetime, если возможно
-                published_at = datetime.strptime(c['time'], '%Y-%m-%dT%H:%M:%SZ')
-            except Exception:
-                published_at = None
-        comment = Comment(
-            comment_id=c.get('cid'),
-            video_id=video.id,
-            author=c.get('author'),
-            text=c.get('text'),
-            likes=c.get('likes', 0),
-            published_at=published_at,
-            parent_id=c.get('parent')
-        )
-        session.add(comment)
+    # Сохраняем комментарии с лайками, временем и родителем (они нужны порядку заметности
+    # при ранжировании); дубликаты comment_id пропускаются через ON CONFLICT
+    insert_comments(session, [comment_values(video.id, c) for c in comments])
     session.commit()
     session.close()
 
@@ -83,47 +50,40 @@ def extract_video_id(video_url):
         return parse_qs(parsed.query).get('v', [None])[0]
     return None
 
-def get_transcript(video_id):
-    try:
-        transcript = YouTubeTranscriptApi.get_transcript(video_id, languages=['ru', 'en'])
-        return " ".join([entry['text'] for entry in transcript])
-    except (TranscriptsDisabled, NoTranscriptFound):
-        print("❌ Субтитры не найдены")
-        return None
-    except Exception as e:
-        print(f"❌ Ошибка при получении транскрипта: {e}")
-        return None
-
-# Обновленная функция для генерации summary с помощью HTTP запроса к сервису суммаризации
+def save_partial_summary(chunk_event, partials, filename="summary.json"):
+    """Сохраняет готовые summary чанков, пока итоговое summary еще генерируется"""
+    partials[chunk_event["index"]] = chunk_event["summary"]
+    with open(filename, "w", encoding="utf-8") as f:
+        json.dump({
+            "summary": None,
+            "partial": True,
+            "chunks_done": len(partials),
+            "chunks_total": chunk_event["total"],
+            "chunk_summaries": [partials[i] for i in sorted(partials)],
+        }, f, ensure_ascii=False, indent=2)
+
+# Обновленная функция для генерации summary с помощью потокового запроса к сервису суммаризации
 def generate_summary(text):
     if not text:
         return None
     
-    summarizer_service_url = "http://summarizer-llm:8000/summarize"
-    print(f"Отправка текста на суммаризацию по адресу: {summarizer_service_url}")
+    print(f"Отправка текста на потоковую суммаризацию по адресу: {SUMMARIZER_URL}/summarize/stream")
     
-    max_retries = 3
-    for attempt in range(1, max_retries + 1):
-        try:
-            response = requests.post(summarizer_service_url, json={"text": text}, timeout=600)  # увеличен таймаут
-            response.raise_for_status() # Проверка на ошибки HTTP (4xx, 5xx)
-            summary_data = response.json()
-            summary = summary_data.get("summary")
-            if not summary:
-                print("⚠️ Сервис суммаризации вернул пустой результат.")
-                return None
-            return summary
-        except requests.exceptions.RequestException as e:
-            print(f"Попытка {attempt}/{max_retries}: Ошибка при обращении к сервису суммаризации: {e}")
-            if attempt < max_retries:
-                print("Повторная попытка через 10 секунд...")
-                time.sleep(10)
-            else:
-                print("Убедитесь, что сервис 'summarizer-llm' запущен и доступен по адресу http://summarizer-llm:8000")
-                return None
-        except Exception as e:
-            print(f"Неизвестная ошибка при генерации саммари: {e}")
+    try:
+        # Повторы при недоступности сервиса выполняет общий HTTP-клиент (backoff с jitter, Retry-After)
+        partials = {}
+        summary = stream_summary(text, on_chunk=lambda event: save_partial_summary(event, partials), timeout=600)
+        if not summary:
+            print("⚠️ Сервис суммаризации вернул пустой результат.")
             return None
+        return summary
+    except requests.exceptions.RequestException as e:
+        print(f"Ошибка при обращении к сервису суммаризации: {e}")
+        print("Убедитесь, что сервис 'summarizer-llm' запущен и доступен по адресу http://summarizer-llm:8000")
+        return None
+    except Exception as e:
+        print(f"Неизвестная ошибка при генерации саммари: {e}")
+        return None
 
 def main():
     video_url = os.environ.get("VIDEO_URL")
@@ -157,7 +117,12 @@ def main():
 
         if not transcript_text:
             print(f"Скачиваем транскрипт для video_id: {video_id}...")
-            transcript_text = get_transcript(video_id)
+            try:
+                transcript_text = get_transcript(video_id)
+            except Exception as e:
+                print(f"❌ Ошибка при получении транскрипта, повторите запуск позже: {e}")
+                session.close()
+                return
             if transcript_text:
                 new_transcript = Transcript(video_id=video.id, content=transcript_text)
                 session.add(new_transcript)
@@ -2,9 +2,9 @@ import google.generativeai as genai
 import time
 import random
 import os
-from typing import List, Dict, Optional
-from sqlalchemy.orm import Session
+from typing import List, Dict, Iterator, Optional, Tuple
 from models import Video, Comment, get_db_session
+from ranking_driver import CommentRow, RankingDriver, RankWindow, count_unranked
 
 class GeminiCommentRanker:
     """Система ранжирования комментариев с использованием Google Gemini API"""
@@ -54,39 +54,27 @@ class GeminiCommentRanker:
                 print(f"❌ У видео {video_id} нет summary для ранжирования")
                 return False
                 
-            # Получаем комментарии без ранга
-            comments = session.query(Comment).filter_by(
-                video_id=video_id, 
-                comment_rank=None
-            ).all()
+            # Считаем комментарии без ранга; сами тексты читаются окнами в RankingDriver
+            total = count_unranked(session, video_id)
             
-            if not comments:
+            if not total:
                 print(f"✅ Все комментарии для видео {video_id} уже проранжированы")
                 return True
+            video_summary = video.summary
+            session.expunge_all()
                 
-            print(f"🔄 Начинаю ранжирование {len(comments)} комментариев для видео {video_id}")
+            print(f"🔄 Начинаю ранжирование {total} комментариев для видео {video_id}")
             print(f"🤖 Используется: Google Gemini 2.0 Flash (контекст: ~1M токенов)")
             
-            # Проверяем доступность Gemini API
-            gemini_available = self._check_gemini_availability()
-            if not gemini_available and self.use_fallback:
-                print("⚠️ Gemini API недоступен, переключаюсь на эвристический алгоритм")
-                return self._fallback_rank_all_comments(comments, video.summary, session)
-            elif not gemini_available:
-                print("❌ Gemini API недоступен и fallback отключен")
+            window_ranker = self.make_window_ranker(video_summary)
+            if window_ranker is None:
                 return False
+            ranker_name, rank_window = window_ranker
             
-            # Пробуем обработать ВСЕ комментарии одним запросом
-            success = self._rank_all_comments_single_request(comments, video.summary, session)
-            
-            if success:
-                session.commit()
-                print(f"✅ Ранжирование завершено для видео {video_id}")
-                return True
-            else:
-                print("⚠️ Не удалось обработать все комментарии одним запросом, переключаюсь на батчи")
-                # Fallback к батчевой обработке
-                return self._rank_comments_in_batches(comments, video.summary, session)
+            driver = RankingDriver(session, video_id)
+            successful_ranks = driver.run(ranker_name, total, rank_window)
+            print(f"✅ Ранжирование завершено для видео {video_id}: {successful_ranks}/{total}")
+            return successful_ranks > 0
                 
         except Exception as e:
             print(f"❌ Ошибка при ранжировании комментариев: {e}")
@@ -95,6 +83,35 @@ class GeminiCommentRanker:
         finally:
             session.close()
     
+    def make_window_ranker(self, video_summary: str) -> Optional[Tuple[str, RankWindow]]:
+        """
+        Проверяет доступность Gemini API и готовит функцию ранжирования окна для RankingDriver
+        
+        Returns:
+            (имя ранжировщика, функция) или None, если Gemini недоступен и fallback отключен
+        """
+        gemini_available = self._check_gemini_availability()
+        if not gemini_available and not self.use_fallback:
+            print("❌ Gemini API недоступен и fallback отключен")
+            return None
+        if not gemini_available:
+            print("⚠️ Gemini API недоступен, переключаюсь на эвристический алгоритм")
+        
+        def rank_window(window: List[CommentRow]):
+            if not gemini_available:
+                yield from self._fallback_rank_all_comments(window, video_summary)
+                return
+            # Пробуем обработать все комментарии окна одним запросом
+            ranks = self._rank_all_comments_single_request(window, video_summary)
+            if ranks:
+                yield ranks
+            else:
+                print("⚠️ Не удалось обработать окно одним запросом, переключаюсь на батчи")
+                # Fallback к батчевой обработке
+                yield from self._rank_comments_in_batches(window, video_summary)
+        
+        return ("gemini" if gemini_available else "heuristic"), rank_window
+    
     def _check_gemini_availability(self) -> bool:
         """Проверяет доступность Gemini API"""
         try:
@@ -116,9 +133,9 @@ class GeminiCommentRanker:
             print(f"❌ Ошибка при проверке Gemini API: {e}")
             return False
     
-    def _process_batch(self, comments: List[Comment], video_summary: str, session: Session, gemini_available: bool) -> int:
-        """Обрабатывает батч комментариев"""
-        successful_ranks = 0
+    def _process_batch(self, comments: List[CommentRow], video_summary: str, gemini_available: bool) -> List[Tuple[int, float]]:
+        """Обрабатывает батч комментариев и возвращает пары (id комментария, ранг)"""
+        result = []
         
         if gemini_available:
             # Пробуем обработать весь батч одним запросом для эффективности
@@ -127,12 +144,11 @@ class GeminiCommentRanker:
                 if ranks and len(ranks) == len(comments):
                     for comment, rank in zip(comments, ranks):
                         if rank is not None:
-                            comment.comment_rank = rank
-                            successful_ranks += 1
+                            result.append((comment.id, rank))
                             print(f"📊 Комментарий ID {comment.id}: ранг {rank:.3f} (Gemini)")
                         else:
                             print(f"⚠️ Не удалось проранжировать комментарий ID {comment.id}")
-                    return successful_ranks
+                    return result
             except Exception as e:
                 print(f"⚠️ Ошибка батчевой обработки: {e}, переключаюсь на индивидуальную")
         
@@ -145,8 +161,7 @@ class GeminiCommentRanker:
                     rank = self._rank_single_comment_fallback(comment.text, video_summary)
                     
                 if rank is not None:
-                    comment.comment_rank = rank
-                    successful_ranks += 1
+                    result.append((comment.id, rank))
                     method = "Gemini" if gemini_available else "эвристика"
                     print(f"📊 Комментарий ID {comment.id}: ранг {rank:.3f} ({method})")
                 else:
@@ -155,9 +170,9 @@ class GeminiCommentRanker:
             except Exception as e:
                 print(f"❌ Ошибка при обработке комментария ID {comment.id}: {e}")
         
-        return successful_ranks
+        return result
     
-    def _rank_batch_gemini(self, comments: List[Comment], video_summary: str) -> Optional[List[float]]:
+    def _rank_batch_gemini(self, comments: List[CommentRow], video_summary: str) -> Optional[List[float]]:
         """Ранжирует батч комментариев одним запросом к Gemini"""
         try:
             # Создаем промпт для батчевой обработки
@@ -260,7 +275,7 @@ Rating criteria:
 
 Respond with only a number from 0.0 to 1.0:"""
     
-    def _create_batch_ranking_prompt(self, comments: List[Comment], video_summary: str) -> str:
+    def _create_batch_ranking_prompt(self, comments: List[CommentRow], video_summary: str) -> str:
         """Создает промпт для батчевого ранжирования"""
         comments_text = ""
         for i, comment in enumerate(comments, 1):
@@ -345,8 +360,8 @@ Respond with only the ratings separated by commas (e.g., 0.8, 0.3, 0.9, 0.1):"""
         finally:
             session.close()
     
-    def _rank_all_comments_single_request(self, comments: List[Comment], video_summary: str, session: Session) -> bool:
-        """Ранжирует ВСЕ комментарии одним запросом к Gemini"""
+    def _rank_all_comments_single_request(self, comments: List[CommentRow], video_summary: str) -> Optional[List[Tuple[int, float]]]:
+        """Ранжирует ВСЕ комментарии одним запросом к Gemini; возвращает пары (id комментария, ранг) или None"""
         try:
             print(f"📡 Отправляю все {len(comments)} комментариев одним запросом...")
             
@@ -378,16 +393,15 @@ Respond with only the ratings separated by commas (e.g., 0.8, 0.3, 0.9, 0.1):"""
                         
                         ranks = self._extract_mega_ranks_from_response(response.text, len(comments))
                         if ranks and len(ranks) == len(comments):
-                            # Применяем ранги к комментариям
-                            successful_ranks = 0
+                            # Сопоставляем ранги комментариям
+                            result = []
                             for comment, rank in zip(comments, ranks):
                                 if rank is not None:
-                                    comment.comment_rank = rank
-                                    successful_ranks += 1
+                                    result.append((comment.id, rank))
                                     print(f"📊 ID {comment.id}: {rank:.3f}")
                             
-                            print(f"✅ Успешно проранжировано: {successful_ranks}/{len(comments)} комментариев")
-                            return True
+                            print(f"✅ Успешно проранжировано: {len(result)}/{len(comments)} комментариев")
+                            return result
                         else:
                             print(f"⚠️ Получено {len(ranks) if ranks else 0} рангов, ожидалось {len(comments)}")
                     
@@ -396,13 +410,13 @@ Respond with only the ratings separated by commas (e.g., 0.8, 0.3, 0.9, 0.1):"""
                     if attempt < self.max_retries - 1:
                         time.sleep(2)
             
-            return False
+            return None
             
         except Exception as e:
             print(f"❌ Ошибка мега-ранжирования: {e}")
-            return False
+            return None
     
-    def _create_mega_ranking_prompt(self, comments: List[Comment], video_summary: str) -> str:
+    def _create_mega_ranking_prompt(self, comments: List[CommentRow], video_summary: str) -> str:
         """Создает мега-промпт для ранжирования всех комментариев"""
         comments_text = ""
         for i, comment in enumerate(comments, 1):
@@ -469,39 +483,29 @@ Ratings:"""
             print(f"❌ Ошибка извлечения мега-рангов: {e}")
             return None
     
-    def _rank_comments_in_batches(self, comments: List[Comment], video_summary: str, session: Session) -> bool:
-        """Fallback: ранжирование батчами при неудаче мега-запроса"""
+    def _rank_comments_in_batches(self, comments: List[CommentRow], video_summary: str) -> Iterator[List[Tuple[int, float]]]:
+        """Fallback: ранжирование батчами при неудаче мега-запроса; отдает ранги каждого батча"""
         print("🔄 Переключаюсь на батчевую обработку...")
         
-        successful_ranks = 0
         for i in range(0, len(comments), self.batch_size):
             batch = comments[i:i + self.batch_size]
-            batch_success = self._process_batch(batch, video_summary, session, True)
-            successful_ranks += batch_success
+            yield self._process_batch(batch, video_summary, True)
             time.sleep(0.5)  # Пауза между батчами
-            
-        session.commit()
-        print(f"✅ Батчевое ранжирование завершено: {successful_ranks}/{len(comments)}")
-        return successful_ranks > 0
     
-    def _fallback_rank_all_comments(self, comments: List[Comment], video_summary: str, session: Session) -> bool:
-        """Fallback: эвристическое ранжирование всех комментариев"""
+    def _fallback_rank_all_comments(self, comments: List[CommentRow], video_summary: str) -> Iterator[List[Tuple[int, float]]]:
+        """Fallback: эвристическое ранжирование комментариев; отдает ранги по батчам"""
         print("🔄 Использую эвристический алгоритм для всех комментариев...")
         
-        successful_ranks = 0
-        for comment in comments:
-            try:
-                rank = self._rank_single_comment_fallback(comment.text, video_summary)
-                comment.comment_rank = rank
-                successful_ranks += 1
-                print(f"📊 ID {comment.id}: {rank:.3f} (эвристика)")
-            except Exception as e:
-                print(f"❌ Ошибка при обработке комментария ID {comment.id}: {e}")
-        
-        session.commit()
-        print(f"✅ Эвристическое ранжирование завершено: {successful_ranks}/{len(comments)}")
-        return successful_ranks > 0
-
+        for i in range(0, len(comments), self.batch_size):
+            ranks = []
+            for comment in comments[i:i + self.batch_size]:
+                try:
+                    rank = self._rank_single_comment_fallback(comment.text, video_summary)
+                    ranks.append((comment.id, rank))
+                    print(f"📊 ID {comment.id}: {rank:.3f} (эвристика)")
+                except Exception as e:
+                    print(f"❌ Ошибка при обработке комментария ID {comment.id}: {e}")
+            yield ranks
 
 def main():
     """Основная функция для тестирования ранжирования с Gemini"""
@@ -0,0 +1,191 @@
+"""
+Суммаризация транскриптов любой длины через Gemini
+
+Если транскрипт помещается в бюджет одного запроса, он отправляется целиком.
+Иначе транскрипт режется на чанки по границам предложений, чанки суммаризируются
+параллельно, а их summary сводятся в итоговое одним запросом. Summary чанков и итоговые
+summary кэшируются на диске, поэтому повторная обработка видео не тратит квоту API.
+"""
+
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+import google.generativeai as genai
+
+from summarizer.chunker import approx_token_count, chunk_text
+from summarizer.summary_cache import SummaryCache
+
+GEMINI_SUMMARY_MODEL = 'gemini-2.0-flash-exp'
+# Сколько токенов транскрипта отправляется одним запросом; больше - параллельные чанки
+# (ограничено и контекстом модели: длинный одиночный запрос - это долгий ответ)
+GEMINI_SINGLE_CALL_TOKENS = int(os.getenv("GEMINI_SINGLE_CALL_TOKENS", "200000"))
+GEMINI_CHUNK_TOKENS = int(os.getenv("GEMINI_CHUNK_TOKENS", "30000"))
+GEMINI_CHUNK_OVERLAP_TOKENS = 200
+GEMINI_SUMMARY_WORKERS = int(os.getenv("GEMINI_SUMMARY_WORKERS", "4"))
+GEMINI_SUMMARY_CACHE_PATH = os.getenv(
+    "GEMINI_SUMMARY_CACHE_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache", "gemini_summary_cache.sqlite3"),
+)
+
+# Запас контекста под инструкцию и ответ модели
+PROMPT_RESERVE_TOKENS = 2000
+
+SUMMARY_PROMPT = """Создай краткое содержание (summary) этого видео на основе транскрипта.
+
+Требования:
+- Длина: 2-3 предложения
+- Язык: русский
+- Основные темы и ключевые моменты
+- Четкий и информативный стиль
+
+Транскрипт:
+{text}
+
+Summary:"""
+
+CHUNK_PROMPT = """Это часть {index} из {total} транскрипта видео. Перескажи ее содержание.
+
+Требования:
+- Длина: 3-5 предложений
+- Язык: русский
+- Темы, факты, выводы и примеры этой части, без вступлений
+
+Фрагмент транскрипта:
+{text}
+
+Пересказ:"""
+
+COMBINE_PROMPT = """Ниже пересказы последовательных частей транскрипта одного видео.
+Создай по ним краткое содержание (summary) всего видео.
+
+Требования:
+- Длина: 2-3 предложения
+- Язык: русский
+- Основные темы и ключевые моменты всего видео, а не только начала
+- Четкий и информативный стиль
+
+Пересказы частей:
+{text}
+
+Summary:"""
+
+
+class GeminiSummarizer:
+    """Суммаризация длинных транскриптов через Gemini с кэшированием summary чанков"""
+
+    def __init__(self, api_key: str = None, model_name: str = GEMINI_SUMMARY_MODEL,
+                 cache_path: str = GEMINI_SUMMARY_CACHE_PATH):
+        if api_key:
+            genai.configure(api_key=api_key)
+        elif os.getenv('GEMINI_API_KEY'):
+            genai.configure(api_key=os.getenv('GEMINI_API_KEY'))
+        else:
+            raise ValueError("Необходимо указать GEMINI_API_KEY")
+
+        self.model_name = model_name
+        self.model = genai.GenerativeModel(model_name)
+        self.cache = SummaryCache(cache_path)
+        self.single_call_tokens = min(GEMINI_SINGLE_CALL_TOKENS, self._context_window() - PROMPT_RESERVE_TOKENS)
+
+        self.summary_config = genai.types.GenerationConfig(
+            temperature=0.3,
+            max_output_tokens=200,
+            top_p=0.8
+        )
+        self.chunk_config = genai.types.GenerationConfig(
+            temperature=0.3,
+            max_output_tokens=400,
+            top_p=0.8
+        )
+
+    def _context_window(self) -> int:
+        """Размер контекста модели по данным API (1M токенов, если узнать не удалось)"""
+        try:
+            return genai.get_model(f"models/{self.model_name}").input_token_limit
+        except Exception as e:
+            print(f"⚠️ Не удалось получить размер контекста {self.model_name}: {e}")
+            return 1_000_000
+
+    def count_tokens(self, text: str) -> int:
+        """Точный подсчет токенов через API (грубая оценка, если запрос не удался)"""
+        try:
+            return self.model.count_tokens(text).total_tokens
+        except Exception as e:
+            print(f"⚠️ Не удалось посчитать токены через API: {e}")
+            return approx_token_count(text)
+
+    def summarize(self, transcript: str, cancel: Optional[threading.Event] = None) -> Optional[str]:
+        """
+        Генерирует summary транскрипта любой длины
+
+        Args:
+            transcript: Полный транскрипт видео
+            cancel: Событие отмены - еще не отправленные запросы чанков не выполняются
+
+        Returns:
+            str: summary видео или None, если модель вернула пустой ответ
+
+        Raises:
+            Exception: ошибки Gemini API - решение о fallback остается за вызывающим кодом
+        """
+        start = time.time()
+        tokens = self.count_tokens(transcript)
+        if tokens <= self.single_call_tokens:
+            print(f"📄 Транскрипт ({tokens} токенов) помещается в один запрос")
+            return self._cached_generate(SUMMARY_PROMPT, transcript, self.summary_config, "summary")
+
+        # Чанки режутся по грубой оценке: точный подсчет - это запрос к API на каждое предложение
+        chunks = chunk_text(transcript, approx_token_count, GEMINI_CHUNK_TOKENS, GEMINI_CHUNK_OVERLAP_TOKENS)
+        print(f"📚 Транскрипт ({tokens} токенов) разбит на {len(chunks)} чанков, "
+              f"суммаризирую в {GEMINI_SUMMARY_WORKERS} потоков...")
+        summaries = self._summarize_chunks(chunks, cancel)
+        if cancel is not None and cancel.is_set():
+            return None
+        parts = "\n\n".join(f"Часть {idx}: {summary}" for idx, summary in enumerate(summaries, 1) if summary)
+        if not parts:
+            return None
+        summary = self._cached_generate(COMBINE_PROMPT, parts, self.summary_config, "combine")
+        print(f"[DEBUG] Суммаризация {len(chunks)} чанков заняла {time.time() - start:.2f} сек")
+        return summary
+
+    def _summarize_chunks(self, chunks: List[str], cancel: Optional[threading.Event] = None) -> List[Optional[str]]:
+        def summarize_chunk(idx):
+            if cancel is not None and cancel.is_set():
+                return None
+            # Номер части входит в шаблон промпта, а значит и в ключ кэша
+            template = CHUNK_PROMPT.replace("{index}", str(idx + 1)).replace("{total}", str(len(chunks)))
+            return self._cached_generate(template, chunks[idx], self.chunk_config, f"chunk {idx+1}/{len(chunks)}")
+
+        with ThreadPoolExecutor(max_workers=GEMINI_SUMMARY_WORKERS) as executor:
+            return list(executor.map(summarize_chunk, range(len(chunks))))
+
+    def _cached_generate(self, template: str, text: str, config, label: str) -> Optional[str]:
+        key = SummaryCache.make_key(self.model_name, template, text)
+        cached = self.cache.get(key)
+        if cached is not None:
+            print(f"💾 {label}: из кэша")
+            return cached
+
+        response = self.model.generate_content(template.replace("{text}", text), generation_config=config)
+        if not response or not response.text:
+            print(f"⚠️ {label}: пустой ответ Gemini")
+            return None
+        summary = response.text.strip()
+        self.cache.put(key, summary)
+        print(f"✅ {label}: {len(summary)} символов")
+        return summary
+
+
+_summarizers: Dict[Optional[str], GeminiSummarizer] = {}
+_summarizers_lock = threading.Lock()
+
+
+def gemini_summarizer(api_key: Optional[str] = None) -> GeminiSummarizer:
+    """Общий суммаризатор процесса: модель, размер контекста и подключение к кэшу создаются один раз"""
+    with _summarizers_lock:
+        if api_key not in _summarizers:
+            _summarizers[api_key] = GeminiSummarizer(api_key=api_key)
+        return _summarizers[api_key]
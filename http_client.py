@@ -0,0 +1,218 @@
+"""
+Общий HTTP-клиент для всех исходящих запросов к сервисам (summarizer-llm и др.)
+
+- keep-alive пул соединений (один requests.Session на процесс)
+- ограничение числа одновременных запросов к одному хосту (паузы перед повтором слот не занимают)
+- повторы с экспоненциальной задержкой и jitter, с учетом заголовка Retry-After
+- метрики задержек по endpoint
+"""
+
+import os
+import random
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from email.utils import parsedate_to_datetime
+from typing import Dict, Iterator, Optional
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", "20"))
+HTTP_MAX_PER_HOST = int(os.getenv("HTTP_MAX_PER_HOST", "8"))
+HTTP_MAX_RETRIES = int(os.getenv("HTTP_MAX_RETRIES", "3"))
+HTTP_BACKOFF_BASE = 1.0   # задержка перед первым повтором (сек), дальше удваивается
+HTTP_BACKOFF_MAX = 30.0
+HTTP_RETRY_AFTER_MAX = 120.0  # Retry-After больше этого значения не ждем
+
+# Статусы, при которых запрос имеет смысл повторить
+RETRY_STATUSES = (429, 502, 503, 504)
+
+
+class EndpointStats:
+    """Задержки и ошибки запросов к одному endpoint"""
+
+    def __init__(self, window: int = 500):
+        self.requests = 0
+        self.errors = 0
+        self.retries = 0
+        self.latencies = deque(maxlen=window)
+        # Счетчики обновляют все потоки, которые обращаются к endpoint
+        self._lock = threading.Lock()
+
+    def record(self, latency: Optional[float] = None, error: bool = False):
+        """Учитывает попытку запроса: latency - если ответ получен"""
+        with self._lock:
+            self.requests += 1
+            if error:
+                self.errors += 1
+            if latency is not None:
+                self.latencies.append(latency)
+
+    def record_retry(self):
+        with self._lock:
+            self.retries += 1
+
+    def percentile(self, q: float) -> Optional[float]:
+        with self._lock:
+            samples = sorted(self.latencies)
+        if not samples:
+            return None
+        return samples[min(len(samples) - 1, int(len(samples) * q / 100))]
+
+    def as_dict(self) -> Dict:
+        with self._lock:
+            requests_count, errors, retries = self.requests, self.errors, self.retries
+            latency_max = max(self.latencies) if self.latencies else None
+        return {
+            "requests": requests_count,
+            "errors": errors,
+            "retries": retries,
+            "p50": self.percentile(50),
+            "p95": self.percentile(95),
+            "max": latency_max,
+        }
+
+
+class HttpClient:
+    """Пул соединений с лимитом на хост, повторами и метриками задержек"""
+
+    def __init__(self, pool_size: int = HTTP_POOL_SIZE, max_per_host: int = HTTP_MAX_PER_HOST,
+                 max_retries: int = HTTP_MAX_RETRIES):
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.max_per_host = max_per_host
+        self.max_retries = max_retries
+        self._host_limits: Dict[str, threading.BoundedSemaphore] = {}
+        self._stats: Dict[str, EndpointStats] = {}
+        self._lock = threading.Lock()
+
+    def _host_limit(self, url: str) -> threading.BoundedSemaphore:
+        host = urlparse(url).netloc
+        with self._lock:
+            if host not in self._host_limits:
+                self._host_limits[host] = threading.BoundedSemaphore(self.max_per_host)
+            return self._host_limits[host]
+
+    def _endpoint_stats(self, endpoint: str) -> EndpointStats:
+        with self._lock:
+            return self._stats.setdefault(endpoint, EndpointStats())
+
+    @staticmethod
+    def retry_after(response: requests.Response) -> Optional[float]:
+        """Задержка из заголовка Retry-After (секунды или HTTP-дата)"""
+        value = response.headers.get("Retry-After")
+        if not value:
+            return None
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            pass
+        try:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+        except (TypeError, ValueError):
+            return None
+
+    @staticmethod
+    def backoff(attempt: int) -> float:
+        """Экспоненциальная задержка с full jitter: случайное значение от 0 до base * 2^attempt"""
+        return random.uniform(0, min(HTTP_BACKOFF_MAX, HTTP_BACKOFF_BASE * 2 ** attempt))
+
+    def _send(self, method: str, url: str, endpoint: str, retries: int,
+              slot: threading.BoundedSemaphore, **kwargs) -> requests.Response:
+        """
+        Запрос с повторами. Слот хоста занимается на каждую попытку и освобождается на время
+        паузы перед повтором (долгий Retry-After не блокирует другие потоки этого хоста).
+        Возвращенный ответ держит слот - его освобождает вызывающий код
+        """
+        stats = self._endpoint_stats(endpoint)
+        attempt = 0
+        while True:
+            slot.acquire()
+            start = time.time()
+            try:
+                response = self.session.request(method, url, **kwargs)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                slot.release()
+                stats.record(error=True)
+                if attempt >= retries:
+                    raise
+                delay = self.backoff(attempt)
+                print(f"🔁 {endpoint}: {type(e).__name__}, повтор {attempt + 1}/{retries} через {delay:.1f} сек")
+            except BaseException:
+                slot.release()
+                raise
+            else:
+                latency = time.time() - start
+                if response.status_code not in RETRY_STATUSES or attempt >= retries:
+                    stats.record(latency, error=response.status_code >= 400)
+                    return response
+                stats.record(latency, error=True)
+                retry_after = self.retry_after(response)
+                delay = min(retry_after, HTTP_RETRY_AFTER_MAX) if retry_after is not None else self.backoff(attempt)
+                response.close()
+                slot.release()
+                print(f"🔁 {endpoint}: статус {response.status_code}, повтор {attempt + 1}/{retries} через {delay:.1f} сек")
+            stats.record_retry()
+            attempt += 1
+            time.sleep(delay)
+
+    def request(self, method: str, url: str, retries: Optional[int] = None,
+                endpoint: Optional[str] = None, **kwargs) -> requests.Response:
+        """
+        Выполняет запрос через общий пул соединений
+
+        Args:
+            retries: Сколько раз повторить при ошибке соединения, таймауте или статусе 429/5xx
+                (None - значение клиента по умолчанию)
+            endpoint: Имя endpoint для метрик (по умолчанию "METHOD host/path")
+
+        Returns:
+            requests.Response: ответ (в том числе с ошибочным статусом после исчерпания повторов)
+
+        Raises:
+            requests.exceptions.RequestException: если соединение так и не удалось
+        """
+        endpoint = endpoint or f"{method.upper()} {urlparse(url).netloc}{urlparse(url).path}"
+        retries = self.max_retries if retries is None else retries
+        slot = self._host_limit(url)
+        response = self._send(method, url, endpoint, retries, slot, **kwargs)
+        # Тело ответа уже прочитано (не stream) - слот больше не нужен
+        slot.release()
+        return response
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url: str, **kwargs) -> requests.Response:
+        return self.request("POST", url, **kwargs)
+
+    @contextmanager
+    def stream(self, method: str, url: str, retries: Optional[int] = None,
+               endpoint: Optional[str] = None, **kwargs) -> Iterator[requests.Response]:
+        """
+        Потоковый запрос: слот хоста занят, пока читается тело ответа.
+        Повторяется только установка соединения - до получения первых данных
+        """
+        endpoint = endpoint or f"{method.upper()} {urlparse(url).netloc}{urlparse(url).path}"
+        retries = self.max_retries if retries is None else retries
+        slot = self._host_limit(url)
+        response = self._send(method, url, endpoint, retries, slot, stream=True, **kwargs)
+        try:
+            yield response
+        finally:
+            response.close()
+            slot.release()
+
+    def stats(self) -> Dict[str, Dict]:
+        """Метрики по endpoint: количество запросов, ошибок, повторов и перцентили задержки (сек)"""
+        with self._lock:
+            return {endpoint: stats.as_dict() for endpoint, stats in self._stats.items()}
+
+
+# Общий клиент процесса: все модули используют один пул соединений
+shared_client = HttpClient()
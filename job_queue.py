@@ -0,0 +1,211 @@
+"""
+Очередь заданий на обработку видео поверх PostgreSQL (без внешнего брокера)
+
+Воркеры на любых узлах забирают задания из таблицы jobs через
+SELECT ... FOR UPDATE SKIP LOCKED, поэтому одно задание достается ровно одному воркеру.
+Взятое задание закреплено за воркером арендой (lease), которую продлевает heartbeat;
+если воркер упал, аренда истекает и задание забирает другой воркер. Ошибки повторяются
+с экспоненциальной задержкой, после max_attempts задание переходит в статус dead.
+Пройденные этапы сохраняются в jobs.stage - повтор продолжает с места ошибки.
+"""
+
+import os
+import socket
+import threading
+import time
+import traceback
+from datetime import timedelta
+from typing import Callable, List, Optional
+
+from sqlalchemy import and_, func, or_
+from sqlalchemy.orm import Session
+
+from models import Job, get_db_session, process_session_factory
+
+# Этапы пайплайна в порядке выполнения (методы VideoProcessor.stage_*)
+STAGES = ("ingest", "transcript", "summary", "rank")
+
+JOB_LEASE_SECONDS = int(os.getenv("JOB_LEASE_SECONDS", "300"))
+JOB_HEARTBEAT_SECONDS = int(os.getenv("JOB_HEARTBEAT_SECONDS", "60"))
+JOB_RETRY_BASE_SECONDS = 30
+JOB_RETRY_MAX_SECONDS = 3600
+JOB_POLL_SECONDS = float(os.getenv("JOB_POLL_SECONDS", "5"))
+
+
+def worker_id() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def enqueue(session: Session, video_url: str, max_attempts: int = 5) -> Job:
+    """Ставит видео в очередь (если по этому URL уже есть незавершенное задание - возвращает его)"""
+    job = session.query(Job).filter(
+        Job.video_url == video_url,
+        Job.status.in_(("queued", "running")),
+    ).first()
+    if job:
+        return job
+    job = Job(video_url=video_url, status="queued", stage=STAGES[0], max_attempts=max_attempts)
+    session.add(job)
+    session.commit()
+    return job
+
+
+def claim_job(session: Session, owner: str) -> Optional[Job]:
+    """
+    Забирает следующее готовое задание: из очереди или с истекшей арендой (воркер упал).
+    SKIP LOCKED пропускает строки, которые в этот момент забирают другие воркеры
+    """
+    job = session.query(Job).filter(or_(
+        and_(Job.status == "queued", Job.run_after <= func.now()),
+        and_(Job.status == "running", Job.lease_expires_at < func.now()),
+    )).order_by(Job.run_after, Job.id).with_for_update(skip_locked=True).first()
+    if job is None:
+        session.rollback()
+        return None
+    if job.status == "running":
+        print(f"♻️ Задание {job.id}: аренда {job.lease_owner} истекла, забираю")
+    job.status = "running"
+    job.lease_owner = owner
+    job.lease_expires_at = func.now() + timedelta(seconds=JOB_LEASE_SECONDS)
+    job.attempts += 1
+    session.commit()
+    return job
+
+
+def extend_lease(session: Session, job_id: int, owner: str) -> bool:
+    """Продлевает аренду; False - задание уже забрал другой воркер"""
+    updated = session.query(Job).filter(
+        Job.id == job_id, Job.lease_owner == owner, Job.status == "running"
+    ).update({Job.lease_expires_at: func.now() + timedelta(seconds=JOB_LEASE_SECONDS)},
+             synchronize_session=False)
+    session.commit()
+    return updated == 1
+
+
+def retry_delay(attempts: int) -> int:
+    """Экспоненциальная задержка перед повтором: 30 с, 1 мин, 2 мин ... до 1 ч"""
+    return min(JOB_RETRY_MAX_SECONDS, JOB_RETRY_BASE_SECONDS * 2 ** max(0, attempts - 1))
+
+
+def fail_job(session: Session, job: Job, error: str):
+    """Откладывает задание на повтор или переводит в dead после max_attempts попыток"""
+    job.last_error = error[-4000:]
+    job.lease_owner = None
+    job.lease_expires_at = None
+    if job.attempts >= job.max_attempts:
+        job.status = "dead"
+        job.finished_at = func.now()
+        print(f"💀 Задание {job.id} переведено в dead после {job.attempts} попыток")
+    else:
+        delay = retry_delay(job.attempts)
+        job.status = "queued"
+        job.run_after = func.now() + timedelta(seconds=delay)
+        print(f"🔁 Задание {job.id}: повтор через {delay} сек (попытка {job.attempts}/{job.max_attempts})")
+    session.commit()
+
+
+class Heartbeat(threading.Thread):
+    """Фоновое продление аренды задания (или шарда ранжирования - через extend), пока воркер его выполняет"""
+
+    def __init__(self, job_id: int, owner: str,
+                 extend: Callable[[Session, int, str], bool] = extend_lease,
+                 session_factory: Callable[[], Session] = get_db_session):
+        super().__init__(daemon=True)
+        self.job_id = job_id
+        self.owner = owner
+        self.extend = extend
+        # Воркеры передают фабрику своего процесса: без нее каждый heartbeat создавал бы свой engine
+        self.session_factory = session_factory
+        self.lost = threading.Event()  # аренду перехватил другой воркер
+        self._halt = threading.Event()
+
+    def run(self):
+        session = self.session_factory()
+        try:
+            while not self._halt.wait(JOB_HEARTBEAT_SECONDS):
+                try:
+                    if not self.extend(session, self.job_id, self.owner):
+                        print(f"⚠️ Задание {self.job_id}: аренда потеряна")
+                        self.lost.set()
+                        return
+                except Exception as e:
+                    session.rollback()
+                    print(f"⚠️ Не удалось продлить аренду задания {self.job_id}: {e}")
+        finally:
+            session.close()
+
+    def stop(self):
+        self._halt.set()
+
+
+class Worker:
+    """Воркер пайплайна: забирает задания и выполняет этапы VideoProcessor"""
+
+    def __init__(self, gemini_api_key: str = None, poll_interval: float = JOB_POLL_SECONDS):
+        self.gemini_api_key = gemini_api_key or os.getenv('GEMINI_API_KEY')
+        self.poll_interval = poll_interval
+        self.owner = worker_id()
+        # Один engine на процесс воркера: сессии заданий, heartbeat и ранжировщиков (get_db_session) берутся из его пула
+        self.session_factory = process_session_factory()
+        self.session = self.session_factory()
+
+    def run(self, once: bool = False):
+        """Основной цикл; once - обработать не больше одного задания и выйти"""
+        print(f"👷 Воркер {self.owner} запущен (аренда {JOB_LEASE_SECONDS} сек)")
+        while True:
+            job = claim_job(self.session, self.owner)
+            if job is None:
+                if once:
+                    return
+                time.sleep(self.poll_interval)
+                continue
+            self.process(job)
+            if once:
+                return
+
+    def process(self, job: Job):
+        # Импорт здесь: VideoProcessor тянет зависимости загрузки и ранжирования
+        from process_video import VideoProcessor
+
+        print(f"\n📦 Задание {job.id}: {job.video_url} (этап {job.stage}, попытка {job.attempts}/{job.max_attempts})")
+        heartbeat = Heartbeat(job.id, self.owner, session_factory=self.session_factory)
+        heartbeat.start()
+        processor = VideoProcessor(self.gemini_api_key, session=self.session_factory())
+        try:
+            for stage in STAGES[STAGES.index(job.stage):]:
+                if heartbeat.lost.is_set():
+                    print(f"⏹️ Задание {job.id} выполняет другой воркер, прекращаю")
+                    return
+                print(f"▶️ Задание {job.id}: этап {stage}")
+                if stage == "ingest":
+                    job.video_id = processor.stage_ingest(job.video_url)
+                else:
+                    getattr(processor, f"stage_{stage}")(job.video_id)
+                # Этап пройден: следующая попытка продолжит со следующего
+                next_index = STAGES.index(stage) + 1
+                job.stage = STAGES[next_index] if next_index < len(STAGES) else stage
+                self.session.commit()
+            if heartbeat.lost.is_set():
+                return
+            job.status = "done"
+            job.lease_owner = None
+            job.lease_expires_at = None
+            job.finished_at = func.now()
+            self.session.commit()
+            print(f"✅ Задание {job.id} выполнено")
+        except Exception as e:
+            print(f"❌ Задание {job.id}, этап {job.stage}: {e}")
+            processor.session.rollback()
+            self.session.rollback()
+            if not heartbeat.lost.is_set():
+                fail_job(self.session, job, f"{type(e).__name__}: {e}\n{traceback.format_exc()}")
+        finally:
+            heartbeat.stop()
+            processor.session.close()
+
+
+def list_jobs(session: Session, status: Optional[str] = None, limit: int = 50) -> List[Job]:
+    query = session.query(Job)
+    if status:
+        query = query.filter(Job.status == status)
+    return query.order_by(Job.id.desc()).limit(limit).all()
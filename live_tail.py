@@ -0,0 +1,304 @@
+"""
+Режим слежения за комментариями премьер и трансляций (live tail)
+
+Вместо однократной загрузки всех комментариев видео периодически опрашивается
+лента новых комментариев (SORT_BY_RECENT): опрос останавливается на уже виденных,
+новые комментарии сразу сохраняются (дедупликация - ON CONFLICT по comment_id)
+и ранжируются, а скользящий топ-N видео обновляется инкрементально.
+Интервал опроса подстраивается под скорость комментариев; когда поток затихает,
+слежение останавливается само. Память ограничена: кэш виденных comment_id,
+топ-N и не больше TAIL_MAX_PER_POLL комментариев за опрос.
+"""
+
+import heapq
+import os
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+from youtube_comment_downloader import SORT_BY_RECENT
+
+from models import Comment, Video, get_db_session
+from rank_store import RankStore
+from ranking_driver import CommentRow, count_unranked
+from ranking_shards import build_ranker
+from rate_limit import youtube_downloader
+
+TAIL_MIN_INTERVAL = float(os.getenv("TAIL_MIN_INTERVAL", "5"))
+TAIL_MAX_INTERVAL = float(os.getenv("TAIL_MAX_INTERVAL", "120"))
+TAIL_TARGET_BATCH = 20  # интервал подбирается так, чтобы за опрос приходило ~столько комментариев
+TAIL_MAX_PER_POLL = 2000
+TAIL_SEEN_CACHE = 50000  # comment_id, которые помним для остановки опроса
+TAIL_SEEN_STOP = 3  # столько виденных комментариев верхнего уровня подряд - дальше только старые
+TAIL_TOP_N = int(os.getenv("TAIL_TOP_N", "20"))
+COMMENT_INSERT_BATCH = 1000  # строк в одном INSERT
+# Слежение останавливается, когда скорость ниже TAIL_STOP_VELOCITY комментариев в минуту
+# и новых комментариев не было TAIL_IDLE_STOP секунд
+TAIL_STOP_VELOCITY = float(os.getenv("TAIL_STOP_VELOCITY", "1"))
+TAIL_IDLE_STOP = float(os.getenv("TAIL_IDLE_STOP", "600"))
+VELOCITY_ALPHA = 0.3  # вес последнего опроса в скользящей средней скорости
+
+
+def parse_votes(votes) -> int:
+    """Лайки из строки загрузчика: "15", "1.2K", "3M" """
+    if isinstance(votes, int):
+        return votes
+    value = str(votes or "0").strip().replace(",", ".").upper()
+    multiplier = 1
+    if value.endswith("K"):
+        multiplier, value = 1000, value[:-1]
+    elif value.endswith("M"):
+        multiplier, value = 1000000, value[:-1]
+    try:
+        return int(float(value) * multiplier)
+    except ValueError:
+        return 0
+
+
+def comment_values(video_id: int, comment: Dict) -> Dict:
+    """Строка таблицы comments из комментария youtube_comment_downloader"""
+    published_at = None
+    if comment.get("time_parsed"):
+        published_at = datetime.fromtimestamp(comment["time_parsed"], tz=timezone.utc).replace(tzinfo=None)
+    cid = comment["cid"]
+    return {
+        "comment_id": cid,
+        "video_id": video_id,
+        "author": comment.get("author"),
+        "text": comment.get("text") or "",
+        "likes": parse_votes(comment.get("votes")),
+        "published_at": published_at,
+        # cid ответа: "<cid родителя>.<id ответа>"
+        "parent_id": cid.split(".")[0] if comment.get("reply") else None,
+    }
+
+
+def insert_comments(session: Session, rows: List[Dict]) -> List[Tuple[int, str]]:
+    """
+    Вставляет строки comments, пропуская уже сохраненные comment_id (ON CONFLICT DO NOTHING) -
+    в том числе повторы внутри одной загрузки, например закрепленный комментарий на двух страницах.
+    Возвращает (id, text) действительно вставленных; коммит - за вызывающим
+    """
+    inserted = []
+    for i in range(0, len(rows), COMMENT_INSERT_BATCH):
+        stmt = insert(Comment).values(rows[i:i + COMMENT_INSERT_BATCH])
+        stmt = stmt.on_conflict_do_nothing(index_elements=[Comment.comment_id]).returning(Comment.id, Comment.text)
+        inserted.extend(session.execute(stmt).all())
+    return inserted
+
+
+class SeenCache:
+    """Последние TAIL_SEEN_CACHE comment_id (LRU)"""
+
+    def __init__(self, size: int = TAIL_SEEN_CACHE):
+        self.size = size
+        self._ids: "OrderedDict[str, None]" = OrderedDict()
+
+    def __contains__(self, cid: str) -> bool:
+        return cid in self._ids
+
+    def add(self, cid: str):
+        self._ids[cid] = None
+        self._ids.move_to_end(cid)
+        if len(self._ids) > self.size:
+            self._ids.popitem(last=False)
+
+
+class RollingTop:
+    """Скользящий топ-N комментариев видео по рангу: min-куча, обновление за O(log N)"""
+
+    def __init__(self, size: int = TAIL_TOP_N):
+        self.size = size
+        self._heap: List[Tuple[float, int, str]] = []
+
+    def offer(self, rank: float, comment_id: int, text: str) -> bool:
+        """Добавляет комментарий; True - топ изменился"""
+        item = (rank, comment_id, text[:200])
+        if len(self._heap) < self.size:
+            heapq.heappush(self._heap, item)
+            return True
+        if item > self._heap[0]:
+            heapq.heapreplace(self._heap, item)
+            return True
+        return False
+
+    def items(self) -> List[Tuple[float, int, str]]:
+        return sorted(self._heap, reverse=True)
+
+
+class LiveTail:
+    """Слежение за новыми комментариями одного видео"""
+
+    def __init__(self, youtube_id: str, db_video_id: int, gemini_api_key: str = None, top_n: int = TAIL_TOP_N):
+        self.youtube_id = youtube_id
+        self.db_video_id = db_video_id
+        self.gemini_api_key = gemini_api_key or os.getenv('GEMINI_API_KEY')
+        self.session: Session = get_db_session()
+        self.downloader = youtube_downloader()
+        self.store = RankStore(self.session)
+        self.seen = SeenCache()
+        self.top = RollingTop(top_n)
+        self.velocity: Optional[float] = None  # комментариев в секунду (скользящая средняя)
+        self.interval = TAIL_MIN_INTERVAL
+        self.last_fetched = 0  # комментариев прочитано последним опросом (для оценки числа запросов)
+
+    def run(self, max_duration: Optional[float] = None) -> int:
+        """
+        Следит за комментариями, пока поток не затихнет (или max_duration секунд)
+
+        Returns:
+            int: Сколько новых комментариев сохранено
+        """
+        summary = self.session.query(Video.summary).filter(Video.id == self.db_video_id).scalar()
+        if not summary:
+            raise RuntimeError(f"У видео {self.db_video_id} нет summary для ранжирования")
+        window_ranker = build_ranker(self.gemini_api_key).make_window_ranker(summary)
+        if window_ranker is None:
+            raise RuntimeError("Ранжировщик недоступен")
+        ranker_name, rank_window = window_ranker
+        run_id = self.store.start_run(self.db_video_id, ranker_name, count_unranked(self.session, self.db_video_id))
+        if not self._load_state():
+            # Комментарии сохранены без comment_id - дедупликация по нему невозможна, запоминаем текущую ленту
+            print("⚠️ У сохраненных комментариев нет comment_id: первый опрос только запоминает ленту")
+            self.poll()
+
+        print(f"📡 Слежу за комментариями видео {self.youtube_id} (ID {self.db_video_id})")
+        started_at = last_poll = last_new_at = time.time()
+        total = 0
+        try:
+            while True:
+                comments = self.poll()
+                now = time.time()
+                self._update_velocity(len(comments), now - last_poll)
+                last_poll = now
+                if comments:
+                    last_new_at = now
+                    rows = self.ingest(comments)
+                    total += len(rows)
+                    self.rank(run_id, rows, rank_window)
+                    print(f"📥 +{len(rows)} комментариев (всего {total}), скорость "
+                          f"{self.velocity * 60:.1f}/мин, следующий опрос через {self.interval:.0f} сек")
+
+                if self.velocity * 60 < TAIL_STOP_VELOCITY and now - last_new_at >= TAIL_IDLE_STOP:
+                    print(f"🛑 Поток комментариев затих ({self.velocity * 60:.2f}/мин) - слежение остановлено")
+                    break
+                if max_duration and now - started_at >= max_duration:
+                    print("🛑 Достигнута максимальная длительность слежения")
+                    break
+                time.sleep(self.interval)
+            self.store.finish_run(run_id)
+        except Exception as e:
+            self.store.fail_run(run_id, str(e))
+            raise
+        finally:
+            self.session.close()
+        return total
+
+    def fetch_new(self) -> int:
+        """Однократная дозагрузка новых комментариев без ранжирования (для recrawl_scheduler.py)"""
+        try:
+            if not self._load_state():
+                print("⚠️ У сохраненных комментариев нет comment_id: опрос только запоминает ленту")
+                self.poll()
+                return 0
+            comments = self.poll()
+            return len(self.ingest(comments)) if comments else 0
+        finally:
+            self.session.close()
+
+    def _load_state(self) -> bool:
+        """
+        Кэш последних comment_id и топ из уже сохраненных комментариев
+
+        Returns:
+            bool: False, если у видео есть комментарии, но ни у одного нет comment_id
+        """
+        cids = self.session.query(Comment.comment_id).filter(
+            Comment.video_id == self.db_video_id, Comment.comment_id.isnot(None)
+        ).order_by(Comment.id.desc()).limit(self.seen.size).all()
+        # Кэш заполняется от старых к новым: вытесняться должны старые
+        for (cid,) in reversed(cids):
+            self.seen.add(cid)
+        for rank, comment_id, text in self.session.query(Comment.comment_rank, Comment.id, Comment.text).filter(
+            Comment.video_id == self.db_video_id, Comment.comment_rank.isnot(None)
+        ).order_by(Comment.comment_rank.desc()).limit(self.top.size):
+            self.top.offer(rank, comment_id, text or "")
+        return bool(cids) or not self.session.query(Comment.id).filter(Comment.video_id == self.db_video_id).first()
+
+    def poll(self) -> List[Dict]:
+        """Новые комментарии с начала ленты (новые первыми) до первых уже виденных"""
+        new = []
+        seen_in_row = 0
+        self.last_fetched = 0
+        for comment in self.downloader.get_comments(self.youtube_id, sort_by=SORT_BY_RECENT):
+            self.last_fetched += 1
+            if comment["cid"] in self.seen:
+                if not comment.get("reply"):
+                    seen_in_row += 1
+                    if seen_in_row >= TAIL_SEEN_STOP:
+                        break
+                continue
+            if not comment.get("reply"):
+                seen_in_row = 0
+            self.seen.add(comment["cid"])
+            new.append(comment)
+            if len(new) >= TAIL_MAX_PER_POLL:
+                break
+        return new
+
+    def ingest(self, comments: List[Dict]) -> List[CommentRow]:
+        """Сохраняет комментарии, пропуская уже сохраненные; возвращает действительно новые"""
+        inserted = insert_comments(self.session, [comment_values(self.db_video_id, c) for c in comments])
+        rows = [CommentRow(comment_id, text) for comment_id, text in inserted]
+        self.session.commit()
+        return rows
+
+    def rank(self, run_id: int, rows: List[CommentRow], rank_window):
+        """Ранжирует новые комментарии, сохраняет ранги по батчам и обновляет топ"""
+        texts = {row.id: row.text for row in rows}
+        changed = False
+        for ranks in rank_window(rows):
+            self.store.save_batch(run_id, ranks)
+            for comment_id, rank in ranks:
+                changed |= self.top.offer(rank, comment_id, texts[comment_id])
+        if changed:
+            self.print_top()
+
+    def print_top(self, limit: int = 5):
+        print(f"🏆 Топ видео {self.db_video_id}:")
+        for i, (rank, comment_id, text) in enumerate(self.top.items()[:limit], 1):
+            print(f"   {i}. {rank:.3f} [ID {comment_id}] {text[:80]}")
+
+    def _update_velocity(self, new_count: int, elapsed: float):
+        """Скользящая средняя скорости и следующий интервал опроса"""
+        rate = new_count / max(elapsed, 1e-3)
+        self.velocity = rate if self.velocity is None else VELOCITY_ALPHA * rate + (1 - VELOCITY_ALPHA) * self.velocity
+        if new_count == 0:
+            self.interval = min(TAIL_MAX_INTERVAL, self.interval * 1.5)
+        elif self.velocity > 0:
+            self.interval = min(TAIL_MAX_INTERVAL, max(TAIL_MIN_INTERVAL, TAIL_TARGET_BATCH / self.velocity))
+
+
+def tail_video(video_url: str, gemini_api_key: Optional[str] = None, top_n: int = TAIL_TOP_N,
+               max_duration: Optional[float] = None) -> int:
+    """
+    Готовит видео обычными этапами пайплайна (ingest, transcript, summary, rank)
+    и следит за новыми комментариями
+    """
+    from process_video import VideoProcessor
+
+    processor = VideoProcessor(gemini_api_key)
+    try:
+        youtube_id = processor._extract_video_id(video_url)
+        if not youtube_id:
+            raise ValueError(f"Не удалось извлечь video_id из URL: {video_url}")
+        db_video_id = processor.stage_ingest(video_url)
+        processor.stage_transcript(db_video_id)
+        processor.stage_summary(db_video_id)
+        processor.stage_rank(db_video_id)
+    finally:
+        processor.session.close()
+    return LiveTail(youtube_id, db_video_id, processor.gemini_api_key, top_n).run(max_duration)
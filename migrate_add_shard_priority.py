@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+"""
+Миграция для добавления поля priority в таблицу ranking_shards
+
+Таблица создана раньше, чем появилось поле, а create_all не добавляет колонки
+в существующие таблицы - без миграции воркеры шардов падают на первом claim_shard.
+"""
+
+import os
+from sqlalchemy import create_engine, text
+
+def migrate_add_shard_priority():
+    """Добавляет поле priority в таблицу ranking_shards если его нет"""
+    
+    # Подключение к базе данных
+    db_host = os.getenv("DB_HOST", "localhost")
+    db_port = os.getenv("DB_PORT", "5432")
+    db_name = os.getenv("DB_NAME", "comments")
+    db_user = os.getenv("DB_USER", "postgres")
+    db_password = os.getenv("DB_PASSWORD", "postgres")
+    db_url = f"postgresql+psycopg2://{db_user}:{db_password}@{db_host}:{db_port}/{db_name}"
+    
+    engine = create_engine(db_url)
+    
+    try:
+        with engine.connect() as connection:
+            # Таблицы еще нет - ее создаст create_all сразу с полем priority
+            result = connection.execute(text("SELECT to_regclass('ranking_shards')"))
+            if result.scalar() is None:
+                print("ℹ️ Таблицы 'ranking_shards' еще нет, миграция не нужна")
+                return True
+            
+            # Уже нарезанные шарды получают приоритет 0 и забираются после новых
+            connection.execute(text("""
+                ALTER TABLE ranking_shards
+                ADD COLUMN IF NOT EXISTS priority INTEGER NOT NULL DEFAULT 0
+            """))
+            
+            connection.commit()
+            print("✅ Поле 'priority' есть в таблице 'ranking_shards'")
+            return True
+            
+    except Exception as e:
+        print(f"❌ Ошибка при выполнении миграции: {e}")
+        return False
+
+def main():
+    """Основная функция"""
+    print("🔄 Запуск миграции для добавления поля 'priority' в 'ranking_shards'...")
+    success = migrate_add_shard_priority()
+    
+    if success:
+        print("🎉 Миграция завершена успешно!")
+    else:
+        print("💥 Миграция завершилась с ошибкой!")
+
+if __name__ == "__main__":
+    main()
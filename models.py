@@ -1,11 +1,15 @@
 import os
-from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey, UniqueConstraint, Float, create_engine
+import threading
+from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey, UniqueConstraint, Float, Index, create_engine, func
 from sqlalchemy.orm import declarative_base, relationship, sessionmaker
 
 Base = declarative_base()
 
-def get_db_session():
-    """Создает сессию подключения к базе данных PostgreSQL"""
+def create_session_factory() -> sessionmaker:
+    """
+    Создает новый engine (пул соединений) PostgreSQL и фабрику сессий.
+    Обычно нужна общая фабрика процесса - process_session_factory
+    """
     db_host = os.getenv("DB_HOST", "localhost")
     db_port = os.getenv("DB_PORT", "5432")
     db_name = os.getenv("DB_NAME", "comments")
@@ -14,8 +18,27 @@ def get_db_session():
     db_url = f"postgresql+psycopg2://{db_user}:{db_password}@{db_host}:{db_port}/{db_name}"
     engine = create_engine(db_url)
     Base.metadata.create_all(engine)
-    Session = sessionmaker(bind=engine)
-    return Session()
+    return sessionmaker(bind=engine)
+
+_process_factory = None
+_process_factory_pid = None
+_process_factory_lock = threading.Lock()
+
+def process_session_factory() -> sessionmaker:
+    """
+    Фабрика сессий процесса: один engine и пул соединений на процесс.
+    После fork дочерний процесс создает свою - соединения родителя не переиспользуются
+    """
+    global _process_factory, _process_factory_pid
+    with _process_factory_lock:
+        if _process_factory is None or _process_factory_pid != os.getpid():
+            _process_factory = create_session_factory()
+            _process_factory_pid = os.getpid()
+        return _process_factory
+
+def get_db_session():
+    """Создает сессию подключения к базе данных PostgreSQL (из общего пула процесса)"""
+    return process_session_factory()()
 
 class Video(Base):
     __tablename__ = 'videos'
@@ -46,4 +69,115 @@ class Comment(Base):
 
     video = relationship("Video", back_populates="comments")
 
+class VideoStageState(Base):
+    """Состояние этапа обработки видео (см. stage_state.py): решения о повторе принимаются без чтения текстов"""
+    __tablename__ = 'video_stage_states'
+
+    id = Column(Integer, primary_key=True)
+    video_id = Column(Integer, ForeignKey("videos.id"), nullable=False)
+    stage = Column(String, nullable=False)  # ingest, transcript, summary, rank
+    status = Column(String, nullable=False, default='pending')  # pending, running, done, failed
+    input_hash = Column(String, nullable=True)  # output_hash вышестоящего этапа на момент запуска
+    output_hash = Column(String, nullable=True)  # md5 результата этапа (транскрипта, summary)
+    error = Column(Text, nullable=True)
+    started_at = Column(DateTime(timezone=True), nullable=True)
+    finished_at = Column(DateTime(timezone=True), nullable=True)
+    updated_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now(), onupdate=func.now())
+
+    __table_args__ = (UniqueConstraint('video_id', 'stage', name='uq_video_stage'),)
+
+class RankingRun(Base):
+    """Запуск ранжирования комментариев видео: прогресс для мониторинга и продолжения после сбоя (см. rank_store.py)"""
+    __tablename__ = 'ranking_runs'
+
+    id = Column(Integer, primary_key=True)
+    video_id = Column(Integer, ForeignKey("videos.id"), nullable=False)
+    ranker = Column(String, nullable=False)  # gemini, llm, heuristic
+    status = Column(String, nullable=False, default='running')  # running, done, failed
+    total = Column(Integer, nullable=False, default=0)  # непроранжированных комментариев на старте
+    ranked = Column(Integer, nullable=False, default=0)  # сохранено рангов
+    batches = Column(Integer, nullable=False, default=0)  # сохранено батчей
+    last_comment_id = Column(Integer, nullable=True)  # последний комментарий сохраненного батча
+    error = Column(Text, nullable=True)
+    started_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now(), onupdate=func.now())
+    finished_at = Column(DateTime(timezone=True), nullable=True)
+
+    __table_args__ = (Index('ix_ranking_runs_video_status', 'video_id', 'status'),)
+
+class RankingShard(Base):
+    """Диапазон id непроранжированных комментариев видео - единица работы шардированного ранжирования (см. ranking_shards.py)"""
+    __tablename__ = 'ranking_shards'
+
+    id = Column(Integer, primary_key=True)
+    run_id = Column(Integer, ForeignKey("ranking_runs.id"), nullable=False)
+    video_id = Column(Integer, ForeignKey("videos.id"), nullable=False)
+    first_comment_id = Column(Integer, nullable=False)
+    last_comment_id = Column(Integer, nullable=False)
+    size = Column(Integer, nullable=False)  # непроранжированных комментариев при нарезке
+    priority = Column(Integer, nullable=False, default=0)  # максимум лайков комментария верхнего уровня в шарде
+    status = Column(String, nullable=False, default='queued')  # queued, running, done, failed
+    attempts = Column(Integer, nullable=False, default=0)
+    ranked = Column(Integer, nullable=False, default=0)
+    lease_owner = Column(String, nullable=True)
+    lease_expires_at = Column(DateTime(timezone=True), nullable=True)
+    error = Column(Text, nullable=True)
+    created_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now(), onupdate=func.now())
+    finished_at = Column(DateTime(timezone=True), nullable=True)
+
+    __table_args__ = (
+        # Выборка следующего шарда: status + video_id
+        Index('ix_ranking_shards_status_video', 'status', 'video_id'),
+        Index('ix_ranking_shards_run', 'run_id'),
+    )
+
+class CrawlHistory(Base):
+    """Загрузка комментариев видео: по истории оценивается скорость комментариев (см. recrawl_scheduler.py)"""
+    __tablename__ = 'crawl_history'
+
+    id = Column(Integer, primary_key=True)
+    video_id = Column(Integer, ForeignKey("videos.id"), nullable=False)
+    crawled_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
+    new_comments = Column(Integer, nullable=False, default=0)  # сохранено новых комментариев
+    fetched = Column(Integer, nullable=False, default=0)  # прочитано комментариев из ленты
+    requests = Column(Integer, nullable=False, default=0)  # оценка числа запросов к YouTube
+    duration_seconds = Column(Float, nullable=True)
+    error = Column(Text, nullable=True)
+
+    __table_args__ = (Index('ix_crawl_history_video_crawled', 'video_id', 'crawled_at'),)
+
+class RateLimitBucket(Base):
+    """Общий для процессов token bucket запросов к YouTube (см. rate_limit.py, RATE_LIMIT_BACKEND=db)"""
+    __tablename__ = 'rate_limit_buckets'
+
+    name = Column(String, primary_key=True)  # тип запросов: comments, transcript
+    tokens = Column(Float, nullable=False)
+    rate = Column(Float, nullable=False)  # токенов в секунду, меняется адаптивно (AIMD)
+    updated_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
+
+class Job(Base):
+    """Задание на обработку видео в очереди воркеров (см. job_queue.py)"""
+    __tablename__ = 'jobs'
+
+    id = Column(Integer, primary_key=True)
+    video_url = Column(String, nullable=False)
+    status = Column(String, nullable=False, default='queued')  # queued, running, done, dead
+    stage = Column(String, nullable=False, default='ingest')  # этап, с которого продолжится обработка
+    video_id = Column(Integer, ForeignKey("videos.id"), nullable=True)  # заполняется после этапа ingest
+    attempts = Column(Integer, nullable=False, default=0)
+    max_attempts = Column(Integer, nullable=False, default=5)
+    run_after = Column(DateTime(timezone=True), nullable=False, server_default=func.now())  # backoff повторов
+    lease_owner = Column(String, nullable=True)  # воркер, который сейчас выполняет задание
+    lease_expires_at = Column(DateTime(timezone=True), nullable=True)
+    last_error = Column(Text, nullable=True)
+    created_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now(), onupdate=func.now())
+    finished_at = Column(DateTime(timezone=True), nullable=True)
+
+    __table_args__ = (
+        # Выборка следующего задания: status + run_after
+        Index('ix_jobs_status_run_after', 'status', 'run_after'),
+    )
+
 # Transcript теперь является полем в Video, отдельная модель не нужна 
\ No newline at end of file
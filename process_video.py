@@ -15,21 +15,36 @@ import sys
 import os
 import time
 from urllib.parse import urlparse, parse_qs
-from youtube_comment_downloader import YoutubeCommentDownloader
-from youtube_transcript_api import YouTubeTranscriptApi
-import requests
+from sqlalchemy.orm import Session
 from models import Video, Comment, get_db_session
 from gemini_ranker import GeminiCommentRanker
+from gemini_summarizer import gemini_summarizer
+from summary_router import HedgedRouter
+from stage_state import StageTracker, content_hash
 from comment_ranker import CommentRanker
+from ranking_driver import count_unranked
+from live_tail import comment_values, insert_comments
+from recrawl_scheduler import record_crawl
+from rate_limit import youtube_downloader
+from transcript_engine import get_transcript
+from ranking_shards import RANK_PROCESSES, RANK_SHARD_THRESHOLD, rank_video_sharded
+from summarizer_client import stream_summary
 
 class VideoProcessor:
     """Полный пайплайн обработки видео с мега-ранжированием"""
     
-    def __init__(self, gemini_api_key: str = None):
-        self.session = get_db_session()
-        self.downloader = YoutubeCommentDownloader()
+    def __init__(self, gemini_api_key: str = None, session: Session = None):
+        # session - из пула воркера очереди заданий; без нее создается свое подключение
+        self.session = session or get_db_session()
+        self.downloader = youtube_downloader()
         self.gemini_api_key = gemini_api_key or os.getenv('GEMINI_API_KEY')
         
+        # Бэкенды summary в порядке приоритета
+        summary_backends = [("local_llm", self._summarize_with_local_llm)]
+        if self.gemini_api_key:
+            summary_backends.insert(0, ("gemini", self._summarize_with_gemini))
+        self.summary_router = HedgedRouter(summary_backends)
+        
     def process_video(self, video_url: str) -> bool:
         """
         Полная обработка видео: от URL до ранжированных комментариев
@@ -55,78 +70,34 @@ class VideoProcessor:
             print(f"📹 Video ID: {video_id}")
             print(f"🔗 URL: {video_url}")
             
-            # 2. Проверяем, не обработано ли уже это видео
-            existing_video = self.session.query(Video).filter_by(video_id=video_id).first()
-            if existing_video:
-                print(f"⚠️ Видео уже существует в БД (ID: {existing_video.id})")
-                
-                # Проверяем, есть ли необходимые данные
-                has_transcript = existing_video.transcript is not None
-                has_summary = existing_video.summary is not None
-                
-                print(f"📊 Статус данных:")
-                print(f"   Транскрипт: {'✅' if has_transcript else '❌'}")
-                print(f"   Summary: {'✅' if has_summary else '❌'}")
-                
-                # Если данных нет, обрабатываем как новое видео
-                if not has_transcript or not has_summary:
-                    print("🔄 Недостающие данные - запускаю полную обработку...")
-                    
-                    # Получаем транскрипт если его нет
-                    if not has_transcript:
-                        print("\n📝 ЭТАП 2: ПОЛУЧЕНИЕ ТРАНСКРИПТА")
-                        print("-" * 40)
-                        transcript = self._get_transcript(video_id)
-                        existing_video.transcript = transcript
-                    else:
-                        transcript = existing_video.transcript
-                    
-                    # Генерируем summary если его нет
-                    if not has_summary:
-                        print("\n🤖 ЭТАП 3: ГЕНЕРАЦИЯ SUMMARY")
-                        print("-" * 40)
-                        summary = self._generate_summary(transcript)
-                        existing_video.summary = summary
-                    
-                    # Сохраняем изменения
-                    self.session.commit()
-                    print("✅ Данные видео обновлены")
-                
-                # Теперь запускаем ранжирование
-                print("\n🚀 ЭТАП 5: МЕГА-РАНЖИРОВАНИЕ КОММЕНТАРИЕВ")
-                print("-" * 40)
-                return self._rank_existing_video(existing_video.id)
-            
-            # 3. Загружаем комментарии
-            print("\n📥 ЭТАП 1: ЗАГРУЗКА КОММЕНТАРИЕВ")
+            # 2. Загружаем комментарии и сохраняем видео (пропускается, если видео уже в БД)
+            print("\n📥 ЭТАП 1: ЗАГРУЗКА КОММЕНТАРИЕВ И СОХРАНЕНИЕ В БД")
             print("-" * 40)
-            comments_data = self._download_comments(video_id)
-            if not comments_data:
-                print("❌ Не удалось загрузить комментарии")
-                return False
+            db_video_id = self.stage_ingest(video_url)
+            
+            # Что делать дальше, решается по состоянию этапов, без чтения транскрипта и summary
+            tracker = StageTracker(self.session, db_video_id)
+            print(f"📊 Статус этапов: {tracker.describe()}")
             
-            # 4. Получаем транскрипт
+            # 3. Получаем транскрипт
             print("\n📝 ЭТАП 2: ПОЛУЧЕНИЕ ТРАНСКРИПТА")
             print("-" * 40)
-            transcript = self._get_transcript(video_id)
+            self.stage_transcript(db_video_id)
             
-            # 5. Генерируем summary
+            # 4. Генерируем summary
             print("\n🤖 ЭТАП 3: ГЕНЕРАЦИЯ SUMMARY")
             print("-" * 40)
-            summary = self._generate_summary(transcript)
-            
-            # 6. Сохраняем видео в БД
-            print("\n💾 ЭТАП 4: СОХРАНЕНИЕ В БАЗУ ДАННЫХ")
-            print("-" * 40)
-            db_video_id = self._save_video_to_db(video_id, video_url, comments_data, transcript, summary)
-            if not db_video_id:
-                print("❌ Не удалось сохранить в БД")
-                return False
+            self.stage_summary(db_video_id)
             
-            # 7. МЕГА-РАНЖИРОВАНИЕ КОММЕНТАРИЕВ
-            print("\n🚀 ЭТАП 5: МЕГА-РАНЖИРОВАНИЕ КОММЕНТАРИЕВ")
+            # 5. МЕГА-РАНЖИРОВАНИЕ КОММЕНТАРИЕВ
+            print("\n🚀 ЭТАП 4: МЕГА-РАНЖИРОВАНИЕ КОММЕНТАРИЕВ")
             print("-" * 40)
-            ranking_success = self._rank_comments_mega(db_video_id)
+            try:
+                self.stage_rank(db_video_id)
+                ranking_success = True
+            except RuntimeError as e:
+                print(f"⚠️ {e}")
+                ranking_success = False
             
             print("\n🎉" + "="*70)
             if ranking_success:
@@ -150,6 +121,73 @@ class VideoProcessor:
         finally:
             self.session.close()
     
+    # Этапы пайплайна для воркеров очереди заданий (job_queue.py).
+    # Каждый этап идемпотентен и при ошибке бросает исключение - воркер повторит его позже
+    
+    def stage_ingest(self, video_url: str) -> int:
+        """Загружает комментарии и создает запись видео; возвращает ID видео в БД"""
+        video_id = self._extract_video_id(video_url)
+        if not video_id:
+            raise ValueError(f"Не удалось извлечь video_id из URL: {video_url}")
+        
+        existing_id = self.session.query(Video.id).filter_by(video_id=video_id).scalar()
+        if existing_id:
+            print(f"⚠️ Видео уже существует в БД (ID: {existing_id})")
+            return existing_id
+        
+        start_time = time.time()
+        comments_data = self._download_comments(video_id)
+        if not comments_data:
+            raise RuntimeError("Не удалось загрузить комментарии")
+        db_video_id = self._save_video_to_db(video_id, video_url, comments_data, None, None)
+        if not db_video_id:
+            raise RuntimeError("Не удалось сохранить видео в БД")
+        # Первая точка истории загрузок для планировщика повторных загрузок
+        record_crawl(self.session, db_video_id, len(comments_data), len(comments_data), time.time() - start_time)
+        return db_video_id
+    
+    def stage_transcript(self, db_video_id: int):
+        """Получает транскрипт, если этап еще не выполнен"""
+        tracker = StageTracker(self.session, db_video_id)
+        if not tracker.needs_run("transcript"):
+            print("⏭️ Транскрипт уже получен")
+            return
+        youtube_id = self.session.query(Video.video_id).filter_by(id=db_video_id).scalar()
+        with tracker.run("transcript") as result:
+            transcript = self._get_transcript(youtube_id)
+            self.session.query(Video).filter_by(id=db_video_id).update({Video.transcript: transcript})
+            result.output_hash = content_hash(transcript)
+    
+    def stage_summary(self, db_video_id: int):
+        """Генерирует summary, если этап не выполнен или транскрипт изменился"""
+        tracker = StageTracker(self.session, db_video_id)
+        if not tracker.needs_run("summary"):
+            print("⏭️ Summary актуально")
+            return
+        if tracker.is_stale("summary"):
+            print("♻️ Транскрипт изменился - summary будет сгенерировано заново")
+        transcript = self.session.query(Video.transcript).filter_by(id=db_video_id).scalar()
+        with tracker.run("summary") as result:
+            summary = self._generate_summary(transcript or "")
+            self.session.query(Video).filter_by(id=db_video_id).update({Video.summary: summary})
+            result.output_hash = content_hash(summary)
+    
+    def stage_rank(self, db_video_id: int):
+        """Ранжирует комментарии; прерванное ранжирование продолжается с непроранжированных"""
+        tracker = StageTracker(self.session, db_video_id)
+        if not tracker.needs_run("rank"):
+            print("⏭️ Комментарии уже проранжированы по актуальному summary")
+            return
+        if tracker.is_stale("rank"):
+            print("♻️ Summary изменилось - сбрасываю ранги для повторного ранжирования")
+            self.session.query(Comment).filter_by(video_id=db_video_id).update(
+                {Comment.comment_rank: None}, synchronize_session=False
+            )
+            self.session.commit()
+        with tracker.run("rank"):
+            if not self._rank_comments_mega(db_video_id):
+                raise RuntimeError("Ранжирование завершилось с ошибками")
+    
     def _extract_video_id(self, url: str) -> str:
         """Извлекает video_id из YouTube URL"""
         try:
@@ -174,117 +212,28 @@ class VideoProcessor:
             return None
     
     def _get_transcript(self, video_id: str) -> str:
-        """Получает транскрипт видео"""
-        try:
-            print(f"📝 Получаю транскрипт для видео {video_id}...")
-            
-            # Сначала пробуем получить обычные субтитры
-            try:
-                transcript_list = YouTubeTranscriptApi.get_transcript(video_id, languages=['ru', 'en'])
-                transcript = ' '.join([item['text'] for item in transcript_list])
-                print(f"✅ Получен обычный транскрипт длиной {len(transcript)} символов")
-                return transcript
-            except:
-                print("⚠️ Обычные субтитры недоступны, пробую автоматические...")
-            
-            # Если обычные не найдены, пробуем автоматически сгенерированные
-            try:
-                # Получаем список всех доступных транскриптов
-                transcript_list = YouTubeTranscriptApi.list_transcripts(video_id)
-                
-                # Ищем автоматически сгенерированные субтитры
-                for transcript in transcript_list:
-                    if transcript.is_generated:
-                        print(f"🤖 Найден автоматический транскрипт на языке: {transcript.language}")
-                        transcript_data = transcript.fetch()
-                        # Исправляем обращение к атрибутам FetchedTranscriptSnippet
-                        transcript_text = ' '.join([item.text for item in transcript_data])
-                        print(f"✅ Получен автоматический транскрипт длиной {len(transcript_text)} символов")
-                        return transcript_text
-                
-                # Если автоматических нет, берем первый доступный
-                for transcript in transcript_list:
-                    print(f"📝 Использую доступный транскрипт на языке: {transcript.language}")
-                    transcript_data = transcript.fetch()
-                    # Исправляем обращение к атрибутам FetchedTranscriptSnippet
-                    transcript_text = ' '.join([item.text for item in transcript_data])
-                    print(f"✅ Получен транскрипт длиной {len(transcript_text)} символов")
-                    return transcript_text
-                    
-            except Exception as e:
-                print(f"⚠️ Ошибка получения автоматических субтитров: {e}")
-            
-            # Если ничего не найдено
+        """
+        Получает транскрипт видео (см. transcript_engine.py). Заглушка сохраняется, только если
+        транскрипта у видео нет; троттлинг и сетевые ошибки пробрасываются - этап упадет и будет повторен
+        """
+        transcript = get_transcript(video_id)
+        if not transcript:
             print("⚠️ Транскрипт недоступен")
             return "Транскрипт недоступен для данного видео"
-            
-        except Exception as e:
-            print(f"⚠️ Общая ошибка получения транскрипта: {e}")
-            print("🔄 Использую fallback - пустой транскрипт")
-            return "Транскрипт недоступен для данного видео"
+        return transcript
     
     def _generate_summary(self, transcript: str) -> str:
-        """Генерирует summary через Gemini API"""
+        """
+        Генерирует summary: Gemini и локальная LLM опрашиваются с хеджированием -
+        если Gemini не ответил за hedge delay, параллельно запускается локальная LLM
+        """
         try:
-            print("🤖 Генерирую summary через Gemini API...")
+            print("🤖 Генерирую summary...")
             
-            # Если есть API ключ Gemini, используем его
-            if self.gemini_api_key:
-                try:
-                    import google.generativeai as genai
-                    genai.configure(api_key=self.gemini_api_key)
-                    model = genai.GenerativeModel('gemini-2.0-flash-exp')
-                    
-                    # Создаем промпт для суммаризации
-                    prompt = f"""Создай краткое содержание (summary) этого видео на основе транскрипта.
-                    
-Требования:
-- Длина: 2-3 предложения
-- Язык: русский
-- Основные темы и ключевые моменты
-- Четкий и информативный стиль
-
-Транскрипт:
-{transcript[:3000]}...
-
-Summary:"""
-                    
-                    response = model.generate_content(
-                        prompt,
-                        generation_config=genai.types.GenerationConfig(
-                            temperature=0.3,
-                            max_output_tokens=200,
-                            top_p=0.8
-                        )
-                    )
-                    
-                    if response and response.text:
-                        summary = response.text.strip()
-                        print(f"✅ Сгенерирован summary через Gemini длиной {len(summary)} символов")
-                        return summary
-                    
-                except Exception as e:
-                    print(f"⚠️ Ошибка Gemini API: {e}")
-            
-            # Fallback: пробуем локальную LLM
-            print("🔄 Пробую локальную LLM...")
-            try:
-                response = requests.get("http://summarizer-llm:8000/", timeout=5)
-                
-                response = requests.post(
-                    "http://summarizer-llm:8000/summarize",
-                    json={"text": transcript},
-                    timeout=60  # Уменьшаем таймаут
-                )
-                
-                if response.status_code == 200:
-                    result = response.json()
-                    summary = result.get("summary", "")
-                    if summary:
-                        print(f"✅ Сгенерирован summary через локальную LLM длиной {len(summary)} символов")
-                        return summary
-            except Exception as e:
-                print(f"⚠️ Локальная LLM недоступна: {e}")
+            summary, backend = self.summary_router.summarize(transcript)
+            if summary:
+                print(f"✅ Сгенерирован summary через {backend} длиной {len(summary)} символов")
+                return summary
             
             # Финальный fallback
             print("🔄 Использую fallback summary...")
@@ -296,6 +245,15 @@ Summary:"""
             print(f"❌ Ошибка генерации summary: {e}")
             return f"Fallback summary: {transcript[:200]}..."
     
+    def _summarize_with_gemini(self, transcript: str, cancel) -> str:
+        # Длинный транскрипт суммаризируется по чанкам, а не обрезается до начала
+        # Суммаризатор общий для процесса: не пересоздается на каждое видео и задание очереди
+        return gemini_summarizer(self.gemini_api_key).summarize(transcript, cancel=cancel)
+    
+    def _summarize_with_local_llm(self, transcript: str, cancel) -> str:
+        # Потоковый запрос: при таймауте остаются уже готовые summary чанков
+        return stream_summary(transcript, timeout=60, cancel=cancel)
+    
     def _save_video_to_db(self, video_id: str, url: str, comments_data: list, transcript: str, summary: str) -> int:
         """Сохраняет видео и комментарии в БД"""
         try:
@@ -318,8 +276,13 @@ Summary:"""
             # Сохраняем комментарии
             print(f"💬 Сохраняю {len(comments_data)} комментариев...")
             
+            downloader_rows = []
             for comment_data in comments_data:
                 # Обрабатываем разные форматы данных комментариев
+                if isinstance(comment_data, dict) and comment_data.get('cid'):
+                    # Формат youtube_comment_downloader: с comment_id, ответами и временем (нужны live_tail)
+                    downloader_rows.append(comment_values(video.id, comment_data))
+                    continue
                 if isinstance(comment_data, dict):
                     author = comment_data.get('author', 'Unknown')
                     text = comment_data.get('text', '')
@@ -339,6 +302,10 @@ Summary:"""
                 )
                 self.session.add(comment)
             
+            # comment_id уникален: повторы cid в ленте загрузчика пропускаются, а не откатывают всю загрузку
+            inserted = insert_comments(self.session, downloader_rows)
+            if len(inserted) < len(downloader_rows):
+                print(f"ℹ️ Пропущено повторов comment_id: {len(downloader_rows) - len(inserted)}")
             self.session.commit()
             print(f"✅ Все данные сохранены в БД")
             
@@ -352,6 +319,14 @@ Summary:"""
     def _rank_comments_mega(self, video_id: int) -> bool:
         """Выполняет мега-ранжирование комментариев"""
         try:
+            unranked = count_unranked(self.session, video_id)
+            if unranked > RANK_SHARD_THRESHOLD:
+                print(f"🧩 {unranked} комментариев без ранга - запускаю шардированное ранжирование")
+                start_time = time.time()
+                success = rank_video_sharded(video_id, self.gemini_api_key, RANK_PROCESSES)
+                print(f"{'✅' if success else '⚠️'} Шардированное ранжирование за {time.time() - start_time:.1f} секунд")
+                return success
+            
             if self.gemini_api_key:
                 print("🚀 Запускаю МЕГА-РАНЖИРОВАНИЕ с Gemini 2.0 Flash...")
                 ranker = GeminiCommentRanker(api_key=self.gemini_api_key, use_fallback=True)
@@ -375,10 +350,6 @@ Summary:"""
             print(f"❌ Ошибка ранжирования: {e}")
             return False
     
-    def _rank_existing_video(self, video_id: int) -> bool:
-        """Ранжирует комментарии для уже существующего видео"""
-        return self._rank_comments_mega(video_id)
-    
     def _show_results(self, video_id: int):
         """Показывает результаты обработки"""
         try:
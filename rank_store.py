@@ -0,0 +1,175 @@
+"""
+Сохранение рангов комментариев по батчам и учет запусков ранжирования
+
+Ранги каждого готового батча записываются сразу одним UPDATE ... FROM (VALUES ...)
+вместе с прогрессом запуска в ranking_runs - в одной транзакции. Сбой или Ctrl-C
+теряет не больше одного батча, а повторный запуск продолжает тот же run:
+непроранжированными остались ровно те комментарии, до которых ранжирование не дошло.
+Запуск со статусом running продолжается, только если его прогресс не обновлялся
+RANK_RUN_STALE_SECONDS: иначе он жив и ранжируется другим процессом.
+"""
+
+import os
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from sqlalchemy import func, text
+from sqlalchemy.orm import Session
+
+from models import Comment, RankingRun, RankingShard
+
+# Запуск running без новых батчей дольше этого считается брошенным (процесс упал или убит).
+# Больше времени ранжирования одного батча и паузы слежения за комментариями (TAIL_IDLE_STOP)
+RANK_RUN_STALE_SECONDS = int(os.getenv("RANK_RUN_STALE_SECONDS", "1800"))
+# Строк в одном UPDATE ... FROM (VALUES ...): ограничивает размер SQL и число параметров
+BULK_UPDATE_ROWS = 1000
+
+
+def bulk_update_ranks(session: Session, ranks: Sequence[Tuple[int, float]]) -> int:
+    """Записывает ранги пачкой (без ORM-объектов); commit остается за вызывающим кодом"""
+    updated = 0
+    for start in range(0, len(ranks), BULK_UPDATE_ROWS):
+        part = ranks[start:start + BULK_UPDATE_ROWS]
+        params = {}
+        values = []
+        for idx, (comment_id, rank) in enumerate(part):
+            values.append(f"(CAST(:id{idx} AS INTEGER), CAST(:rank{idx} AS DOUBLE PRECISION))")
+            params[f"id{idx}"] = comment_id
+            params[f"rank{idx}"] = rank
+        result = session.execute(text(
+            "UPDATE comments AS c SET comment_rank = v.rank "
+            f"FROM (VALUES {', '.join(values)}) AS v(id, rank) "
+            "WHERE c.id = v.id"
+        ), params)
+        updated += result.rowcount
+    return updated
+
+
+class RankRunActive(Exception):
+    """Видео уже ранжируется другим процессом: запуск нужно повторить позже"""
+
+
+class RankStore:
+    """Запуски ранжирования видео и сохранение рангов по батчам"""
+
+    def __init__(self, session: Session):
+        self.session = session
+
+    def start_run(self, video_id: int, ranker: str, total: int) -> int:
+        """
+        Начинает запуск ранжирования или продолжает незавершенный (упавший или брошенный)
+
+        Returns:
+            int: ID запуска
+
+        Raises:
+            RankRunActive: У видео есть живой запуск - его прогресс обновлялся недавно
+        """
+        # FOR UPDATE: из двух процессов, одновременно подхвативших брошенный запуск, продолжит один -
+        # второй после commit первого увидит свежий updated_at
+        run = self.session.query(RankingRun).filter(
+            RankingRun.video_id == video_id,
+            RankingRun.status.in_(("running", "failed")),
+        ).order_by(RankingRun.id.desc()).with_for_update().first()
+        stale_before = datetime.now(timezone.utc) - timedelta(seconds=RANK_RUN_STALE_SECONDS)
+        if run and run.status == "running" and _as_utc(run.updated_at) > stale_before:
+            self.session.rollback()
+            raise RankRunActive(f"Видео {video_id} уже ранжируется (запуск {run.id}, "
+                                f"прогресс обновлен {run.updated_at.isoformat()})")
+        if run:
+            print(f"♻️ Продолжаю запуск ранжирования {run.id}: сохранено {run.ranked}/{run.total}, "
+                  f"осталось {total} комментариев")
+            run.status = "running"
+            run.ranker = ranker
+            run.error = None
+            run.updated_at = func.now()
+        else:
+            run = RankingRun(video_id=video_id, ranker=ranker, status="running", total=total)
+            self.session.add(run)
+        self.session.commit()
+        return run.id
+
+    def save_batch(self, run_id: int, ranks: List[Tuple[int, float]]) -> int:
+        """Записывает ранги батча и прогресс запуска одной транзакцией"""
+        if not ranks:
+            return 0
+        updated = bulk_update_ranks(self.session, ranks)
+        # Счетчики увеличиваются в SQL: батчи одного запуска могут сохранять разные процессы
+        self.session.query(RankingRun).filter(RankingRun.id == run_id).update({
+            RankingRun.ranked: RankingRun.ranked + updated,
+            RankingRun.batches: RankingRun.batches + 1,
+            RankingRun.last_comment_id: max(comment_id for comment_id, _ in ranks),
+            RankingRun.updated_at: func.now(),
+        }, synchronize_session=False)
+        self.session.commit()
+        return updated
+
+    def finish_run(self, run_id: int):
+        self._set_status(run_id, "done")
+
+    def fail_run(self, run_id: int, error: str):
+        self.session.rollback()
+        self._set_status(run_id, "failed", error[-2000:])
+
+    def _set_status(self, run_id: int, status: str, error: Optional[str] = None):
+        self.session.query(RankingRun).filter(RankingRun.id == run_id).update({
+            RankingRun.status: status,
+            RankingRun.error: error,
+            RankingRun.finished_at: func.now(),
+        }, synchronize_session=False)
+        self.session.commit()
+
+
+def _as_utc(value: datetime) -> datetime:
+    """Время из БД с часовым поясом (драйверы без поддержки timezone возвращают наивное UTC)"""
+    return value if value.tzinfo else value.replace(tzinfo=timezone.utc)
+
+
+def ranking_progress(session: Session, video_id: int) -> Dict:
+    """
+    Прогресс ранжирования видео для внешнего мониторинга.
+    Кроме доли проранжированных комментариев - покрытие комментариев верхнего уровня
+    и доля лайков проранжированных комментариев: при ранжировании по заметности
+    они растут быстрее общего покрытия
+    """
+    ranked_filter = Comment.comment_rank.isnot(None)
+    top_level_filter = Comment.parent_id.is_(None)
+    total, ranked, top_level, top_level_ranked, total_likes, ranked_likes = session.query(
+        func.count(Comment.id),
+        func.count(Comment.comment_rank),
+        func.count(Comment.id).filter(top_level_filter),
+        func.count(Comment.id).filter(top_level_filter, ranked_filter),
+        func.coalesce(func.sum(Comment.likes), 0),
+        func.coalesce(func.sum(Comment.likes).filter(ranked_filter), 0),
+    ).filter(Comment.video_id == video_id).one()
+    progress = {
+        "video_id": video_id,
+        "comments": total,
+        "ranked": ranked,
+        "coverage": ranked / total if total else 0.0,
+        "top_level_coverage": top_level_ranked / top_level if top_level else 0.0,
+        "likes_coverage": ranked_likes / total_likes if total_likes else 0.0,
+        "run": None,
+    }
+    run = session.query(RankingRun).filter_by(video_id=video_id).order_by(RankingRun.id.desc()).first()
+    if run:
+        elapsed = ((run.finished_at or run.updated_at) - run.started_at).total_seconds()
+        progress["run"] = {
+            "id": run.id,
+            "ranker": run.ranker,
+            "status": run.status,
+            "total": run.total,
+            "ranked": run.ranked,
+            "batches": run.batches,
+            "last_comment_id": run.last_comment_id,
+            "started_at": run.started_at.isoformat(),
+            "updated_at": run.updated_at.isoformat(),
+            "finished_at": run.finished_at.isoformat() if run.finished_at else None,
+            "ranks_per_second": run.ranked / elapsed if elapsed > 0 else None,
+            "error": run.error,
+            # Для шардированного запуска - число шардов по статусам
+            "shards": dict(session.query(RankingShard.status, func.count(RankingShard.id)).filter(
+                RankingShard.run_id == run.id
+            ).group_by(RankingShard.status).all()),
+        }
+    return progress
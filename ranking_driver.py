@@ -0,0 +1,179 @@
+"""
+Ранжирование комментариев видео окнами с ограниченной памятью
+
+Непроранжированные комментарии читаются окнами в виде пар (id, text), без ORM-объектов
+и identity map сессии. Ранги окна сохраняются через RankStore, после чего окно
+освобождается - память не зависит от числа комментариев.
+Курсор на стороне сервера здесь не подходит: RankStore коммитит после каждого батча,
+а commit закрывает курсор, поэтому каждое окно - отдельный короткий запрос.
+
+Порядок обхода (RANK_ORDER):
+- priority - сначала самые заметные: комментарии верхнего уровня по лайкам и свежести,
+  затем ответы. Окна читаются по ключу (уровень, лайки, время, id) > ключа последней
+  строки с LIMIT - память на окно, комментарии, добавленные во время обхода, тоже
+  попадают в свою позицию; топ видео готов в первых же окнах;
+- id - по возрастанию id (окна по ключу id > последнего).
+"""
+
+import os
+from datetime import datetime
+from typing import Callable, Iterable, Iterator, List, Optional, Tuple
+
+from sqlalchemy import and_, case, func, or_
+from sqlalchemy.orm import Session
+
+from models import Comment
+from rank_store import RankStore
+
+RANK_WINDOW_SIZE = int(os.getenv("RANK_WINDOW_SIZE", "500"))
+RANK_ORDER = os.getenv("RANK_ORDER", "priority")  # priority или id
+# Время для комментариев без published_at: в порядке заметности они идут последними
+PUBLISHED_AT_MISSING = datetime(1970, 1, 1)
+
+
+class CommentRow:
+    """Комментарий для ранжирования: только то, что нужно промпту"""
+
+    __slots__ = ("id", "text")
+
+    def __init__(self, id: int, text: str):
+        self.id = id
+        self.text = text
+
+
+# Ранжирует окно и по мере готовности отдает батчи пар (id комментария, ранг)
+RankWindow = Callable[[List[CommentRow]], Iterable[List[Tuple[int, float]]]]
+
+
+def count_unranked(session: Session, video_id: int) -> int:
+    return session.query(func.count(Comment.id)).filter(
+        Comment.video_id == video_id, Comment.comment_rank.is_(None)
+    ).scalar()
+
+
+def priority_keys():
+    """Ключи порядка заметности и их направление (True - по убыванию), без NULL"""
+    return (
+        (case((Comment.parent_id.is_(None), 0), else_=1), False),
+        (func.coalesce(Comment.likes, -1), True),
+        (func.coalesce(Comment.published_at, PUBLISHED_AT_MISSING), True),
+        (Comment.id, False),
+    )
+
+
+def priority_order():
+    """Порядок заметности: верхний уровень раньше ответов, затем лайки и свежесть"""
+    return tuple(key.desc() if descending else key for key, descending in priority_keys())
+
+
+def after_key(keys, last: Tuple):
+    """
+    Условие "строка дальше last в порядке keys". Направления ключей разные, поэтому
+    вместо сравнения кортежей (k1, k2, k3, id) > (...) - его раскрытие по ключам
+    """
+    clauses = []
+    for i, (key, descending) in enumerate(keys):
+        equal = [prev == value for (prev, _), value in zip(keys[:i], last[:i])]
+        clauses.append(and_(*equal, key < last[i] if descending else key > last[i]))
+    return or_(*clauses)
+
+
+def iter_unranked_windows(session: Session, video_id: int, window_size: int = RANK_WINDOW_SIZE,
+                          first_id: Optional[int] = None, last_id: Optional[int] = None,
+                          order: str = RANK_ORDER) -> Iterator[List[CommentRow]]:
+    """Окна непроранжированных комментариев в порядке order (first_id/last_id - границы шарда)"""
+    if order == "priority":
+        return _iter_priority_windows(session, video_id, window_size, first_id, last_id)
+    return _iter_id_windows(session, video_id, window_size, first_id, last_id)
+
+
+def _unranked_query(session: Session, video_id: int, first_id: Optional[int], last_id: Optional[int], *columns):
+    query = session.query(*columns).filter(Comment.video_id == video_id, Comment.comment_rank.is_(None))
+    if first_id is not None:
+        query = query.filter(Comment.id >= first_id)
+    if last_id is not None:
+        query = query.filter(Comment.id <= last_id)
+    return query
+
+
+def _iter_priority_windows(session: Session, video_id: int, window_size: int,
+                           first_id: Optional[int], last_id: Optional[int]) -> Iterator[List[CommentRow]]:
+    keys = priority_keys()
+    last = None
+    while True:
+        # Комментарии, которые не удалось проранжировать, остаются позади ключа и не зацикливают обход
+        query = _unranked_query(session, video_id, first_id, last_id,
+                                Comment.id, Comment.text, *(key for key, _ in keys))
+        if last is not None:
+            query = query.filter(after_key(keys, last))
+        rows = query.order_by(*priority_order()).limit(window_size).all()
+        if not rows:
+            return
+        last = tuple(rows[-1][2:])
+        window = [CommentRow(row[0], row[1]) for row in rows]
+        del rows
+        yield window
+
+
+def _iter_id_windows(session: Session, video_id: int, window_size: int,
+                     first_id: Optional[int], last_id: Optional[int]) -> Iterator[List[CommentRow]]:
+    # Комментарии, которые не удалось проранжировать, остаются позади ключа и не зацикливают обход
+    after_id = first_id - 1 if first_id is not None else 0
+    while True:
+        rows = _unranked_query(session, video_id, None, last_id, Comment.id, Comment.text).filter(
+            Comment.id > after_id
+        ).order_by(Comment.id).limit(window_size).all()
+        if not rows:
+            return
+        after_id = rows[-1][0]
+        window = [CommentRow(comment_id, text) for comment_id, text in rows]
+        del rows
+        yield window
+
+
+class RankingDriver:
+    """Обход непроранжированных комментариев видео окнами с сохранением рангов по батчам"""
+
+    def __init__(self, session: Session, video_id: int, window_size: int = RANK_WINDOW_SIZE,
+                 order: str = RANK_ORDER):
+        self.session = session
+        self.video_id = video_id
+        self.window_size = window_size
+        self.order = order
+        self.store = RankStore(session)
+
+    def run(self, ranker: str, total: int, rank_window: RankWindow) -> int:
+        """
+        Ранжирует все непроранжированные комментарии видео
+
+        Args:
+            ranker: Имя ранжировщика для ranking_runs (gemini, llm, heuristic)
+            total: Число непроранжированных комментариев (для прогресса)
+            rank_window: Функция ранжирования окна, отдающая батчи пар (id, ранг)
+
+        Returns:
+            int: Сколько рангов сохранено
+        """
+        run_id = self.store.start_run(self.video_id, ranker, total)
+        try:
+            saved = self.rank_windows(run_id, rank_window)
+        except Exception as e:
+            self.store.fail_run(run_id, str(e))
+            raise
+        self.store.finish_run(run_id)
+        return saved
+
+    def rank_windows(self, run_id: int, rank_window: RankWindow,
+                     first_id: Optional[int] = None, last_id: Optional[int] = None) -> int:
+        """Ранжирует окна в рамках уже начатого запуска (для шарда - только диапазон first_id..last_id)"""
+        saved = 0
+        windows = iter_unranked_windows(self.session, self.video_id, self.window_size, first_id, last_id, self.order)
+        for number, window in enumerate(windows, 1):
+            print(f"🪟 Окно {number}: {len(window)} комментариев (порядок {self.order})")
+            for ranks in rank_window(window):
+                saved += self.store.save_batch(run_id, ranks)
+            # Ранги уже закоммичены - топ видео доступен до окончания ранжирования
+            print(f"💾 Окно {number}: сохранено рангов всего {saved}")
+            # Ранги окна уже в БД - отпускаем окно до чтения следующего
+            del window
+        return saved
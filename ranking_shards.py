@@ -0,0 +1,289 @@
+"""
+Шардированное ранжирование комментариев одного видео
+
+Непроранжированные комментарии большого видео нарезаются на диапазоны id примерно
+равного размера (ntile по id на стороне PostgreSQL) - строки таблицы ranking_shards.
+Шарды забирают воркеры любого узла (локальный пул процессов координатора или
+`comdig.py shard-worker` на других хостах) через SELECT ... FOR UPDATE SKIP LOCKED под
+арендой, как задания в job_queue.py. Видео обслуживаются в порядке нарезки, внутри
+нарезки первыми забираются шарды с самыми заметными комментариями (priority), внутри
+шарда окна идут в порядке RANK_ORDER.
+Ранги всех шардов сохраняются в один запуск ranking_runs; ранжирование видео
+завершено, когда выполнены все его шарды.
+"""
+
+import math
+import multiprocessing
+import os
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+from datetime import timedelta
+from typing import Dict, List, Optional
+
+from sqlalchemy import and_, case, func, or_
+from sqlalchemy.orm import Session
+
+from job_queue import JOB_LEASE_SECONDS, JOB_POLL_SECONDS, Heartbeat, worker_id
+from models import Comment, RankingShard, Video, get_db_session, process_session_factory
+from rank_store import RankStore
+from ranking_driver import RankWindow, RankingDriver, count_unranked
+
+RANK_SHARD_SIZE = int(os.getenv("RANK_SHARD_SIZE", "2000"))
+# Видео с большим числом непроранжированных комментариев ранжируются шардами
+RANK_SHARD_THRESHOLD = int(os.getenv("RANK_SHARD_THRESHOLD", "5000"))
+RANK_PROCESSES = int(os.getenv("RANK_PROCESSES", "4"))
+SHARD_MAX_ATTEMPTS = 3
+
+
+def build_ranker(gemini_api_key: Optional[str] = None):
+    """Ранжировщик как в VideoProcessor: Gemini при наличии ключа, иначе локальная LLM"""
+    # Импорт здесь: ранжировщики тянут клиентов Gemini и LLM
+    if gemini_api_key:
+        from gemini_ranker import GeminiCommentRanker
+        return GeminiCommentRanker(api_key=gemini_api_key, use_fallback=True)
+    from comment_ranker import CommentRanker
+    return CommentRanker(use_fallback=True)
+
+
+def create_shards(session: Session, video_id: int, run_id: int,
+                  shard_size: int = RANK_SHARD_SIZE) -> List[RankingShard]:
+    """
+    Нарезает непроранжированные комментарии видео на шарды запуска run_id.
+    Если у запуска остались невыполненные шарды (координатор перезапущен) - возвращает их,
+    упавшие шарды снова ставятся в очередь
+    """
+    shards = session.query(RankingShard).filter(
+        RankingShard.run_id == run_id, RankingShard.status != "done"
+    ).order_by(RankingShard.first_comment_id).all()
+    if shards:
+        for shard in shards:
+            if shard.status == "failed":
+                shard.status = "queued"
+                shard.attempts = 0
+                shard.error = None
+        session.commit()
+        return shards
+
+    total = count_unranked(session, video_id)
+    if not total:
+        return []
+    bucket = func.ntile(math.ceil(total / shard_size)).over(order_by=Comment.id).label("bucket")
+    visibility = case((Comment.parent_id.is_(None), func.coalesce(Comment.likes, 0)), else_=0).label("visibility")
+    ids = session.query(Comment.id.label("id"), bucket, visibility).filter(
+        Comment.video_id == video_id, Comment.comment_rank.is_(None)
+    ).subquery()
+    ranges = session.query(
+        func.min(ids.c.id), func.max(ids.c.id), func.count(), func.max(ids.c.visibility)
+    ).group_by(ids.c.bucket).order_by(ids.c.bucket).all()
+    shards = [
+        RankingShard(run_id=run_id, video_id=video_id, first_comment_id=first_id,
+                     last_comment_id=last_id, size=size, priority=priority, status="queued")
+        for first_id, last_id, size, priority in ranges
+    ]
+    session.add_all(shards)
+    session.commit()
+    return shards
+
+
+def claim_shard(session: Session, owner: str, video_id: Optional[int] = None) -> Optional[RankingShard]:
+    """Забирает следующий шард из очереди или с истекшей арендой (SKIP LOCKED - без гонок между воркерами)"""
+    query = session.query(RankingShard).filter(or_(
+        RankingShard.status == "queued",
+        and_(RankingShard.status == "running", RankingShard.lease_expires_at < func.now()),
+    ))
+    if video_id is not None:
+        query = query.filter(RankingShard.video_id == video_id)
+    # Очередь по времени нарезки: большой бэклог одного видео не обгоняет видео, нарезанные раньше;
+    # внутри одной нарезки - самые заметные комментарии первыми
+    shard = query.order_by(
+        RankingShard.created_at, RankingShard.priority.desc(), RankingShard.id
+    ).with_for_update(skip_locked=True).first()
+    if shard is None:
+        session.rollback()
+        return None
+    if shard.status == "running":
+        print(f"♻️ Шард {shard.id}: аренда {shard.lease_owner} истекла, забираю")
+    shard.status = "running"
+    shard.lease_owner = owner
+    shard.lease_expires_at = func.now() + timedelta(seconds=JOB_LEASE_SECONDS)
+    shard.attempts += 1
+    session.commit()
+    return shard
+
+
+def extend_shard_lease(session: Session, shard_id: int, owner: str) -> bool:
+    """Продлевает аренду шарда; False - шард уже забрал другой воркер"""
+    updated = session.query(RankingShard).filter(
+        RankingShard.id == shard_id, RankingShard.lease_owner == owner, RankingShard.status == "running"
+    ).update({RankingShard.lease_expires_at: func.now() + timedelta(seconds=JOB_LEASE_SECONDS)},
+             synchronize_session=False)
+    session.commit()
+    return updated == 1
+
+
+def finish_shard(session: Session, shard_id: int, owner: str, ranked: int, error: Optional[str] = None,
+                 attempts: int = 0) -> bool:
+    """
+    Отмечает шард выполненным или, при ошибке, возвращает в очередь (после SHARD_MAX_ATTEMPTS - failed).
+    Ничего не меняет, если аренду уже перехватил другой воркер
+    """
+    if error is None:
+        values = {RankingShard.status: "done", RankingShard.finished_at: func.now()}
+    elif attempts >= SHARD_MAX_ATTEMPTS:
+        values = {RankingShard.status: "failed", RankingShard.finished_at: func.now()}
+    else:
+        values = {RankingShard.status: "queued"}
+    values.update({
+        RankingShard.ranked: RankingShard.ranked + ranked,
+        RankingShard.error: error[-2000:] if error else None,
+        RankingShard.lease_owner: None,
+        RankingShard.lease_expires_at: None,
+    })
+    updated = session.query(RankingShard).filter(
+        RankingShard.id == shard_id, RankingShard.lease_owner == owner
+    ).update(values, synchronize_session=False)
+    session.commit()
+    return updated == 1
+
+
+def shard_counts(session: Session, run_id: int) -> Dict[str, int]:
+    """Число шардов запуска по статусам"""
+    return dict(session.query(RankingShard.status, func.count(RankingShard.id)).filter(
+        RankingShard.run_id == run_id
+    ).group_by(RankingShard.status).all())
+
+
+def has_open_shards(session: Session, video_id: int) -> bool:
+    """У видео есть шарды в очереди или в работе"""
+    return session.query(RankingShard.id).filter(
+        RankingShard.video_id == video_id, RankingShard.status.in_(("queued", "running"))
+    ).first() is not None
+
+
+class ShardWorker:
+    """Воркер шардов: забирает шарды и ранжирует их диапазоны через RankingDriver"""
+
+    def __init__(self, gemini_api_key: str = None, poll_interval: float = JOB_POLL_SECONDS):
+        self.gemini_api_key = gemini_api_key or os.getenv('GEMINI_API_KEY')
+        self.poll_interval = poll_interval
+        self.owner = worker_id()
+        # Один engine на процесс воркера: сессия воркера, heartbeat шардов и get_db_session берутся из его пула
+        self.session_factory = process_session_factory()
+        self.session = self.session_factory()
+        self._ranker = None
+
+    def run(self, video_id: Optional[int] = None, drain: bool = False):
+        """
+        Основной цикл
+
+        Args:
+            video_id: Брать шарды только этого видео
+            drain: Выйти, когда забирать нечего (для video_id - когда у видео не останется шардов в работе)
+        """
+        print(f"🧩 Воркер шардов {self.owner} запущен" + (f" (видео {video_id})" if video_id else ""))
+        try:
+            while True:
+                shard = claim_shard(self.session, self.owner, video_id)
+                if shard is not None:
+                    self.process(shard)
+                    continue
+                if drain and (video_id is None or not has_open_shards(self.session, video_id)):
+                    return
+                self.session.rollback()
+                time.sleep(self.poll_interval)
+        finally:
+            self.session.close()
+
+    def process(self, shard: RankingShard):
+        shard_id, video_id, run_id = shard.id, shard.video_id, shard.run_id
+        first_id, last_id, attempts = shard.first_comment_id, shard.last_comment_id, shard.attempts
+        print(f"\n🧩 Шард {shard_id}: видео {video_id}, ID {first_id}-{last_id} ({shard.size} комментариев, "
+              f"попытка {attempts}/{SHARD_MAX_ATTEMPTS})")
+        heartbeat = Heartbeat(shard_id, self.owner, extend=extend_shard_lease, session_factory=self.session_factory)
+        heartbeat.start()
+        ranked = 0
+        try:
+            driver = RankingDriver(self.session, video_id)
+            ranked = driver.rank_windows(run_id, self._window_ranker(video_id), first_id, last_id)
+            if finish_shard(self.session, shard_id, self.owner, ranked):
+                print(f"✅ Шард {shard_id}: проранжировано {ranked}")
+            else:
+                print(f"⏹️ Шард {shard_id} перехватил другой воркер")
+        except Exception as e:
+            print(f"❌ Шард {shard_id}: {e}")
+            self.session.rollback()
+            if not heartbeat.lost.is_set():
+                finish_shard(self.session, shard_id, self.owner, ranked,
+                             f"{type(e).__name__}: {e}\n{traceback.format_exc()}", attempts)
+        finally:
+            heartbeat.stop()
+
+    def _window_ranker(self, video_id: int) -> RankWindow:
+        """
+        Функция ранжирования шарда. Доступность бэкенда проверяется на каждый шард: если LLM
+        была недоступна, следующие шарды снова ранжируются ею, когда она поднимется
+        """
+        summary = self.session.query(Video.summary).filter(Video.id == video_id).scalar()
+        if not summary:
+            raise RuntimeError(f"У видео {video_id} нет summary для ранжирования")
+        if self._ranker is None:
+            self._ranker = build_ranker(self.gemini_api_key)
+        window_ranker = self._ranker.make_window_ranker(summary)
+        if window_ranker is None:
+            raise RuntimeError("Ранжировщик недоступен")
+        return window_ranker[1]
+
+
+def run_shard_worker(gemini_api_key: Optional[str], video_id: int):
+    """Точка входа процесса локального пула"""
+    ShardWorker(gemini_api_key).run(video_id=video_id, drain=True)
+
+
+def rank_video_sharded(video_id: int, gemini_api_key: Optional[str] = None,
+                       processes: int = RANK_PROCESSES) -> bool:
+    """
+    Ранжирует видео шардами: нарезает, обрабатывает локальным пулом процессов (вместе с
+    воркерами других узлов) и ждет, пока будут выполнены все шарды
+
+    Returns:
+        bool: True если все шарды выполнены
+    """
+    session = get_db_session()
+    try:
+        summary = session.query(Video.summary).filter(Video.id == video_id).scalar()
+        if not summary:
+            print(f"❌ У видео {video_id} нет summary для ранжирования")
+            return False
+        total = count_unranked(session, video_id)
+        if not total:
+            print(f"✅ Все комментарии для видео {video_id} уже проранжированы")
+            return True
+        window_ranker = build_ranker(gemini_api_key).make_window_ranker(summary)
+        if window_ranker is None:
+            return False
+
+        store = RankStore(session)
+        run_id = store.start_run(video_id, window_ranker[0], total)
+        shards = create_shards(session, video_id, run_id)
+        print(f"🧩 Видео {video_id}: {total} комментариев в {len(shards)} шардах, процессов: {processes}")
+
+        start_time = time.time()
+        # spawn: дочерние процессы открывают свои подключения к БД, а не наследуют чужие
+        with ProcessPoolExecutor(max_workers=max(1, processes - 1),
+                                 mp_context=multiprocessing.get_context("spawn")) as pool:
+            futures = [pool.submit(run_shard_worker, gemini_api_key, video_id) for _ in range(processes - 1)]
+            # Координатор сам тоже ранжирует шарды и ждет шарды, которые забрали другие узлы
+            ShardWorker(gemini_api_key).run(video_id=video_id, drain=True)
+            for future in futures:
+                future.result()
+
+        counts = shard_counts(session, run_id)
+        print(f"🧩 Шарды видео {video_id} за {time.time() - start_time:.1f} сек: {counts}")
+        if counts.get("failed"):
+            store.fail_run(run_id, f"Не удалось проранжировать шардов: {counts['failed']}")
+            return False
+        store.finish_run(run_id)
+        return True
+    finally:
+        session.close()
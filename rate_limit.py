@@ -0,0 +1,258 @@
+"""
+Ограничение частоты запросов к YouTube (загрузка комментариев и транскриптов)
+
+- token bucket на каждый тип запросов: rate токенов в секунду, запас до burst;
+- адаптивная частота (AIMD): при признаках троттлинга (429, блокировка IP) частота
+  делится пополам и бакет уходит в паузу, после серии успешных запросов - растет
+  на постоянную величину до максимума;
+- бакет общий для всех потоков процесса, а с RATE_LIMIT_BACKEND=db - и для всех
+  процессов и узлов: состояние хранится в таблице rate_limit_buckets и меняется
+  одним атомарным UPDATE.
+
+Загрузчик комментариев ограничивается на уровне каждого HTTP-запроса (страницы ленты),
+вызовы youtube_transcript_api - на уровне вызова (throttled_call).
+"""
+
+import os
+import threading
+import time
+from typing import Callable, Dict, Optional
+
+from sqlalchemy import text
+from youtube_comment_downloader import YoutubeCommentDownloader
+
+from http_client import HttpClient
+from models import RateLimitBucket, get_db_session
+
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "local")  # local или db
+# Тип запросов: (запросов в секунду на старте, запас burst, максимум частоты)
+RATE_LIMITS = {
+    "comments": (float(os.getenv("YT_COMMENTS_RATE", "2")), 5, float(os.getenv("YT_COMMENTS_MAX_RATE", "8"))),
+    "transcript": (float(os.getenv("YT_TRANSCRIPT_RATE", "0.5")), 2, float(os.getenv("YT_TRANSCRIPT_MAX_RATE", "2"))),
+}
+MIN_RATE = 0.05  # не реже запроса в 20 сек даже после серии троттлингов
+THROTTLE_PAUSE_SECONDS = 30.0  # пауза после троттлинга (если нет Retry-After)
+AIMD_INCREASE_EVERY = 20  # успешных запросов на один шаг роста частоты
+AIMD_INCREASE_STEP = 0.05  # прибавка частоты за шаг (запросов в секунду)
+
+# Исключения youtube_transcript_api, которые означают троттлинг или блокировку
+THROTTLE_ERRORS = ("TooManyRequests", "RequestBlocked", "IpBlocked")
+
+
+class YouTubeThrottled(Exception):
+    """YouTube ограничил частоту запросов: ошибка временная, запрос нужно повторить позже"""
+
+
+def is_throttle_error(error: Exception) -> bool:
+    message = str(error)
+    return type(error).__name__ in THROTTLE_ERRORS or "429" in message or "Too Many Requests" in message
+
+
+class TokenBucket:
+    """Token bucket процесса (общий для потоков)"""
+
+    def __init__(self, name: str, rate: float, burst: float):
+        self.name = name
+        self.rate = rate
+        self.burst = burst
+        self._tokens = burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float):
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def try_acquire(self) -> float:
+        """Берет токен; возвращает 0 или сколько секунд ждать до следующего токена"""
+        with self._lock:
+            self._refill(time.monotonic())
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0.0
+            return (1 - self._tokens) / self.rate
+
+    def adjust(self, factor: float = 1.0, increment: float = 0.0, pause: float = 0.0,
+               min_rate: float = MIN_RATE, max_rate: Optional[float] = None) -> float:
+        """Меняет частоту (rate * factor + increment) и при pause > 0 забирает токены на pause секунд"""
+        with self._lock:
+            self._refill(time.monotonic())
+            rate = max(min_rate, self.rate * factor + increment)
+            self.rate = min(max_rate, rate) if max_rate else rate
+            if pause:
+                self._tokens = min(self._tokens, 0.0) - pause * self.rate
+            return self.rate
+
+
+class DbTokenBucket:
+    """Token bucket в PostgreSQL: один бюджет на все процессы и узлы"""
+
+    # Токены с учетом пополнения с момента updated_at.
+    # clock_timestamp(), а не now(): now() - время начала транзакции
+    REFILLED = "LEAST(:burst, tokens + rate * EXTRACT(EPOCH FROM clock_timestamp() - updated_at))"
+
+    def __init__(self, name: str, rate: float, burst: float):
+        self.name = name
+        self.burst = burst
+        self.session = get_db_session()
+        # Первый процесс создает бакет; остальные подхватывают текущие токены и частоту
+        self.session.execute(text(
+            "INSERT INTO rate_limit_buckets (name, tokens, rate, updated_at) "
+            "VALUES (:name, :burst, :rate, clock_timestamp()) ON CONFLICT (name) DO NOTHING"
+        ), {"name": name, "burst": burst, "rate": rate})
+        self.session.commit()
+        self._lock = threading.Lock()
+
+    @property
+    def rate(self) -> float:
+        with self._lock:
+            rate = self.session.query(RateLimitBucket.rate).filter(RateLimitBucket.name == self.name).scalar()
+            self.session.commit()
+            return rate
+
+    def try_acquire(self) -> float:
+        refilled = self.REFILLED
+        with self._lock:
+            try:
+                row = self.session.execute(text(
+                    f"UPDATE rate_limit_buckets SET tokens = {refilled} - 1, updated_at = clock_timestamp() "
+                    f"WHERE name = :name AND {refilled} >= 1 RETURNING tokens"
+                ), {"name": self.name, "burst": self.burst}).first()
+                if row is not None:
+                    self.session.commit()
+                    return 0.0
+                tokens, rate = self.session.execute(text(
+                    f"SELECT {refilled}, rate FROM rate_limit_buckets WHERE name = :name"
+                ), {"name": self.name, "burst": self.burst}).one()
+                self.session.commit()
+                return (1 - tokens) / rate
+            except Exception:
+                self.session.rollback()
+                raise
+
+    def adjust(self, factor: float = 1.0, increment: float = 0.0, pause: float = 0.0,
+               min_rate: float = MIN_RATE, max_rate: Optional[float] = None) -> float:
+        with self._lock:
+            try:
+                # В SET все выражения видят старые значения строки
+                new_rate = "LEAST(:max_rate, GREATEST(:min_rate, rate * :factor + :increment))"
+                rate = self.session.execute(text(
+                    f"UPDATE rate_limit_buckets SET rate = {new_rate}, "
+                    f"tokens = CASE WHEN :pause > 0 THEN LEAST({self.REFILLED}, 0) - :pause * {new_rate} "
+                    f"ELSE {self.REFILLED} END, updated_at = clock_timestamp() "
+                    "WHERE name = :name RETURNING rate"
+                ), {"name": self.name, "burst": self.burst, "factor": factor, "increment": increment,
+                    "pause": pause, "min_rate": min_rate, "max_rate": max_rate or 1e9}).scalar()
+                self.session.commit()
+                return rate
+            except Exception:
+                self.session.rollback()
+                raise
+
+
+class AdaptiveLimiter:
+    """Token bucket с адаптивной частотой (AIMD) и статистикой"""
+
+    def __init__(self, name: str, rate: float, burst: float, max_rate: float, backend: str = RATE_LIMIT_BACKEND):
+        self.name = name
+        self.max_rate = max_rate
+        self.bucket = DbTokenBucket(name, rate, burst) if backend == "db" else TokenBucket(name, rate, burst)
+        self.acquired = 0
+        self.throttled = 0
+        self.waited_seconds = 0.0
+        self._successes = 0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Ждет токен; вызывается перед каждым запросом"""
+        while True:
+            wait = self.bucket.try_acquire()
+            if wait <= 0:
+                break
+            self.waited_seconds += wait
+            time.sleep(wait)
+        self.acquired += 1
+
+    def on_success(self):
+        """Аддитивный рост частоты после AIMD_INCREASE_EVERY успешных запросов"""
+        with self._lock:
+            self._successes += 1
+            if self._successes < AIMD_INCREASE_EVERY:
+                return
+            self._successes = 0
+        self.bucket.adjust(increment=AIMD_INCREASE_STEP, max_rate=self.max_rate)
+
+    def on_throttle(self, retry_after: Optional[float] = None):
+        """Мультипликативное снижение частоты и пауза всего бакета"""
+        with self._lock:
+            self.throttled += 1
+            self._successes = 0
+        rate = self.bucket.adjust(factor=0.5, pause=retry_after or THROTTLE_PAUSE_SECONDS, max_rate=self.max_rate)
+        print(f"🐢 YouTube троттлинг ({self.name}): частота снижена до {rate:.2f} запросов/сек")
+
+    def stats(self) -> Dict:
+        return {
+            "rate": self.bucket.rate,
+            "acquired": self.acquired,
+            "throttled": self.throttled,
+            "waited_seconds": round(self.waited_seconds, 1),
+        }
+
+
+_limiters: Dict[str, AdaptiveLimiter] = {}
+_limiters_lock = threading.Lock()
+
+
+def youtube_limiter(kind: str) -> AdaptiveLimiter:
+    """Общий limiter процесса для типа запросов (comments, transcript)"""
+    with _limiters_lock:
+        if kind not in _limiters:
+            rate, burst, max_rate = RATE_LIMITS[kind]
+            _limiters[kind] = AdaptiveLimiter(kind, rate, burst, max_rate)
+        return _limiters[kind]
+
+
+def throttled_call(kind: str, func: Callable, *args, **kwargs):
+    """
+    Вызов с токеном limiter'а. Троттлинг снижает частоту и пробрасывается как YouTubeThrottled,
+    чтобы вызывающий код не спутал его с отсутствием данных
+    """
+    limiter = youtube_limiter(kind)
+    limiter.acquire()
+    try:
+        result = func(*args, **kwargs)
+    except Exception as e:
+        if is_throttle_error(e):
+            limiter.on_throttle()
+            raise YouTubeThrottled(f"{kind}: {type(e).__name__}: {e}") from e
+        raise
+    limiter.on_success()
+    return result
+
+
+def limit_session(session, kind: str):
+    """
+    Ограничивает каждый запрос requests.Session (заголовки и cookies сессии сохраняются).
+    Ответ 429 снижает частоту с учетом Retry-After
+    """
+    limiter = youtube_limiter(kind)
+    original_request = session.request
+
+    def request(method, url, *args, **kwargs):
+        limiter.acquire()
+        response = original_request(method, url, *args, **kwargs)
+        if response.status_code == 429:
+            limiter.on_throttle(HttpClient.retry_after(response))
+        elif response.status_code < 400:
+            limiter.on_success()
+        return response
+
+    session.request = request
+    return session
+
+
+def youtube_downloader():
+    """YoutubeCommentDownloader, все запросы которого идут через limiter comments"""
+    downloader = YoutubeCommentDownloader()
+    limit_session(downloader.session, "comments")
+    return downloader
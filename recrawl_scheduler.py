@@ -0,0 +1,247 @@
+"""
+Планировщик повторной загрузки комментариев по скорости их появления
+
+Каждая загрузка комментариев видео пишется в crawl_history. По истории оценивается
+скорость комментариев видео (экспоненциальное сглаживание с периодом полураспада
+RECRAWL_HALF_LIFE_HOURS) и стоимость загрузки в запросах к YouTube. Общий бюджет
+запросов в час распределяется между видео пропорционально sqrt(скорость / стоимость):
+горячие видео обновляются часто, затихшие - не реже раза в RECRAWL_MAX_INTERVAL_HOURS,
+но все вместе не превышают бюджет. Загрузки выполняются с паузами, которые держат
+фактическую частоту запросов не выше запланированной (защита от троттлинга YouTube).
+"""
+
+import math
+import os
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional
+
+from sqlalchemy import func, or_
+from sqlalchemy.orm import Session
+
+from models import CrawlHistory, Video, get_db_session
+
+RECRAWL_BUDGET_PER_HOUR = float(os.getenv("RECRAWL_BUDGET_PER_HOUR", "600"))  # запросов к YouTube в час
+RECRAWL_MIN_INTERVAL_HOURS = float(os.getenv("RECRAWL_MIN_INTERVAL_HOURS", "0.25"))
+RECRAWL_MAX_INTERVAL_HOURS = float(os.getenv("RECRAWL_MAX_INTERVAL_HOURS", "168"))
+RECRAWL_HALF_LIFE_HOURS = 24.0  # вес старых интервалов истории падает вдвое за столько часов
+RECRAWL_PRIOR_HOURS = 24.0  # первая загрузка: считаем, что комментарии набраны за столько часов
+RECRAWL_HISTORY = 20  # последних загрузок видео для оценки
+COMMENTS_PER_PAGE = 20  # комментариев в одном ответе YouTube (страница продолжения)
+
+
+def estimate_requests(fetched: int) -> int:
+    """Оценка числа запросов загрузки: страница видео + страницы ленты комментариев"""
+    return 1 + max(1, math.ceil(fetched / COMMENTS_PER_PAGE))
+
+
+def record_crawl(session: Session, video_id: int, new_comments: int, fetched: int,
+                 duration_seconds: Optional[float] = None, error: Optional[str] = None) -> CrawlHistory:
+    crawl = CrawlHistory(video_id=video_id, new_comments=new_comments, fetched=fetched,
+                         requests=estimate_requests(fetched), duration_seconds=duration_seconds,
+                         error=error[-2000:] if error else None)
+    session.add(crawl)
+    session.commit()
+    return crawl
+
+
+class VideoCrawlStats:
+    """Оценки по истории загрузок видео"""
+
+    def __init__(self, video_id: int, velocity: float, cost: float, last_crawled_at: datetime):
+        self.video_id = video_id
+        self.velocity = velocity  # новых комментариев в час
+        self.cost = cost  # запросов на одну загрузку
+        self.last_crawled_at = last_crawled_at
+
+
+class CrawlPlanItem:
+    """Запланированная частота загрузки видео"""
+
+    def __init__(self, video_id: int, velocity: float, cost: float, interval_hours: float, next_crawl_at: datetime):
+        self.video_id = video_id
+        self.velocity = velocity
+        self.cost = cost
+        self.interval_hours = interval_hours
+        self.next_crawl_at = next_crawl_at
+
+    def as_dict(self) -> Dict:
+        return {
+            "video_id": self.video_id,
+            "velocity_per_hour": self.velocity,
+            "cost_requests": self.cost,
+            "interval_hours": self.interval_hours,
+            "next_crawl_at": self.next_crawl_at.isoformat(),
+            "requests_per_hour": self.requests_per_hour,
+        }
+
+    @property
+    def requests_per_hour(self) -> float:
+        return self.cost / self.interval_hours
+
+
+def load_stats(session: Session) -> List[VideoCrawlStats]:
+    """Скорость и стоимость загрузки для всех видео с историей загрузок"""
+    row_number = func.row_number().over(
+        partition_by=CrawlHistory.video_id, order_by=CrawlHistory.crawled_at.desc()
+    ).label("row_number")
+    recent = session.query(
+        CrawlHistory.video_id, CrawlHistory.crawled_at, CrawlHistory.new_comments,
+        CrawlHistory.requests, row_number,
+    ).filter(CrawlHistory.error.is_(None)).subquery()
+    rows = session.query(
+        recent.c.video_id, recent.c.crawled_at, recent.c.new_comments, recent.c.requests
+    ).filter(recent.c.row_number <= RECRAWL_HISTORY).order_by(recent.c.video_id, recent.c.crawled_at).all()
+
+    history: Dict[int, list] = {}
+    for video_id, crawled_at, new_comments, requests in rows:
+        history.setdefault(video_id, []).append((crawled_at, new_comments, requests))
+    return [estimate_stats(video_id, crawls) for video_id, crawls in history.items()]
+
+
+def estimate_stats(video_id: int, crawls: list) -> VideoCrawlStats:
+    """
+    Сглаженная скорость по интервалам между загрузками (от старых к новым):
+    вес нового интервала 1 - 0.5^(длительность / период полураспада)
+    """
+    _, first_new, _ = crawls[0]
+    velocity = first_new / RECRAWL_PRIOR_HOURS
+    for (prev_at, _, _), (crawled_at, new_comments, _) in zip(crawls, crawls[1:]):
+        hours = max((crawled_at - prev_at).total_seconds() / 3600, 1e-3)
+        alpha = 1 - 0.5 ** (hours / RECRAWL_HALF_LIFE_HOURS)
+        velocity = alpha * (new_comments / hours) + (1 - alpha) * velocity
+    # Первая загрузка читает всю ленту - стоимость повторных оцениваем по остальным
+    incremental = crawls[1:] or crawls
+    cost = sum(requests for _, _, requests in incremental) / len(incremental)
+    return VideoCrawlStats(video_id, velocity, max(1.0, cost), crawls[-1][0])
+
+
+def plan_crawls(stats: List[VideoCrawlStats], budget_per_hour: float = RECRAWL_BUDGET_PER_HOUR) -> List[CrawlPlanItem]:
+    """
+    Распределяет бюджет запросов в час: каждому видео минимальная частота
+    (1 / RECRAWL_MAX_INTERVAL_HOURS), остаток - пропорционально sqrt(скорость / стоимость)
+    с ограничением сверху 1 / RECRAWL_MIN_INTERVAL_HOURS; срезанный ограничением остаток
+    перераспределяется между остальными видео
+    """
+    if not stats:
+        return []
+    min_rate = 1 / RECRAWL_MAX_INTERVAL_HOURS
+    max_rate = 1 / RECRAWL_MIN_INTERVAL_HOURS
+    reserved = sum(min_rate * s.cost for s in stats)
+    if reserved >= budget_per_hour:
+        # Бюджета не хватает даже на минимальную частоту - делим поровну по стоимости
+        print(f"⚠️ Бюджета {budget_per_hour:.0f} запросов/ч не хватает на {len(stats)} видео: "
+              f"нужно минимум {reserved:.0f}")
+        rates = {s.video_id: budget_per_hour / sum(x.cost for x in stats) for s in stats}
+    else:
+        rates = {s.video_id: min_rate for s in stats}
+        remaining = budget_per_hour - reserved
+        active = [s for s in stats if s.velocity > 0]
+        while remaining > 1e-9 and active:
+            weights = {s.video_id: math.sqrt(s.velocity / s.cost) for s in active}
+            norm = sum(weights[s.video_id] * s.cost for s in active)
+            capped = []
+            spent = 0.0
+            for s in active:
+                extra = remaining * weights[s.video_id] / norm
+                new_rate = min(max_rate, rates[s.video_id] + extra)
+                spent += (new_rate - rates[s.video_id]) * s.cost
+                rates[s.video_id] = new_rate
+                if new_rate >= max_rate:
+                    capped.append(s)
+            remaining -= spent
+            if not capped:
+                break
+            active = [s for s in active if s not in capped]
+
+    return [
+        CrawlPlanItem(
+            video_id=s.video_id,
+            velocity=s.velocity,
+            cost=s.cost,
+            interval_hours=1 / rates[s.video_id],
+            next_crawl_at=s.last_crawled_at + timedelta(hours=1 / rates[s.video_id]),
+        )
+        for s in sorted(stats, key=lambda s: -rates[s.video_id])
+    ]
+
+
+def untracked_videos(session: Session) -> List[int]:
+    """
+    Видео без успешных загрузок: обработаны до появления планировщика или все их загрузки
+    завершились ошибкой (load_stats такие видео не видит, и без этого они не загружались бы никогда).
+    После ошибки видео повторяется не раньше, чем через RECRAWL_MIN_INTERVAL_HOURS
+    """
+    retry_after = datetime.now(timezone.utc) - timedelta(hours=RECRAWL_MIN_INTERVAL_HOURS)
+    return [video_id for (video_id,) in session.query(Video.id).filter(
+        Video.video_id.isnot(None),
+        ~session.query(CrawlHistory.id).filter(
+            CrawlHistory.video_id == Video.id,
+            or_(CrawlHistory.error.is_(None), CrawlHistory.crawled_at > retry_after),
+        ).exists(),
+    ).order_by(Video.id)]
+
+
+def planned_fetch_rate(plan: List[CrawlPlanItem]) -> float:
+    """Запланированная частота запросов к YouTube (в час)"""
+    return sum(item.requests_per_hour for item in plan)
+
+
+def crawl_video(session: Session, video_id: int, gemini_api_key: Optional[str] = None) -> CrawlHistory:
+    """Дозагружает новые комментарии видео, ранжирует их и пишет загрузку в историю"""
+    # Импорт здесь: загрузка тянет youtube_comment_downloader и ранжировщики
+    from live_tail import LiveTail
+    from ranking_shards import build_ranker
+
+    youtube_id, summary = session.query(Video.video_id, Video.summary).filter(Video.id == video_id).one()
+    tail = LiveTail(youtube_id, video_id, gemini_api_key)
+    start_time = time.time()
+    try:
+        new_comments = tail.fetch_new()
+    except Exception as e:
+        print(f"❌ Видео {video_id}: ошибка загрузки: {e}")
+        return record_crawl(session, video_id, 0, tail.last_fetched, time.time() - start_time, str(e))
+    crawl = record_crawl(session, video_id, new_comments, tail.last_fetched, time.time() - start_time)
+    print(f"📥 Видео {video_id}: +{new_comments} комментариев (прочитано {tail.last_fetched}, ~{crawl.requests} запросов)")
+    if new_comments and summary:
+        build_ranker(tail.gemini_api_key).rank_comments_for_video(video_id)
+    return crawl
+
+
+class RecrawlScheduler:
+    """Цикл планирования и выполнения повторных загрузок в пределах бюджета запросов"""
+
+    def __init__(self, budget_per_hour: float = RECRAWL_BUDGET_PER_HOUR, gemini_api_key: str = None):
+        self.budget_per_hour = budget_per_hour
+        self.gemini_api_key = gemini_api_key or os.getenv('GEMINI_API_KEY')
+        self.session = get_db_session()
+
+    def plan(self) -> List[CrawlPlanItem]:
+        plan = plan_crawls(load_stats(self.session), self.budget_per_hour)
+        self.session.rollback()
+        return plan
+
+    def run(self, once: bool = False):
+        """Выполняет загрузки, срок которых наступил; once - один проход по плану"""
+        print(f"🗓️ Планировщик загрузок запущен: бюджет {self.budget_per_hour:.0f} запросов/ч")
+        try:
+            while True:
+                plan = self.plan()
+                print(f"🗓️ План: {len(plan)} видео, {planned_fetch_rate(plan):.1f} запросов/ч "
+                      f"(бюджет {self.budget_per_hour:.0f})")
+                now = datetime.now(timezone.utc)
+                due = sorted((item for item in plan if item.next_crawl_at <= now), key=lambda item: item.next_crawl_at)
+                # Видео без истории загружаются первыми: так появляется первая оценка скорости
+                due_ids = untracked_videos(self.session) + [item.video_id for item in due]
+                for video_id in due_ids:
+                    crawl = crawl_video(self.session, video_id, self.gemini_api_key)
+                    # Пауза пропорциональна потраченным запросам: частота не выше бюджета
+                    time.sleep(crawl.requests * 3600 / self.budget_per_hour)
+                if once:
+                    return
+                if not due_ids:
+                    upcoming = min((item.next_crawl_at for item in plan), default=None)
+                    wait = (upcoming - now).total_seconds() if upcoming else 60
+                    time.sleep(min(max(wait, 1), 300))
+        finally:
+            self.session.close()
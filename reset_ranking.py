@@ -10,6 +10,7 @@ docker-compose run --rm comments-downloader python reset_ranking.py --stats
 """
 
 from models import get_db_session, Video, Comment
+from stage_state import reset_stages
 
 def reset_ranking_for_video(video_id: int) -> bool:
     """
@@ -45,6 +46,8 @@ def reset_ranking_for_video(video_id: int) -> bool:
         for comment in ranked_comments:
             comment.comment_rank = None
         
+        # Иначе повторная обработка пропустит этап rank со статусом done
+        reset_stages(session, [video_id], ["rank"])
         session.commit()
         print(f"✅ Ранжирование сброшено для видео {video_id}")
         return True
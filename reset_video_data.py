@@ -19,6 +19,7 @@ docker-compose run --rm comments-downloader python reset_video_data.py --all
 """
 
 from models import get_db_session, Video, Comment
+from stage_state import reset_stages
 
 def reset_video_data(video_id: int, transcript_only: bool = False, summary_only: bool = False) -> bool:
     """
@@ -49,11 +50,13 @@ def reset_video_data(video_id: int, transcript_only: bool = False, summary_only:
         reset_summary = not transcript_only
         
         changes_made = False
+        reset = []
         
         # Сбрасываем транскрипт
         if reset_transcript and video.transcript:
             print(f"🔄 Сбрасываю транскрипт (длина: {len(video.transcript)} символов)")
             video.transcript = None
+            reset.append("transcript")
             changes_made = True
         elif reset_transcript:
             print("ℹ️ Транскрипт уже отсутствует")
@@ -62,11 +65,14 @@ def reset_video_data(video_id: int, transcript_only: bool = False, summary_only:
         if reset_summary and video.summary:
             print(f"🔄 Сбрасываю summary (длина: {len(video.summary)} символов)")
             video.summary = None
+            reset.append("summary")
             changes_made = True
         elif reset_summary:
             print("ℹ️ Summary уже отсутствует")
         
         if changes_made:
+            # Иначе повторная обработка пропустит этапы со статусом done
+            reset_stages(session, [video_id], reset)
             session.commit()
             print(f"✅ Данные видео {video_id} сброшены")
         else:
@@ -128,6 +134,7 @@ def reset_all_video_data() -> bool:
             video.summary = None
             reset_count += 1
         
+        reset_stages(session, [video.id for video in videos_with_data], ["transcript", "summary"])
         session.commit()
         print(f"✅ Данные сброшены для {reset_count} видео")
         
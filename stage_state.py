@@ -0,0 +1,161 @@
+"""
+Машина состояний этапов обработки видео
+
+Для каждого видео и этапа (ingest, transcript, summary, rank) в таблице video_stage_states
+хранятся статус (pending, running, done, failed), время и хэши входа и выхода.
+Повторный запуск решает, что делать, только по этим метаданным, не загружая тексты:
+- done и вход не изменился - этап пропускается;
+- running/failed - этап прерван и продолжается;
+- done, но output_hash вышестоящего этапа изменился (например, новый транскрипт) -
+  этап устарел и выполняется заново вместе со всеми нижестоящими;
+- done, но результат удален (скрипты сброса reset_video_data.py, reset_ranking.py
+  возвращают этапы в pending через reset_stages, а ручная очистка видна по NULL
+  в videos и непроранжированным комментариям) - этап выполняется заново.
+"""
+
+import hashlib
+from contextlib import contextmanager
+from typing import Dict, Iterable, Iterator, List, Optional
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from models import Comment, Video, VideoStageState
+
+STAGES = ("ingest", "transcript", "summary", "rank")
+# Вход этапа - результат предыдущего; транскрипт зависит только от ID видео
+UPSTREAM = {"summary": "transcript", "rank": "summary"}
+
+
+def content_hash(text: Optional[str]) -> Optional[str]:
+    """md5 текста в UTF-8 - совпадает с md5() PostgreSQL, поэтому старые данные хэшируются на стороне БД"""
+    if text is None:
+        return None
+    return hashlib.md5(text.encode('utf-8')).hexdigest()
+
+
+def reset_stages(session: Session, video_ids: Iterable[int], stages: Iterable[str]) -> int:
+    """Возвращает этапы видео в pending после сброса их результатов (коммит - за вызывающим)"""
+    return session.query(VideoStageState).filter(
+        VideoStageState.video_id.in_(list(video_ids)), VideoStageState.stage.in_(list(stages))
+    ).update({VideoStageState.status: "pending"}, synchronize_session=False)
+
+
+class StageResult:
+    """Результат этапа, который заполняет код внутри StageTracker.run()"""
+
+    def __init__(self):
+        self.output_hash: Optional[str] = None
+
+
+class StageTracker:
+    """Состояние этапов одного видео"""
+
+    def __init__(self, session: Session, video_id: int):
+        self.session = session
+        self.video_id = video_id
+        self.states: Dict[str, VideoStageState] = {
+            state.stage: state
+            for state in session.query(VideoStageState).filter_by(video_id=video_id)
+        }
+        if len(self.states) < len(STAGES):
+            self._bootstrap()
+
+    def _bootstrap(self):
+        """
+        Создает недостающие состояния для видео, обработанных до появления таблицы.
+        Наличие и хэши текстов считаются в PostgreSQL - сами тексты не передаются
+        """
+        has_transcript, transcript_hash, has_summary, summary_hash = self.session.query(
+            Video.transcript.isnot(None), func.md5(Video.transcript),
+            Video.summary.isnot(None), func.md5(Video.summary),
+        ).filter(Video.id == self.video_id).one()
+        total, unranked = self.session.query(
+            func.count(Comment.id), func.count(Comment.id).filter(Comment.comment_rank.is_(None))
+        ).filter(Comment.video_id == self.video_id).one()
+
+        known = {
+            "ingest": ("done", None, None),
+            "transcript": ("done", None, transcript_hash) if has_transcript else ("pending", None, None),
+            "summary": ("done", transcript_hash, summary_hash) if has_summary else ("pending", None, None),
+            "rank": ("done", summary_hash, None) if total and not unranked else ("pending", None, None),
+        }
+        for stage in STAGES:
+            if stage in self.states:
+                continue
+            status, input_hash, output_hash = known[stage]
+            state = VideoStageState(video_id=self.video_id, stage=stage, status=status,
+                                    input_hash=input_hash, output_hash=output_hash)
+            self.session.add(state)
+            self.states[stage] = state
+        self.session.commit()
+
+    def expected_input(self, stage: str) -> Optional[str]:
+        upstream = UPSTREAM.get(stage)
+        return self.states[upstream].output_hash if upstream else None
+
+    def is_stale(self, stage: str) -> bool:
+        """Этап выполнен, но с тех пор изменился результат вышестоящего этапа"""
+        state = self.states[stage]
+        return state.status == "done" and state.input_hash != self.expected_input(stage)
+
+    def output_missing(self, stage: str) -> bool:
+        """Результат выполненного этапа удален в обход трекера (проверка в БД, тексты не читаются)"""
+        if stage == "transcript":
+            return self.session.query(Video.transcript.is_(None)).filter(Video.id == self.video_id).scalar()
+        if stage == "summary":
+            return self.session.query(Video.summary.is_(None)).filter(Video.id == self.video_id).scalar()
+        if stage == "rank":
+            return self.session.query(Comment.id).filter(
+                Comment.video_id == self.video_id, Comment.comment_rank.is_(None)
+            ).first() is not None
+        return False
+
+    def needs_run(self, stage: str) -> bool:
+        state = self.states[stage]
+        return state.status != "done" or self.is_stale(stage) or self.output_missing(stage)
+
+    def pending_stages(self) -> List[str]:
+        """Этапы, которые нужно выполнить: первый невыполненный или устаревший и все после него"""
+        for index, stage in enumerate(STAGES):
+            if self.needs_run(stage):
+                return list(STAGES[index:])
+        return []
+
+    def invalidate(self, stage: str):
+        """Принудительный повтор этапа (нижестоящие устареют, когда изменится его результат)"""
+        self.states[stage].status = "pending"
+        self.session.commit()
+
+    @contextmanager
+    def run(self, stage: str) -> Iterator[StageResult]:
+        """Отмечает этап как running, а по завершении блока - done или failed"""
+        state = self.states[stage]
+        state.status = "running"
+        state.input_hash = self.expected_input(stage)
+        state.error = None
+        state.started_at = func.now()
+        state.finished_at = None
+        self.session.commit()
+
+        result = StageResult()
+        try:
+            yield result
+        except Exception as e:
+            self.session.rollback()
+            state.status = "failed"
+            state.error = f"{type(e).__name__}: {e}"[:2000]
+            state.finished_at = func.now()
+            self.session.commit()
+            raise
+        state.status = "done"
+        state.output_hash = result.output_hash
+        state.finished_at = func.now()
+        self.session.commit()
+
+    def describe(self) -> str:
+        marks = {"done": "✅", "running": "⏳", "failed": "❌", "pending": "⬜"}
+        return "  ".join(
+            f"{stage}: {'♻️' if self.is_stale(stage) else marks.get(self.states[stage].status, '?')}"
+            for stage in STAGES
+        )
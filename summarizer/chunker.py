@@ -0,0 +1,95 @@
+"""
+Разбиение длинного текста на чанки по границам предложений с учетом бюджета токенов.
+
+Модуль не зависит от llama.cpp: функция подсчета токенов передается снаружи
+(токенизатор модели, tokenizer Gemini или грубая оценка approx_token_count).
+"""
+
+import math
+import re
+from typing import Callable, List
+
+TokenCounter = Callable[[str], int]
+
+# Конец предложения (в т.ч. для кириллицы) или перевод строки - граница сегмента транскрипта
+SENTENCE_BOUNDARY_RE = re.compile(r'(?<=[.!?…])\s+|\s*\n+\s*')
+
+
+def approx_token_count(text: str) -> int:
+    """Грубая оценка количества токенов, если токенизатор модели недоступен"""
+    # Кириллица занимает 2 байта в UTF-8 и токенизируется мельче латиницы
+    return max(1, len(text.encode('utf-8')) // 3)
+
+
+def split_sentences(text: str) -> List[str]:
+    """Делит текст на предложения/сегменты, не разрывая слова"""
+    return [s.strip() for s in SENTENCE_BOUNDARY_RE.split(text) if s and s.strip()]
+
+
+def _split_oversized(segment: str, tokens: int, max_tokens: int, count_tokens: TokenCounter) -> List[str]:
+    """Делит слишком длинное предложение (например, автосубтитры без пунктуации) по словам"""
+    words = segment.split()
+    if len(words) <= 1:
+        return [segment]
+    # Целимся в 90% бюджета, чтобы куски после округления не вылезали за max_tokens
+    parts = min(len(words), math.ceil(tokens / (max_tokens * 0.9)))
+    size = math.ceil(len(words) / parts)
+    result = []
+    for i in range(0, len(words), size):
+        piece = " ".join(words[i:i + size])
+        piece_tokens = count_tokens(piece)
+        if piece_tokens > max_tokens and size > 1:
+            result.extend(_split_oversized(piece, piece_tokens, max_tokens, count_tokens))
+        else:
+            result.append(piece)
+    return result
+
+
+def pack_segments(segments: List[str], count_tokens: TokenCounter, max_tokens: int,
+                  overlap_tokens: int = 0) -> List[List[str]]:
+    """
+    Упаковывает сегменты в группы, каждая из которых укладывается в max_tokens
+
+    Args:
+        segments: Предложения, сегменты транскрипта или частичные summary
+        count_tokens: Функция подсчета токенов
+        max_tokens: Бюджет токенов на одну группу
+        overlap_tokens: Сколько токенов из конца предыдущей группы повторить в начале следующей
+
+    Returns:
+        List[List[str]]: Группы сегментов в исходном порядке
+    """
+    sized = []
+    for segment in segments:
+        tokens = count_tokens(segment)
+        if tokens > max_tokens:
+            for piece in _split_oversized(segment, tokens, max_tokens, count_tokens):
+                sized.append((piece, count_tokens(piece)))
+        else:
+            sized.append((segment, tokens))
+
+    groups: List[List[str]] = []
+    current: List[tuple] = []
+    current_tokens = 0
+    for segment, tokens in sized:
+        # +1 токен на разделитель между сегментами
+        if current and current_tokens + tokens + 1 > max_tokens:
+            groups.append([s for s, _ in current])
+            # Перекрытие: хвост предыдущей группы в пределах overlap_tokens
+            tail, tail_tokens = [], 0
+            for prev, prev_tokens in reversed(current):
+                if tail_tokens + prev_tokens + 1 > overlap_tokens or tail_tokens + prev_tokens + tokens + 2 > max_tokens:
+                    break
+                tail.insert(0, (prev, prev_tokens))
+                tail_tokens += prev_tokens + 1
+            current, current_tokens = tail, tail_tokens
+        current.append((segment, tokens))
+        current_tokens += tokens + 1
+    if current:
+        groups.append([s for s, _ in current])
+    return groups
+
+
+def chunk_text(text: str, count_tokens: TokenCounter, max_tokens: int, overlap_tokens: int = 0) -> List[str]:
+    """Делит текст на чанки до max_tokens токенов по границам предложений"""
+    return [" ".join(group) for group in pack_segments(split_sentences(text), count_tokens, max_tokens, overlap_tokens)]
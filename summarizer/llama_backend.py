@@ -0,0 +1,351 @@
+import os
+import subprocess
+import threading
+import time
+from typing import Dict, List, Optional, Set, Tuple
+
+import requests
+
+
+class PrefixCacheStats:
+    """Статистика переиспользования KV-кэша общего префикса промптов"""
+
+    def __init__(self):
+        self.hits = 0            # запрос попал в слот, где уже лежит KV-кэш его префикса
+        self.misses = 0
+        self.prompt_tokens = 0   # всего токенов в промптах
+        self.reused_tokens = 0   # токенов взято из KV-кэша без повторного вычисления
+        self._lock = threading.Lock()
+
+    def record(self, hit: bool, prompt_tokens: int, reused_tokens: int):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+            self.prompt_tokens += prompt_tokens
+            self.reused_tokens += reused_tokens
+
+    def as_dict(self) -> Dict:
+        with self._lock:
+            return {
+                "prefix_hits": self.hits,
+                "prefix_misses": self.misses,
+                "prompt_tokens": self.prompt_tokens,
+                "reused_tokens": self.reused_tokens,
+                "reused_ratio": self.reused_tokens / self.prompt_tokens if self.prompt_tokens else 0.0,
+            }
+
+
+class LlamaServer:
+    """
+    Резидентный процесс llama-server.
+
+    Модель загружается один раз при старте сервиса и остается в памяти,
+    поэтому каждый запрос тратит время только на инференс, а не на чтение GGUF с диска.
+    """
+
+    def __init__(self, server_path: str, model_path: str, port: int = 8080,
+                 ctx_size: int = 4096, threads: Optional[int] = None, slots: int = 1,
+                 cpus: Optional[List[int]] = None, prefix_stats: Optional[PrefixCacheStats] = None,
+                 extra_args: Optional[List[str]] = None):
+        self.server_path = server_path
+        self.model_path = model_path
+        self.port = port
+        self.ctx_size = ctx_size
+        self.threads = threads
+        self.slots = slots
+        self.cpus = cpus  # набор ядер, к которому привязан процесс (None - без привязки)
+        self.extra_args = extra_args or []
+
+        self.process: Optional[subprocess.Popen] = None
+        self.load_time: Optional[float] = None  # Время загрузки модели в секундах
+        self.error: Optional[str] = None
+        self._ready = threading.Event()
+        self._http = requests.Session()
+
+        # Какой префикс (хэш) лежит в KV-кэше каждого слота и какие слоты сейчас заняты
+        self.prefix_stats = prefix_stats or PrefixCacheStats()
+        self._slot_prefix: Dict[int, str] = {}
+        self._slot_last_used: Dict[int, float] = {}
+        self._busy_slots: Set[int] = set()
+        self._slot_lock = threading.Lock()
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.port}"
+
+    def command(self) -> List[str]:
+        """Формирует командную строку запуска llama-server"""
+        args = [
+            self.server_path,
+            "-m", self.model_path,
+            "--host", "127.0.0.1",
+            "--port", str(self.port),
+            "-c", str(self.ctx_size),
+        ]
+        if self.threads:
+            args += ["--threads", str(self.threads)]
+        if self.slots > 1:
+            args += ["--parallel", str(self.slots), "--cont-batching"]
+        return args + self.extra_args
+
+    def start(self):
+        """Запускает процесс llama-server (без ожидания загрузки модели)"""
+        if not os.path.exists(self.model_path):
+            raise FileNotFoundError(f"Модель не найдена: {self.model_path}")
+        print(f"[DEBUG] Запуск llama-server: {' '.join(self.command())}" + (f" (CPU {self.cpus})" if self.cpus else ""))
+        cpus = self.cpus
+        # Привязка к ядрам наследуется всеми потоками llama-server
+        preexec_fn = (lambda: os.sched_setaffinity(0, cpus)) if cpus else None
+        self.process = subprocess.Popen(self.command(), preexec_fn=preexec_fn)
+
+    def wait_until_ready(self, timeout: float = 600) -> bool:
+        """Ждет, пока llama-server загрузит модель и ответит 200 на /health"""
+        started = time.time()
+        while time.time() - started < timeout:
+            if self.process is not None and self.process.poll() is not None:
+                self.error = f"llama-server завершился с кодом {self.process.returncode}"
+                print(f"[ERROR] {self.error}")
+                return False
+            try:
+                # Пока модель загружается, llama-server отвечает 503
+                response = self._http.get(f"{self.base_url}/health", timeout=2)
+                if response.status_code == 200:
+                    self.load_time = time.time() - started
+                    self._ready.set()
+                    print(f"✅ Модель загружена за {self.load_time:.2f} сек: {self.model_path}")
+                    return True
+            except requests.exceptions.RequestException:
+                pass
+            time.sleep(0.5)
+        self.error = f"Модель не загрузилась за {timeout} сек"
+        print(f"[ERROR] {self.error}")
+        return False
+
+    def start_in_background(self, timeout: float = 600) -> threading.Thread:
+        """Запускает сервер и загрузку модели в фоне, чтобы API сразу отвечал на /health"""
+        def run():
+            try:
+                self.start()
+                self.wait_until_ready(timeout)
+            except Exception as e:
+                self.error = str(e)
+                print(f"[ERROR] Не удалось запустить llama-server: {e}")
+
+        thread = threading.Thread(target=run, name="llama-server-loader", daemon=True)
+        thread.start()
+        return thread
+
+    def is_ready(self) -> bool:
+        """Модель загружена и процесс llama-server жив"""
+        return self._ready.is_set() and self.process is not None and self.process.poll() is None
+
+    def _acquire_slot(self, prefix_key: Optional[str]) -> Tuple[int, bool]:
+        """
+        Выбирает слот для запроса: свободный слот, в KV-кэше которого уже лежит этот префикс,
+        иначе - давно не использованный свободный слот
+
+        Returns:
+            Tuple[int, bool]: номер слота (-1 - выбор за llama-server) и попадание по префиксу
+        """
+        with self._slot_lock:
+            idle = [slot for slot in range(self.slots) if slot not in self._busy_slots]
+            if not idle:
+                return -1, False
+            hit = prefix_key is not None and any(self._slot_prefix.get(slot) == prefix_key for slot in idle)
+            if hit:
+                slot = next(slot for slot in idle if self._slot_prefix.get(slot) == prefix_key)
+            else:
+                slot = min(idle, key=lambda s: self._slot_last_used.get(s, 0.0))
+                self._slot_prefix[slot] = prefix_key
+            self._busy_slots.add(slot)
+            self._slot_last_used[slot] = time.time()
+            return slot, hit
+
+    def _release_slot(self, slot: int):
+        with self._slot_lock:
+            self._busy_slots.discard(slot)
+
+    def has_idle_prefix(self, prefix_key: str) -> bool:
+        """Есть ли свободный слот, в KV-кэше которого уже лежит этот префикс"""
+        with self._slot_lock:
+            return any(self._slot_prefix.get(slot) == prefix_key
+                       for slot in range(self.slots) if slot not in self._busy_slots)
+
+    def complete(self, prompt: str, n_predict: int = 64, temperature: float = 0.7,
+                 timeout: float = 300, prefix_key: Optional[str] = None, **params) -> Dict:
+        """
+        Выполняет генерацию на уже загруженной модели
+
+        Args:
+            prefix_key: Хэш общего префикса промпта (системный промпт, summary видео).
+                Запросы с одинаковым префиксом направляются в слот, где его KV-кэш уже посчитан,
+                и llama-server (cache_prompt) вычисляет только новый суффикс
+
+        Returns:
+            Dict: ответ llama-server (/completion): content, timings, tokens_evaluated и т.д.;
+                дополнительно prefix_hit и reused_tokens
+        """
+        if not self.is_ready():
+            raise RuntimeError("Модель еще не загружена")
+        payload = {"prompt": prompt, "n_predict": n_predict, "temperature": temperature, "cache_prompt": True}
+        payload.update(params)
+        slot, hit = self._acquire_slot(prefix_key)
+        payload["id_slot"] = slot
+        try:
+            response = self._http.post(f"{self.base_url}/completion", json=payload, timeout=timeout)
+            response.raise_for_status()
+            result = response.json()
+        finally:
+            if slot >= 0:
+                self._release_slot(slot)
+
+        # tokens_evaluated - длина промпта, timings.prompt_n - сколько токенов реально вычислено
+        prompt_tokens = result.get("tokens_evaluated", 0) or 0
+        evaluated = (result.get("timings") or {}).get("prompt_n", prompt_tokens)
+        reused = max(0, prompt_tokens - evaluated)
+        self.prefix_stats.record(hit, prompt_tokens, reused)
+        result["prefix_hit"] = hit
+        result["reused_tokens"] = reused
+        return result
+
+    def tokenize(self, text: str, timeout: float = 30) -> List[int]:
+        """Токенизирует текст токенизатором загруженной модели"""
+        if not self.is_ready():
+            raise RuntimeError("Модель еще не загружена")
+        response = self._http.post(f"{self.base_url}/tokenize", json={"content": text}, timeout=timeout)
+        response.raise_for_status()
+        return response.json().get("tokens", [])
+
+    def stop(self):
+        """Останавливает процесс llama-server"""
+        self._ready.clear()
+        if self.process is not None and self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+
+
+def physical_cores() -> List[List[int]]:
+    """Доступные процессу логические CPU, сгруппированные по физическим ядрам"""
+    cores: Dict[str, List[int]] = {}
+    for cpu in sorted(os.sched_getaffinity(0)):
+        try:
+            with open(f"/sys/devices/system/cpu/cpu{cpu}/topology/thread_siblings_list") as f:
+                key = f.read().strip()
+        except OSError:
+            key = str(cpu)
+        cores.setdefault(key, []).append(cpu)
+    return list(cores.values())
+
+
+def plan_instances(instances: int = 0, threads_per_instance: int = 4) -> List[Tuple[List[int], int]]:
+    """
+    Делит физические ядра между экземплярами модели
+
+    Args:
+        instances: Количество экземпляров (0 - по числу ядер / threads_per_instance)
+        threads_per_instance: Сколько физических ядер (= потоков llama.cpp) отдать одному экземпляру
+
+    Returns:
+        List[Tuple[List[int], int]]: Логические CPU каждого экземпляра (вместе с гипертредами
+            его ядер) и число физических ядер - значение --threads
+    """
+    cores = physical_cores()
+    if not instances:
+        instances = max(1, len(cores) // threads_per_instance)
+    instances = max(1, min(instances, len(cores)))
+    per_instance = len(cores) // instances
+    plan = []
+    for i in range(instances):
+        # Остаток ядер при неровном делении достается последнему экземпляру
+        end = (i + 1) * per_instance if i < instances - 1 else len(cores)
+        group = cores[i * per_instance:end]
+        plan.append((sorted(cpu for core in group for cpu in core), len(group)))
+    return plan
+
+
+class LlamaPool:
+    """
+    Пул экземпляров llama-server, каждый привязан к своему набору ядер.
+
+    Веса модели загружаются через mmap и делят page cache, поэтому N экземпляров
+    не занимают N раз память под модель. Запрос направляется в экземпляр, у которого
+    есть свободный слот с нужным префиксом в KV-кэше, иначе - в наименее загруженный.
+    """
+
+    def __init__(self, servers: List[LlamaServer]):
+        self.servers = servers
+        self._in_flight = {id(server): 0 for server in servers}
+        self._lock = threading.Lock()
+
+    @property
+    def slots(self) -> int:
+        return sum(server.slots for server in self.servers)
+
+    @property
+    def prefix_stats(self) -> PrefixCacheStats:
+        return self.servers[0].prefix_stats  # общий объект статистики для всех экземпляров
+
+    @property
+    def load_time(self) -> Optional[float]:
+        times = [server.load_time for server in self.servers if server.load_time is not None]
+        return max(times) if times else None
+
+    @property
+    def error(self) -> Optional[str]:
+        return next((server.error for server in self.servers if server.error), None)
+
+    def start_in_background(self, timeout: float = 600):
+        for server in self.servers:
+            server.start_in_background(timeout)
+
+    def ready_servers(self) -> List[LlamaServer]:
+        return [server for server in self.servers if server.is_ready()]
+
+    def is_ready(self) -> bool:
+        return bool(self.ready_servers())
+
+    def _pick(self, prefix_key: Optional[str]) -> LlamaServer:
+        with self._lock:
+            ready = self.ready_servers()
+            if not ready:
+                raise RuntimeError("Модель еще не загружена")
+            load = lambda server: self._in_flight[id(server)] / server.slots
+            with_prefix = [s for s in ready if prefix_key and s.has_idle_prefix(prefix_key)]
+            server = min(with_prefix or ready, key=load)
+            self._in_flight[id(server)] += 1
+            return server
+
+    def complete(self, prompt: str, **params) -> Dict:
+        server = self._pick(params.get("prefix_key"))
+        try:
+            return server.complete(prompt, **params)
+        finally:
+            with self._lock:
+                self._in_flight[id(server)] -= 1
+
+    def tokenize(self, text: str, timeout: float = 30) -> List[int]:
+        ready = self.ready_servers()
+        if not ready:
+            raise RuntimeError("Модель еще не загружена")
+        return ready[0].tokenize(text, timeout)
+
+    def status(self) -> List[Dict]:
+        """Состояние экземпляров для /ready"""
+        with self._lock:
+            return [{
+                "port": server.port,
+                "cpus": server.cpus,
+                "threads": server.threads,
+                "slots": server.slots,
+                "ready": server.is_ready(),
+                "in_flight": self._in_flight[id(server)],
+            } for server in self.servers]
+
+    def stop(self):
+        for server in self.servers:
+            server.stop()
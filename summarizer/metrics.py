@@ -0,0 +1,78 @@
+from typing import Dict
+
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Gauge, Histogram, generate_latest
+
+# Метрики сервиса в формате Prometheus (/metrics)
+
+REQUESTS = Counter(
+    "summarizer_requests_total", "HTTP-запросы к сервису", ["endpoint", "model", "status"]
+)
+ERRORS = Counter(
+    "summarizer_errors_total", "Ошибки обработки запросов по типу исключения", ["endpoint", "type"]
+)
+PROMPT_LATENCY = Histogram(
+    "summarizer_prompt_seconds", "Время выполнения одного промпта (чанк, reduce, оценка комментария)",
+    ["model", "kind"],
+    buckets=(0.1, 0.25, 0.5, 1, 2, 5, 10, 20, 30, 60, 120, 300),
+)
+PROMPT_TOKENS = Counter(
+    "summarizer_prompt_tokens_total", "Вычисленные токены промптов (без взятых из KV-кэша)", ["model"]
+)
+PROMPT_SECONDS = Counter(
+    "summarizer_prompt_eval_seconds_total", "Время обработки промптов по timings llama-server", ["model"]
+)
+GENERATED_TOKENS = Counter(
+    "summarizer_generated_tokens_total", "Сгенерированные токены", ["model"]
+)
+GENERATED_SECONDS = Counter(
+    "summarizer_generation_seconds_total", "Время генерации по timings llama-server", ["model"]
+)
+PROMPT_TOKENS_PER_SECOND = Gauge(
+    "summarizer_prompt_tokens_per_second", "Скорость обработки промпта в последнем запросе", ["model"]
+)
+GENERATED_TOKENS_PER_SECOND = Gauge(
+    "summarizer_generated_tokens_per_second", "Скорость генерации в последнем запросе", ["model"]
+)
+
+# Значения, которые снимаются в момент запроса /metrics
+QUEUE_DEPTH = Gauge("summarizer_queue_depth", "Промпты, ожидающие свободного слота", ["model"])
+ACTIVE_JOBS = Gauge("summarizer_active_jobs", "Допущенные в очередь запросы", ["model"])
+MODEL_READY = Gauge("summarizer_model_ready", "1 - модель загружена", ["model"])
+MODEL_LOAD_SECONDS = Gauge("summarizer_model_load_seconds", "Время загрузки модели", ["model"])
+PREFIX_REUSED_RATIO = Gauge(
+    "summarizer_prefix_cache_reused_ratio", "Доля токенов промптов, взятых из KV-кэша", ["model"]
+)
+CACHE_HITS = Gauge("summarizer_summary_cache_hits", "Попадания в кэш summary с момента старта")
+CACHE_MISSES = Gauge("summarizer_summary_cache_misses", "Промахи кэша summary с момента старта")
+CACHE_HIT_RATIO = Gauge("summarizer_summary_cache_hit_ratio", "Доля попаданий в кэш summary")
+CACHE_ENTRIES = Gauge("summarizer_summary_cache_entries", "Записей в кэше summary")
+CACHE_BYTES = Gauge("summarizer_summary_cache_bytes", "Размер кэша summary")
+
+
+def observe_completion(model: str, kind: str, result: Dict, elapsed: float):
+    """Учитывает один ответ llama-server: задержку и скорость по его timings"""
+    PROMPT_LATENCY.labels(model, kind).observe(elapsed)
+    timings = result.get("timings") or {}
+    prompt_n, prompt_ms = timings.get("prompt_n", 0), timings.get("prompt_ms", 0.0)
+    predicted_n, predicted_ms = timings.get("predicted_n", 0), timings.get("predicted_ms", 0.0)
+    PROMPT_TOKENS.labels(model).inc(prompt_n)
+    PROMPT_SECONDS.labels(model).inc(prompt_ms / 1000)
+    GENERATED_TOKENS.labels(model).inc(predicted_n)
+    GENERATED_SECONDS.labels(model).inc(predicted_ms / 1000)
+    if prompt_n and prompt_ms:
+        PROMPT_TOKENS_PER_SECOND.labels(model).set(prompt_n / prompt_ms * 1000)
+    if predicted_n and predicted_ms:
+        GENERATED_TOKENS_PER_SECOND.labels(model).set(predicted_n / predicted_ms * 1000)
+
+
+def observe_cache(stats: Dict):
+    CACHE_HITS.set(stats["hits"])
+    CACHE_MISSES.set(stats["misses"])
+    lookups = stats["hits"] + stats["misses"]
+    CACHE_HIT_RATIO.set(stats["hits"] / lookups if lookups else 0.0)
+    CACHE_ENTRIES.set(stats["entries"])
+    CACHE_BYTES.set(stats["bytes"])
+
+
+def render() -> bytes:
+    return generate_latest()
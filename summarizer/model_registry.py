@@ -0,0 +1,122 @@
+import json
+import os
+from typing import List, Optional
+
+from llama_backend import LlamaPool
+from scheduler import PromptScheduler
+
+# Доля заполнения очереди модели, после которой запросы без явных требований уходят на более дешевую модель
+BACKLOG_THRESHOLD = 0.5
+
+QUALITY_TIERS = ("high", "balanced", "fast")
+
+
+class ModelSpec:
+    """Описание GGUF-модели в реестре"""
+
+    def __init__(self, name: str, path: str, cost: float, quality: int, instances: int = 0):
+        self.name = name
+        self.path = path
+        self.cost = cost            # секунд на 1000 токенов промпта в одном слоте (заявленная стоимость)
+        self.quality = quality      # чем больше, тем лучше качество
+        self.instances = instances  # экземпляров llama-server; 0 - у основной модели все ядра, оставшиеся после остальных
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "ModelSpec":
+        return cls(data["name"], data["path"], float(data["cost"]), int(data["quality"]), int(data.get("instances", 0)))
+
+
+def load_model_specs(config: Optional[str], default_path: str) -> List[ModelSpec]:
+    """
+    Читает реестр моделей из JSON (строка или путь к файлу); первая модель - основная.
+    Модели, файла которых нет, кроме основной, пропускаются
+    """
+    if config:
+        if os.path.exists(config):
+            with open(config, encoding="utf-8") as f:
+                config = f.read()
+        specs = [ModelSpec.from_dict(item) for item in json.loads(config)]
+    else:
+        # Имя модели - имя файла: оно входит в ключ кэша summary
+        small_path = os.path.join(os.path.dirname(default_path), "qwen2-0_5b-instruct-q4_k_m.gguf")
+        specs = [
+            ModelSpec(os.path.basename(default_path), default_path, cost=8.0, quality=2),
+            ModelSpec(os.path.basename(small_path), small_path, cost=3.0, quality=1, instances=1),
+        ]
+    available = [specs[0]] + [spec for spec in specs[1:] if os.path.exists(spec.path)]
+    for spec in specs[1:]:
+        if spec not in available:
+            print(f"ℹ️ Модель {spec.name} не найдена ({spec.path}), пропускаю")
+    return available
+
+
+class LoadedModel:
+    """Модель из реестра вместе с ее пулом llama-server и очередью промптов"""
+
+    def __init__(self, spec: ModelSpec, pool: LlamaPool, scheduler: PromptScheduler):
+        self.spec = spec
+        self.pool = pool
+        self.scheduler = scheduler
+
+    @property
+    def name(self) -> str:
+        return self.spec.name
+
+    def backlog(self) -> float:
+        """Заполненность очереди заданий (0.0 - пусто, 1.0 - следующие запросы получат 429)"""
+        return self.scheduler.active_jobs / max(1, self.scheduler.max_queue_depth)
+
+    def estimate_latency(self, tokens: int) -> float:
+        """Оценка времени ответа: стоимость обработки с поправкой на задания, стоящие впереди"""
+        waves = 1 + self.scheduler.active_jobs / max(1, self.pool.slots)
+        return self.spec.cost * tokens / 1000 * waves
+
+
+class ModelRegistry:
+    """Реестр загруженных моделей и политика выбора модели под запрос"""
+
+    def __init__(self, models: List[LoadedModel]):
+        self.models = models
+
+    @property
+    def default(self) -> LoadedModel:
+        return self.models[0]
+
+    def ready_models(self) -> List[LoadedModel]:
+        """Готовые модели от лучшей к худшей"""
+        ready = [model for model in self.models if model.pool.is_ready()]
+        return sorted(ready, key=lambda model: (-model.spec.quality, model.spec.cost))
+
+    def select(self, tokens: int, latency_budget: Optional[float] = None, quality: str = "balanced") -> LoadedModel:
+        """
+        Выбирает модель для запроса
+
+        Args:
+            tokens: Оценка объема запроса в токенах
+            latency_budget: Допустимое время ответа в секундах (None - без ограничения)
+            quality: high - лучшая модель, fast - самая дешевая,
+                balanced - лучшая, укладывающаяся в бюджет и не перегруженная
+        """
+        ready = self.ready_models()
+        if not ready:
+            return self.default
+        cheapest = min(ready, key=lambda model: model.spec.cost)
+        if quality == "high":
+            return ready[0]
+        if quality == "fast":
+            return cheapest
+        if latency_budget is not None:
+            fitting = [model for model in ready if model.estimate_latency(tokens) <= latency_budget]
+            return fitting[0] if fitting else cheapest
+        unloaded = [model for model in ready if model.backlog() < BACKLOG_THRESHOLD]
+        return unloaded[0] if unloaded else cheapest
+
+    async def start(self):
+        for model in self.models:
+            model.pool.start_in_background()
+            await model.scheduler.start()
+
+    async def stop(self):
+        for model in self.models:
+            await model.scheduler.stop()
+            model.pool.stop()
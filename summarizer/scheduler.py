@@ -0,0 +1,110 @@
+import asyncio
+import math
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Callable, List, Optional
+
+
+class QueueFullError(Exception):
+    """Очередь заданий переполнена - клиенту нужно повторить запрос позже"""
+
+    def __init__(self, retry_after: int):
+        super().__init__(f"Queue is full, retry after {retry_after} s")
+        self.retry_after = retry_after
+
+
+class PromptScheduler:
+    """
+    Асинхронный планировщик запросов к модели.
+
+    Задания (HTTP-запросы) допускаются в очередь, пока их не больше max_queue_depth,
+    иначе - QueueFullError с оценкой Retry-After. Промпты всех заданий попадают в одну
+    FIFO-очередь и разбираются воркерами по числу слотов llama-server: промпты разных
+    заданий выполняются одновременно в соседних слотах и при continuous batching
+    llama-server декодируются общими проходами модели.
+    """
+
+    def __init__(self, slots: int, max_queue_depth: int):
+        self.slots = slots
+        self.max_queue_depth = max_queue_depth
+        self.active_jobs = 0
+        self._queue: Optional[asyncio.Queue] = None
+        self._workers: List[asyncio.Task] = []
+        self._job_times = deque(maxlen=50)  # длительность последних заданий для оценки Retry-After
+
+    async def start(self):
+        """Создает очередь и воркеры (вызывается внутри event loop приложения)"""
+        self._queue = asyncio.Queue()
+        self._workers = [asyncio.create_task(self._worker(i)) for i in range(self.slots)]
+
+    async def stop(self):
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    @property
+    def queue_depth(self) -> int:
+        """Количество промптов, ожидающих свободного слота"""
+        return self._queue.qsize() if self._queue is not None else 0
+
+    def retry_after(self) -> int:
+        """Оценка в секундах, через сколько в очереди освободится место"""
+        avg_job_time = sum(self._job_times) / len(self._job_times) if self._job_times else 10.0
+        waves = (self.active_jobs - self.max_queue_depth + 1) / max(self.slots, 1)
+        return max(1, math.ceil(avg_job_time * max(waves, 1)))
+
+    def admit(self) -> float:
+        """Допуск задания в очередь (backpressure): переполнение -> QueueFullError"""
+        if self.active_jobs >= self.max_queue_depth:
+            raise QueueFullError(self.retry_after())
+        self.active_jobs += 1
+        return time.time()
+
+    def release(self, started: float):
+        """Завершение задания, допущенного через admit()"""
+        self.active_jobs -= 1
+        self._job_times.append(time.time() - started)
+
+    @asynccontextmanager
+    async def job(self):
+        started = self.admit()
+        try:
+            yield
+        finally:
+            self.release(started)
+
+    async def submit(self, fn: Callable, *args):
+        """Ставит блокирующий вызов модели в очередь и ждет его результата"""
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((fn, args, future))
+        return await future
+
+    async def map(self, fn: Callable, items: List[tuple]) -> List:
+        """Ставит в очередь fn(*item) для всех элементов и возвращает результаты в исходном порядке"""
+        tasks = [asyncio.ensure_future(self.submit(fn, *item)) for item in items]
+        try:
+            return list(await asyncio.gather(*tasks))
+        except BaseException:
+            # Ошибка одного промпта (или отключение клиента) - остальные из очереди выполнять незачем
+            for task in tasks:
+                task.cancel()
+            raise
+
+    async def _worker(self, index: int):
+        while True:
+            fn, args, future = await self._queue.get()
+            try:
+                if future.cancelled():
+                    continue  # клиент отключился, промпт больше не нужен
+                try:
+                    result = await asyncio.to_thread(fn, *args)
+                except Exception as e:
+                    if not future.cancelled():
+                        future.set_exception(e)
+                else:
+                    if not future.cancelled():
+                        future.set_result(result)
+            finally:
+                self._queue.task_done()
@@ -1,27 +1,178 @@
 from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from pydantic import BaseModel
-import subprocess
 import os
 import json
-import shlex
 import time
 import re
+import asyncio
+import hashlib
+import math
+import requests
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+from llama_backend import LlamaPool, LlamaServer, PrefixCacheStats, plan_instances
+from chunker import approx_token_count, chunk_text, pack_segments
+from summary_cache import SummaryCache
+from scheduler import PromptScheduler, QueueFullError
+from model_registry import QUALITY_TIERS, LoadedModel, ModelRegistry, load_model_specs
+import metrics
 
 app = FastAPI()
 
 class TextInput(BaseModel):
     text: str
+    # map_reduce - частичные summary сводятся в одно итоговое; concat - старое поведение (склейка через \n)
+    mode: str = "map_reduce"
+    # Выбор модели: допустимое время ответа (сек) и уровень качества (high, balanced, fast)
+    latency_budget: Optional[float] = None
+    quality: str = "balanced"
 
-# Указываем правильный путь к исполняемому файлу llama-cli и модели
-LLAMA_MAIN_PATH = "/llama.cpp/build/bin/llama-cli"
-MODEL_PATH = "/app/model/qwen2-1_5b-instruct-q4_k_m.gguf"  # путь к скачанной модели
+class RankInput(BaseModel):
+    summary: str          # summary видео - общий префикс всех промптов запроса
+    comments: List[str]
+    # joint - все комментарии в одном промпте, ответ - JSON-массив оценок ожидаемой длины (только generate)
+    joint: bool = False
+    # generate - модель генерирует число; logits - один проход и матожидание оценки по вероятностям цифр
+    method: str = "generate"
+    latency_budget: Optional[float] = None
+    quality: str = "balanced"
 
-# Максимальный размер одного чанка (примерно 3500-4000 токенов для Qwen2)
-CHUNK_SIZE = 1200  # символов (увеличено в 3 раза)
+# Указываем правильный путь к исполняемому файлу llama-server и модели
+LLAMA_SERVER_PATH = os.getenv("LLAMA_SERVER_PATH", "/llama.cpp/build/bin/llama-server")
+MODEL_PATH = os.getenv("MODEL_PATH", "/app/model/qwen2-1_5b-instruct-q4_k_m.gguf")  # путь к скачанной модели
+# Реестр моделей: JSON-список (или путь к JSON-файлу) [{"name", "path", "cost", "quality", "instances"}],
+# первая модель - основная; по умолчанию MODEL_PATH и, если скачана, qwen2-0.5b рядом с ней
+SUMMARIZER_MODELS = os.getenv("SUMMARIZER_MODELS", "")
+LLAMA_SERVER_PORT = int(os.getenv("LLAMA_SERVER_PORT", "8080"))  # внутренний порт первого llama-server
+LLAMA_CTX_SIZE = int(os.getenv("LLAMA_CTX_SIZE", "4096"))  # контекст на один слот
+# Пул экземпляров модели: каждый привязан к LLAMA_THREADS физическим ядрам и работает с --threads по их числу
+LLAMA_THREADS = int(os.getenv("LLAMA_THREADS", "4"))
+LLAMA_INSTANCES = int(os.getenv("LLAMA_INSTANCES", "0"))  # 0 - по топологии CPU: физические ядра / LLAMA_THREADS
+LLAMA_PIN_CPUS = os.getenv("LLAMA_PIN_CPUS", "1") == "1"
+# Параллельных слотов в каждом экземпляре (слоты одного экземпляра декодируются общим батчем)
+LLAMA_PARALLEL = int(os.getenv("LLAMA_PARALLEL", "2"))
+# Сколько запросов одновременно допускается в очередь, сверх этого - 429 с Retry-After
+MAX_QUEUE_DEPTH = int(os.getenv("SUMMARIZER_MAX_QUEUE", "16"))
 
-# Функция для разбиения текста на чанки
-def split_text(text, chunk_size):
-    return [text[i:i+chunk_size] for i in range(0, len(text), chunk_size)]
+# Бюджет токенов на один чанк: контекст слота минус системный промпт, инструкция и ответ модели
+PROMPT_RESERVE_TOKENS = 320
+CHUNK_TOKENS = int(os.getenv("CHUNK_TOKENS", "0")) or LLAMA_CTX_SIZE - PROMPT_RESERVE_TOKENS
+CHUNK_OVERLAP_TOKENS = int(os.getenv("CHUNK_OVERLAP_TOKENS", "64"))  # перекрытие соседних чанков
+# Сколько токенов частичных summary помещается в один reduce-промпт
+REDUCE_INPUT_TOKENS = int(os.getenv("REDUCE_INPUT_TOKENS", "0")) or CHUNK_TOKENS
+CHUNK_SUMMARY_WORDS = 40
+FINAL_SUMMARY_WORDS = int(os.getenv("FINAL_SUMMARY_WORDS", "120"))
+
+SYSTEM_PROMPT = "You are a text summarizer. You are given a text and you need to summarize it. Save the key points and the main ideas."
+
+# Персистентный кэш summary чанков (каталог cache/ смонтирован вместе с ./summarizer)
+SUMMARY_CACHE_PATH = os.getenv("SUMMARY_CACHE_PATH", "/app/cache/summary_cache.sqlite3")
+SUMMARY_CACHE_MAX_ENTRIES = int(os.getenv("SUMMARY_CACHE_MAX_ENTRIES", "50000"))
+SUMMARY_CACHE_MAX_BYTES = int(os.getenv("SUMMARY_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+
+def build_registry():
+    """
+    Создает экземпляры llama-server всех моделей реестра по плану распределения ядер:
+    дополнительные модели получают по spec.instances экземпляров с конца плана, основная - остальные.
+    Если ядер меньше, чем экземпляров, последние экземпляры делят ядра
+    """
+    specs = load_model_specs(SUMMARIZER_MODELS, MODEL_PATH)
+    plan = plan_instances(LLAMA_INSTANCES, LLAMA_THREADS)
+    reserved = sum(max(1, spec.instances) for spec in specs[1:])
+    counts = [specs[0].instances or max(1, len(plan) - reserved)] + [max(1, spec.instances) for spec in specs[1:]]
+    models = []
+    offset = 0
+    for spec, count in zip(specs, counts):
+        prefix_stats = PrefixCacheStats()
+        servers = []
+        for _ in range(count):
+            cpus, physical = plan[min(offset, len(plan) - 1)]
+            servers.append(LlamaServer(
+                LLAMA_SERVER_PATH,
+                spec.path,
+                port=LLAMA_SERVER_PORT + offset,
+                ctx_size=LLAMA_CTX_SIZE * LLAMA_PARALLEL,  # llama-server делит контекст поровну между слотами
+                threads=physical,
+                slots=LLAMA_PARALLEL,
+                cpus=cpus if LLAMA_PIN_CPUS else None,
+                prefix_stats=prefix_stats,
+            ))
+            offset += 1
+        pool = LlamaPool(servers)
+        # Очередь промптов: не больше одного промпта на слот модели, слоты декодируются общим батчем
+        models.append(LoadedModel(spec, pool, PromptScheduler(pool.slots, MAX_QUEUE_DEPTH)))
+        print(f"Модель {spec.name}: {count} экземпляр(ов), {pool.slots} слотов")
+    return ModelRegistry(models)
+
+# Модели загружаются один раз при старте сервиса и остаются в памяти
+registry = build_registry()
+
+summary_cache = SummaryCache(SUMMARY_CACHE_PATH, SUMMARY_CACHE_MAX_ENTRIES, SUMMARY_CACHE_MAX_BYTES)
+
+@app.on_event("startup")
+async def load_model():
+    # Загрузка идет в фоне: /health отвечает сразу, /ready - только после загрузки модели
+    await registry.start()
+
+@app.on_event("shutdown")
+async def unload_model():
+    await registry.stop()
+
+def model_status(model: LoadedModel):
+    return {
+        "name": model.name,
+        "ready": model.pool.is_ready(),
+        "load_time": model.pool.load_time,
+        "error": model.pool.error,
+        "active_jobs": model.scheduler.active_jobs,
+        "queue_depth": model.scheduler.queue_depth,
+        "instances": model.pool.status(),
+    }
+
+@app.get("/stats")
+def stats():
+    return {
+        "prefix_cache": {model.name: model.pool.prefix_stats.as_dict() for model in registry.models},
+        "summary_cache": summary_cache.stats(),
+    }
+
+@app.get("/metrics")
+def prometheus_metrics():
+    """Метрики в формате Prometheus; показатели очередей, моделей и кэша снимаются в момент запроса"""
+    for model in registry.models:
+        metrics.QUEUE_DEPTH.labels(model.name).set(model.scheduler.queue_depth)
+        metrics.ACTIVE_JOBS.labels(model.name).set(model.scheduler.active_jobs)
+        metrics.MODEL_READY.labels(model.name).set(1 if model.pool.is_ready() else 0)
+        if model.pool.load_time is not None:
+            metrics.MODEL_LOAD_SECONDS.labels(model.name).set(model.pool.load_time)
+        metrics.PREFIX_REUSED_RATIO.labels(model.name).set(model.pool.prefix_stats.as_dict()["reused_ratio"])
+    metrics.observe_cache(summary_cache.stats())
+    return Response(content=metrics.render(), media_type=metrics.CONTENT_TYPE_LATEST)
+
+@app.get("/health")
+def health():
+    return {"status": "ok"}
+
+@app.get("/ready")
+def ready():
+    # Сервис готов, как только загружена хотя бы одна модель: запросы уйдут на нее
+    models = [model_status(model) for model in registry.models]
+    ready_models = registry.ready_models()
+    if ready_models:
+        return {"status": "ready", "model": ready_models[0].name, "models": models}
+    return JSONResponse(status_code=503, content={"status": "loading", "error": registry.default.pool.error,
+                                                  "models": models})
+
+def count_tokens(model: LoadedModel, text):
+    """Считает токены токенизатором модели (грубая оценка, если llama-server недоступен)"""
+    try:
+        return len(model.pool.tokenize(text))
+    except (RuntimeError, requests.exceptions.RequestException):
+        return approx_token_count(text)
+
+# Функция для разбиения текста на чанки по предложениям в пределах бюджета токенов
+def split_text(model: LoadedModel, text):
+    return chunk_text(text, lambda segment: count_tokens(model, segment), CHUNK_TOKENS, CHUNK_OVERLAP_TOKENS)
 
 # Функция для извлечения только ответа ассистента
 def extract_assistant_answer(text):
@@ -34,46 +185,432 @@ def extract_assistant_answer(text):
         return answer.strip()
     return text.strip()
 
-@app.post("/summarize")
-def summarize(input: TextInput):
-    print(f"Received text for summarization (first 100 chars): {input.text[:100]}... (len={len(input.text)})")
+def build_prompt(instruction, text):
+    # Формируем prompt в формате chat template для Qwen2
+    return (
+        "<|im_start|>system\n"
+        f"{SYSTEM_PROMPT}<|im_end|>\n"
+        "<|im_start|>user\n"
+        f"{instruction}: {text}<|im_end|>\n"
+        "<|im_start|>assistant\n"
+    )
+
+MAP_INSTRUCTION = f"Summarize in English in {CHUNK_SUMMARY_WORDS} words"
+
+def reduce_instruction(words):
+    return (
+        "These are summaries of consecutive parts of one video transcript. "
+        f"Combine them into one coherent summary in English in {words} words"
+    )
+
+def prefix_hash(prefix):
+    return hashlib.sha1(prefix.encode('utf-8')).hexdigest()
+
+def complete(model: LoadedModel, kind, prompt, **params):
+    """Запрос к llama-server модели с учетом задержки и скорости в метриках"""
+    start = time.time()
+    result = model.pool.complete(prompt, **params)
+    metrics.observe_completion(model.name, kind, result, time.time() - start)
+    return result
+
+def run_prompt(model: LoadedModel, prompt, n_predict, label, prefix_key=None, kind="summary"):
+    """Выполняет один промпт на резидентной модели и возвращает очищенный ответ"""
+    start = time.time()
     try:
-        chunks = split_text(input.text, CHUNK_SIZE)
-        summaries = []
-        for idx, chunk in enumerate(chunks):
-            print(f"Summarizing chunk {idx+1}/{len(chunks)} (len={len(chunk)})")
-            # Формируем prompt в формате chat template для Qwen2
-            prompt = (
-                "<|im_start|>system\n"
-                "You are a text summarizer. You are given a text and you need to summarize it. Save the key points and the main ideas.<|im_end|>\n"
-                "<|im_start|>user\n"
-                f"Summarize in English in 40 words: {chunk}<|im_end|>\n"
-                "<|im_start|>assistant\n"
+        result = complete(model, kind, prompt, n_predict=n_predict, temperature=0.7, timeout=300, prefix_key=prefix_key)
+    except requests.exceptions.Timeout:
+        print(f"[ERROR] Таймаут при генерации summary для {label}")
+        raise RuntimeError(f"Timeout on {label}")
+    content = result.get("content", "")
+    print(f"[STDOUT] {label}: {content.strip()[:200]}")
+    print(f"[DEBUG] Время генерации ({label}, {model.name}): {time.time() - start:.2f} сек")
+    return extract_assistant_answer(content.strip())
+
+def cached_summary(model: LoadedModel, instruction, text, n_predict, label) -> Tuple[str, bool]:
+    """Суммаризирует текст, если его summary с той же моделью и шаблоном еще нет в кэше"""
+    key = SummaryCache.make_key(model.name, f"{SYSTEM_PROMPT}\n{instruction}", text)
+    cached = summary_cache.get(key)
+    if cached is not None:
+        print(f"[CACHE] {label}: hit")
+        return cached, True
+    # Системный промпт и инструкция одинаковы у всех чанков - их KV-кэш переиспользуется
+    summary = run_prompt(model, build_prompt(instruction, text), n_predict, label,
+                         prefix_key=prefix_hash(SYSTEM_PROMPT + instruction),
+                         kind="map" if instruction == MAP_INSTRUCTION else "reduce")
+    if summary:
+        summary_cache.put(key, summary)
+    return summary, False
+
+def group_summaries(model: LoadedModel, summaries: List[str]) -> List[List[str]]:
+    """Группирует частичные summary так, чтобы каждая группа помещалась в один промпт"""
+    groups = pack_segments(summaries, lambda segment: count_tokens(model, segment), REDUCE_INPUT_TOKENS)
+    if len(groups) >= len(summaries):
+        # В группе минимум два элемента, иначе reduce не уменьшит количество summary
+        groups = [summaries[i:i + 2] for i in range(0, len(summaries), 2)]
+    return groups
+
+async def reduce_summaries(model: LoadedModel, summaries: List[str]) -> Tuple[str, int]:
+    """
+    Reduce-шаг: иерархически сводит частичные summary, пока они не поместятся в один финальный промпт
+
+    Returns:
+        Tuple[str, int]: итоговое summary и количество попаданий в кэш
+    """
+    if not summaries:
+        # Пустой текст не дает ни одного чанка
+        return "", 0
+    level = 1
+    hits = 0
+    while True:
+        if len(summaries) == 1:
+            return summaries[0], hits
+        groups = await asyncio.to_thread(group_summaries, model, summaries)
+        if not 1 <= len(groups) < len(summaries):
+            raise RuntimeError(f"Reduce level {level} не уменьшает число summary: {len(summaries)} -> {len(groups)}")
+        if len(groups) == 1:
+            final, hit = await model.scheduler.submit(
+                cached_summary, model, reduce_instruction(FINAL_SUMMARY_WORDS), "\n".join(summaries), 256, "final reduce"
             )
-            args = [
-                LLAMA_MAIN_PATH,
-                "-m", MODEL_PATH,
-                "-p", prompt,
-                "--n-predict", "64",
-                "--temp", "0.7"
-            ]
-            print(f"[DEBUG] Запуск команды: {' '.join(shlex.quote(a) for a in args)[:200]}...")
-            start = time.time()
-            try:
-                result = subprocess.run(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, timeout=300)
-            except subprocess.TimeoutExpired:
-                print(f"[ERROR] Таймаут при генерации summary для чанка {idx+1}")
-                return {"summary": None, "error": f"Timeout on chunk {idx+1}"}
-            print(f"[STDOUT] {result.stdout.strip()[:200]}")
-            print(f"[STDERR] {result.stderr.strip()[:200]}")
-            print(f"[DEBUG] Время генерации: {time.time() - start:.2f} сек")
-            if result.returncode != 0:
-                print(f"llama.cpp error: {result.stderr}")
-                return {"summary": None, "error": result.stderr}
-            cleaned = extract_assistant_answer(result.stdout.strip())
-            summaries.append(cleaned)
+            return final, hits + hit
+        print(f"Reduce level {level}: {len(summaries)} summaries -> {len(groups)} groups")
+        results = await model.scheduler.map(cached_summary, [
+            (model, reduce_instruction(CHUNK_SUMMARY_WORDS * 2), "\n".join(group), 128, f"reduce {level}.{idx+1}/{len(groups)}")
+            for idx, group in enumerate(groups)
+        ])
+        summaries = [summary for summary, _ in results]
+        hits += sum(hit for _, hit in results)
+        level += 1
+
+async def summarization_events(model: LoadedModel, input: TextInput) -> AsyncIterator[Dict]:
+    """
+    Выполняет суммаризацию и отдает события по мере готовности:
+    chunk - summary очередного чанка (в порядке завершения), final - итоговый результат
+    """
+    start = time.time()
+    chunks = await asyncio.to_thread(split_text, model, input.text)
+    print(f"Summarizing {len(chunks)} chunks with {model.name} on {model.pool.slots} slots "
+          f"(queue: {model.scheduler.queue_depth})")
+
+    async def map_chunk(idx, chunk):
+        return idx, await model.scheduler.submit(cached_summary, model, MAP_INSTRUCTION, chunk, 64, f"chunk {idx+1}/{len(chunks)}")
+
+    # Map-шаг: чанки суммаризируются параллельно на всех слотах модели
+    tasks = [asyncio.ensure_future(map_chunk(idx, chunk)) for idx, chunk in enumerate(chunks)]
+    summaries = [None] * len(chunks)
+    chunk_hits = 0
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            idx, (summary, hit) = await next_done
+            summaries[idx] = summary
+            chunk_hits += hit
+            yield {"event": "chunk", "index": idx, "total": len(chunks), "summary": summary, "cached": hit}
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        raise
+
+    reduce_hits = 0
+    if input.mode == "concat":
         final_summary = "\n".join(summaries)
-        return {"summary": final_summary}
+    else:
+        final_summary, reduce_hits = await reduce_summaries(model, summaries)
+    print(f"[DEBUG] Общее время суммаризации: {time.time() - start:.2f} сек (кэш: {chunk_hits}/{len(chunks)} чанков)")
+    yield {
+        "event": "final",
+        "summary": final_summary,
+        "model": model.name,
+        "chunks": len(chunks),
+        "cache": {"chunk_hits": chunk_hits, "chunk_misses": len(chunks) - chunk_hits, "reduce_hits": reduce_hits},
+    }
+
+def check_summarize_input(input: TextInput):
+    """Возвращает ответ с ошибкой, если запрос нельзя выполнить прямо сейчас"""
+    if not registry.ready_models():
+        return JSONResponse(status_code=503, content={"summary": None, "error": "Model is not loaded yet"})
+    if not input.text.strip():
+        return JSONResponse(status_code=400, content={"summary": None, "error": "Empty text"})
+    if input.mode not in ("map_reduce", "concat"):
+        return JSONResponse(status_code=400, content={"summary": None, "error": f"Unknown mode: {input.mode}"})
+    if input.joint and input.method == "logits":
+        # Проход по промпту дает вероятности только для первого токена ответа - одну оценку на промпт
+        record_request("rank", None, "bad_request")
+        return JSONResponse(status_code=400, content={"ranks": None, "error": "joint is supported only with method=generate"})
+    if input.quality not in QUALITY_TIERS:
+        return JSONResponse(status_code=400, content={"summary": None, "error": f"Unknown quality: {input.quality}"})
+    return None
+
+def record_request(endpoint, model, status, error=None):
+    """Учитывает запрос в метриках: status - ok, error, rejected (429), unavailable (503), bad_request"""
+    metrics.REQUESTS.labels(endpoint, model.name if model else "", status).inc()
+    if error is not None:
+        metrics.ERRORS.labels(endpoint, type(error).__name__).inc()
+
+def select_model(text_tokens, latency_budget, quality):
+    model = registry.select(text_tokens, latency_budget, quality)
+    print(f"[DEBUG] Модель {model.name} (оценка {text_tokens} токенов, бюджет: {latency_budget}, качество: {quality}, "
+          f"заданий в очереди: {model.scheduler.active_jobs})")
+    return model
+
+def queue_full_response(model: LoadedModel, e: QueueFullError):
+    print(f"[WARN] Очередь {model.name} переполнена ({model.scheduler.active_jobs} заданий), "
+          f"Retry-After: {e.retry_after} сек")
+    return JSONResponse(
+        status_code=429,
+        content={"summary": None, "error": str(e)},
+        headers={"Retry-After": str(e.retry_after)},
+    )
+
+@app.post("/summarize")
+async def summarize(input: TextInput):
+    print(f"Received text for summarization (first 100 chars): {input.text[:100]}... (len={len(input.text)}, mode={input.mode})")
+    error_response = check_summarize_input(input)
+    if error_response:
+        record_request("summarize", None, "unavailable" if error_response.status_code == 503 else "bad_request")
+        return error_response
+    model = select_model(approx_token_count(input.text), input.latency_budget, input.quality)
+    try:
+        async with model.scheduler.job():
+            result = None
+            async for event in summarization_events(model, input):
+                if event["event"] == "final":
+                    result = event
+            del result["event"]
+            record_request("summarize", model, "ok")
+            return result
+    except QueueFullError as e:
+        record_request("summarize", model, "rejected")
+        return queue_full_response(model, e)
+    except RuntimeError as e:
+        record_request("summarize", model, "error", e)
+        return {"summary": None, "error": str(e)}
     except Exception as e:
         print(f"Ошибка при запуске llama.cpp: {e}")
-        return {"summary": None, "error": str(e)}
\ No newline at end of file
+        record_request("summarize", model, "error", e)
+        return {"summary": None, "error": str(e)}
+
+@app.post("/summarize/stream")
+async def summarize_stream(input: TextInput):
+    """
+    Потоковая суммаризация (Server-Sent Events): события chunk по мере готовности чанков,
+    затем final с итоговым summary; при ошибке - событие error
+    """
+    print(f"Received text for streaming summarization (len={len(input.text)}, mode={input.mode})")
+    error_response = check_summarize_input(input)
+    if error_response:
+        record_request("summarize_stream", None, "unavailable" if error_response.status_code == 503 else "bad_request")
+        return error_response
+    model = select_model(approx_token_count(input.text), input.latency_budget, input.quality)
+    try:
+        started = model.scheduler.admit()
+    except QueueFullError as e:
+        record_request("summarize_stream", model, "rejected")
+        return queue_full_response(model, e)
+
+    async def event_stream():
+        try:
+            async for event in summarization_events(model, input):
+                name = event.pop("event")
+                yield f"event: {name}\ndata: {json.dumps(event, ensure_ascii=False)}\n\n"
+            record_request("summarize_stream", model, "ok")
+        except Exception as e:
+            print(f"Ошибка потоковой суммаризации: {e}")
+            record_request("summarize_stream", model, "error", e)
+            yield f"event: error\ndata: {json.dumps({'error': str(e)}, ensure_ascii=False)}\n\n"
+        finally:
+            model.scheduler.release(started)
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+RANK_SYSTEM_PROMPT = "You rate how informative YouTube comments are relative to the video content."
+RANK_CRITERIA = (
+    "Rating criteria:\n"
+    "- 1.0: Comment adds significant value, complements or clarifies video content\n"
+    "- 0.7-0.9: Comment is relevant and contains useful information\n"
+    "- 0.4-0.6: Comment is partially related to video topic\n"
+    "- 0.1-0.3: Comment is weakly related to content\n"
+    "- 0.0: Comment is unrelated to video (spam, off-topic, emotions without content)\n"
+)
+
+def build_rank_prefix(summary):
+    # Все, что не зависит от комментария, стоит в начале промпта и считается один раз на слот
+    return (
+        "<|im_start|>system\n"
+        f"{RANK_SYSTEM_PROMPT}<|im_end|>\n"
+        "<|im_start|>user\n"
+        f"{RANK_CRITERIA}\n"
+        f"Video content: {summary}\n\n"
+    )
+
+def build_rank_prompt(prefix, comment):
+    return (
+        f"{prefix}Comment: {comment}\n\n"
+        "Respond with only a number from 0.0 to 1.0<|im_end|>\n"
+        "<|im_start|>assistant\n"
+    )
+
+def build_joint_rank_prompt(prefix, comments):
+    numbered = "\n".join(f"{idx}. {comment}" for idx, comment in enumerate(comments, 1))
+    return (
+        f"{prefix}Comments ({len(comments)} total):\n{numbered}\n\n"
+        f"Respond with a JSON array of exactly {len(comments)} numbers from 0.0 to 1.0, one per comment in order<|im_end|>\n"
+        "<|im_start|>assistant\n"
+    )
+
+# GBNF-грамматики llama.cpp: модель физически не может выдать ничего, кроме оценки,
+# поэтому ответ всегда разбирается, а генерация заканчивается через несколько токенов
+RANK_NUMBER_RULE = 'num ::= "0" ("." [0-9] [0-9]?)? | "1" (".0")?'
+RANK_GRAMMAR = f"root ::= num\n{RANK_NUMBER_RULE}"
+RANK_TOKENS = 5  # "0.85" - не больше 4 токенов + EOS
+
+def rank_array_grammar(count):
+    """Грамматика JSON-массива ровно из count оценок"""
+    items = ' ", " '.join(["num"] * count)
+    return f'root ::= "[" {items} "]"\n{RANK_NUMBER_RULE}'
+
+def extract_rank(text):
+    """Переводит ответ модели (ограниченный грамматикой) в оценку 0.0-1.0"""
+    try:
+        return max(0.0, min(1.0, float(text.strip())))
+    except ValueError:
+        return None
+
+def rank_comment(model: LoadedModel, prefix, prefix_key, comment, label):
+    result = complete(model, "rank", build_rank_prompt(prefix, comment), n_predict=RANK_TOKENS, temperature=0.1,
+                      timeout=120, prefix_key=prefix_key, grammar=RANK_GRAMMAR)
+    content = result.get("content", "").strip()
+    print(f"[DEBUG] {label}: {content[:50]!r} (префикс: {'hit' if result['prefix_hit'] else 'miss'}, "
+          f"переиспользовано {result['reused_tokens']} токенов)")
+    return extract_rank(content), result["prefix_hit"], result["reused_tokens"], result.get("tokens_evaluated", 0)
+
+def build_score_prompt(prefix, comment):
+    return (
+        f"{prefix}Comment: {comment}\n\n"
+        "Respond with a single digit from 0 to 9, where 0 means 0.0 and 9 means 1.0<|im_end|>\n"
+        "<|im_start|>assistant\n"
+    )
+
+SCORE_TOP_PROBS = 20  # сколько самых вероятных токенов вернуть: цифры почти всегда среди них
+
+def digit_probabilities(result):
+    """
+    Достает вероятности токенов-цифр первого сгенерированного токена из ответа llama-server
+    (поддерживаются форматы completion_probabilities старых и новых версий)
+    """
+    probs = {}
+    positions = result.get("completion_probabilities") or []
+    if not positions:
+        return probs
+    first = positions[0]
+    if "top_logprobs" in first:
+        candidates = [(c.get("token", ""), math.exp(c["logprob"])) for c in first["top_logprobs"]]
+    elif "top_probs" in first:
+        candidates = [(c.get("token", ""), c["prob"]) for c in first["top_probs"]]
+    else:
+        candidates = [(c.get("tok_str", ""), c["prob"]) for c in first.get("probs", [])]
+    for token, prob in candidates:
+        token = token.strip()
+        if len(token) == 1 and token.isdigit():
+            probs[int(token)] = probs.get(int(token), 0.0) + prob
+    return probs
+
+def score_comment(model: LoadedModel, prefix, prefix_key, comment, label):
+    """
+    Оценка без цикла сэмплирования: один проход по промпту (префикс берется из KV-кэша),
+    ранг - матожидание цифры 0-9 по ее вероятностям из логитов, нормированное в 0.0-1.0.
+    post_sampling_probs=False (llama.cpp b4600, см. Dockerfile): top_logprobs - softmax сырых
+    логитов до сэмплирования, иначе при temperature=0 вся вероятность досталась бы одной цифре.
+    Один HTTP-запрос на комментарий: запросы идут в параллельные слоты, и llama-server
+    считает их одним батчем (continuous batching)
+    """
+    result = complete(model, "score", build_score_prompt(prefix, comment), n_predict=1, temperature=0.0,
+                      timeout=120, prefix_key=prefix_key, n_probs=SCORE_TOP_PROBS, post_sampling_probs=False)
+    probs = digit_probabilities(result)
+    total = sum(probs.values())
+    rank = sum(digit * prob for digit, prob in probs.items()) / total / 9 if total > 0 else None
+    print(f"[DEBUG] {label}: {rank if rank is None else round(rank, 3)} (P(цифра)={total:.2f}, "
+          f"префикс: {'hit' if result['prefix_hit'] else 'miss'})")
+    return rank, result["prefix_hit"], result["reused_tokens"], result.get("tokens_evaluated", 0)
+
+def rank_comments_joint(model: LoadedModel, prefix, prefix_key, comments):
+    """
+    Оценивает все комментарии одним промптом; грамматика гарантирует массив нужной длины.
+    Если ответ все же не разобрался, ranks - None, и комментарии оцениваются по одному
+    """
+    result = complete(model, "joint_rank", build_joint_rank_prompt(prefix, comments),
+                      n_predict=RANK_TOKENS * len(comments) + 4, temperature=0.1, timeout=300,
+                      prefix_key=prefix_key, grammar=rank_array_grammar(len(comments)))
+    content = result.get("content", "").strip()
+    print(f"[DEBUG] Совместная оценка {len(comments)} комментариев: {content[:100]!r}")
+    try:
+        ranks = [max(0.0, min(1.0, float(value))) for value in json.loads(content)]
+    except (ValueError, TypeError):
+        # Ответ обрезан (n_predict, таймаут) или сервер без поддержки грамматик
+        ranks = None
+    if ranks is not None and len(ranks) != len(comments):
+        ranks = None
+    return ranks, result["prefix_hit"], result["reused_tokens"], result.get("tokens_evaluated", 0)
+
+@app.post("/rank")
+async def rank(input: RankInput):
+    """
+    Оценивает информативность комментариев относительно summary видео.
+    Summary - общий префикс всех промптов: его KV-кэш считается один раз на слот,
+    для каждого комментария вычисляется только суффикс.
+    method=logits - детерминированная оценка за один проход без генерации текста
+    """
+    print(f"Received {len(input.comments)} comments for ranking (summary len={len(input.summary)})")
+    if not registry.ready_models():
+        record_request("rank", None, "unavailable")
+        return JSONResponse(status_code=503, content={"ranks": None, "error": "Model is not loaded yet"})
+    if input.method not in ("generate", "logits"):
+        record_request("rank", None, "bad_request")
+        return JSONResponse(status_code=400, content={"ranks": None, "error": f"Unknown method: {input.method}"})
+    if input.quality not in QUALITY_TIERS:
+        record_request("rank", None, "bad_request")
+        return JSONResponse(status_code=400, content={"ranks": None, "error": f"Unknown quality: {input.quality}"})
+    if not input.comments:
+        record_request("rank", None, "ok")
+        return {"ranks": [], "prefix_cache": {"hits": 0, "reused_tokens": 0, "prompt_tokens": 0}}
+    prefix = build_rank_prefix(input.summary)
+    prefix_key = prefix_hash(prefix)
+    # Префикс считается один раз на слот, основная стоимость - суффиксы комментариев
+    est_tokens = approx_token_count(input.summary) + sum(approx_token_count(comment) for comment in input.comments)
+    model = select_model(est_tokens, input.latency_budget, input.quality)
+    try:
+        async with model.scheduler.job():
+            if input.joint and input.method == "generate":
+                ranks, hit, reused, tokens = await model.scheduler.submit(
+                    rank_comments_joint, model, prefix, prefix_key, input.comments
+                )
+                if ranks is not None:
+                    record_request("rank", model, "ok")
+                    return {"ranks": ranks, "model": model.name,
+                            "prefix_cache": {"hits": int(hit), "reused_tokens": reused, "prompt_tokens": tokens}}
+                print(f"[WARN] Не удалось разобрать совместную оценку {len(input.comments)} комментариев, "
+                      f"оцениваю по одному")
+            # Промпты комментариев расходятся по слотам и считаются общими батчами llama-server
+            scorer = score_comment if input.method == "logits" else rank_comment
+            results = await model.scheduler.map(scorer, [
+                (model, prefix, prefix_key, comment, f"comment {idx+1}/{len(input.comments)}")
+                for idx, comment in enumerate(input.comments)
+            ])
+    except QueueFullError as e:
+        record_request("rank", model, "rejected")
+        print(f"[WARN] Очередь {model.name} переполнена ({model.scheduler.active_jobs} заданий), "
+              f"Retry-After: {e.retry_after} сек")
+        return JSONResponse(status_code=429, content={"ranks": None, "error": str(e)},
+                            headers={"Retry-After": str(e.retry_after)})
+    except Exception as e:
+        print(f"Ошибка ранжирования: {e}")
+        record_request("rank", model, "error", e)
+        return {"ranks": None, "error": str(e)}
+    record_request("rank", model, "ok")
+    return {
+        "ranks": [rank for rank, _, _, _ in results],
+        "model": model.name,
+        "prefix_cache": {
+            "hits": sum(hit for _, hit, _, _ in results),
+            "reused_tokens": sum(reused for _, _, reused, _ in results),
+            "prompt_tokens": sum(tokens for _, _, _, tokens in results),
+        },
+    }
@@ -0,0 +1,101 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, Optional
+
+
+class SummaryCache:
+    """
+    Персистентный content-addressed кэш summary чанков (SQLite).
+
+    Ключ - хэш от (модель, шаблон промпта, текст чанка), поэтому повторная суммаризация
+    того же или дописанного в конце транскрипта платит только за новые чанки.
+    Вытеснение LRU по количеству записей и суммарному размеру.
+    """
+
+    def __init__(self, path: str, max_entries: int = 50000, max_bytes: int = 64 * 1024 * 1024):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS summaries (
+                key TEXT PRIMARY KEY,
+                summary TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                last_access REAL NOT NULL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_summaries_last_access ON summaries(last_access)")
+        self._conn.commit()
+        self._entries, self._bytes = self._conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM summaries"
+        ).fetchone()
+
+    @staticmethod
+    def make_key(model: str, template: str, text: str) -> str:
+        """Content-addressed ключ: sha256(модель, шаблон промпта, текст)"""
+        digest = hashlib.sha256()
+        for part in (model, template, text):
+            digest.update(part.encode('utf-8'))
+            digest.update(b'\0')
+        return digest.hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute("SELECT summary FROM summaries WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE summaries SET last_access = ? WHERE key = ?", (time.time(), key))
+            self._conn.commit()
+            self.hits += 1
+            return row[0]
+
+    def put(self, key: str, summary: str):
+        size = len(summary.encode('utf-8')) + len(key)
+        with self._lock:
+            old = self._conn.execute("SELECT size FROM summaries WHERE key = ?", (key,)).fetchone()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO summaries (key, summary, size, last_access) VALUES (?, ?, ?, ?)",
+                (key, summary, size, time.time()),
+            )
+            if old:
+                self._bytes -= old[0]
+            else:
+                self._entries += 1
+            self._bytes += size
+            self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        """LRU-вытеснение самых давно использованных записей при превышении лимитов"""
+        while self._entries > self.max_entries or self._bytes > self.max_bytes:
+            excess = max(self._entries - self.max_entries, 1)
+            rows = self._conn.execute(
+                "SELECT key, size FROM summaries ORDER BY last_access LIMIT ?", (excess,)
+            ).fetchall()
+            if not rows:
+                break
+            self._conn.executemany("DELETE FROM summaries WHERE key = ?", [(k,) for k, _ in rows])
+            self._entries -= len(rows)
+            self._bytes -= sum(size for _, size in rows)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "entries": self._entries,
+                "bytes": self._bytes,
+            }
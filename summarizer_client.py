@@ -0,0 +1,95 @@
+"""
+Клиент потоковой суммаризации сервиса summarizer-llm (/summarize/stream, Server-Sent Events)
+
+Summary чанков приходят по мере готовности, поэтому при обрыве соединения или таймауте
+вызывающий код получает хотя бы частичный результат, а не теряет всю работу.
+"""
+
+import json
+import os
+import threading
+from typing import Callable, Dict, Iterator, Optional, Tuple
+
+import requests
+
+from http_client import shared_client
+
+SUMMARIZER_URL = os.getenv("SUMMARIZER_URL", "http://summarizer-llm:8000")
+
+
+def iter_summary_events(text: str, base_url: str = SUMMARIZER_URL,
+                        timeout: float = 600) -> Iterator[Tuple[str, Dict]]:
+    """
+    Отправляет текст на потоковую суммаризацию и возвращает события по мере поступления
+
+    Args:
+        text: Текст для суммаризации
+        base_url: Адрес сервиса суммаризации
+        timeout: Максимальная пауза между событиями (сек)
+
+    Yields:
+        Tuple[str, Dict]: имя события (chunk, final, error) и его данные
+    """
+    # Переполненная очередь сервиса (429 с Retry-After) и обрыв соединения повторяются клиентом
+    with shared_client.stream("POST", f"{base_url}/summarize/stream", json={"text": text},
+                              timeout=(5, timeout), endpoint="summarizer /summarize/stream") as response:
+        response.raise_for_status()
+        event_name, data_lines = "message", []
+        for line in response.iter_lines(decode_unicode=True):
+            if line is None:
+                continue
+            if line == "":
+                # Пустая строка завершает событие SSE
+                if data_lines:
+                    yield event_name, json.loads("\n".join(data_lines))
+                event_name, data_lines = "message", []
+            elif line.startswith("event:"):
+                event_name = line[len("event:"):].strip()
+            elif line.startswith("data:"):
+                data_lines.append(line[len("data:"):].strip())
+
+
+def stream_summary(text: str, on_chunk: Optional[Callable[[Dict], None]] = None,
+                   base_url: str = SUMMARIZER_URL, timeout: float = 600,
+                   cancel: Optional[threading.Event] = None) -> Optional[str]:
+    """
+    Получает summary через потоковый endpoint
+
+    Args:
+        text: Текст для суммаризации
+        on_chunk: Вызывается для каждого готового summary чанка (index, total, summary, cached)
+        base_url: Адрес сервиса суммаризации
+        timeout: Максимальная пауза между событиями (сек)
+        cancel: Событие отмены - поток закрывается, и сервис прекращает суммаризацию
+
+    Returns:
+        str: Итоговое summary; при обрыве потока - склеенные частичные summary; None если нет ничего
+
+    Raises:
+        requests.exceptions.RequestException: если соединение оборвалось до первого summary
+    """
+    partials = {}
+    try:
+        for event, data in iter_summary_events(text, base_url, timeout):
+            if cancel is not None and cancel.is_set():
+                print("🛑 Потоковая суммаризация отменена")
+                return None
+            if event == "chunk":
+                partials[data["index"]] = data["summary"]
+                print(f"📝 Готов чанк {len(partials)}/{data['total']}" + (" (кэш)" if data.get("cached") else ""))
+                if on_chunk:
+                    on_chunk(data)
+            elif event == "final":
+                return data.get("summary") or None
+            elif event == "error":
+                print(f"⚠️ Ошибка сервиса суммаризации: {data.get('error')}")
+                break
+    except (requests.exceptions.RequestException, ValueError) as e:
+        if not partials:
+            raise  # ничего не получено - решение о повторе остается за вызывающим кодом
+        print(f"⚠️ Поток суммаризации прерван: {e}")
+
+    if partials:
+        print(f"🔄 Использую частичный результат: {len(partials)} summary чанков")
+        return "\n".join(partials[i] for i in sorted(partials))
+    return None
@@ -0,0 +1,176 @@
+"""
+Хеджированные запросы summary к нескольким бэкендам (Gemini, локальная LLM)
+
+Основной бэкенд запускается сразу; если он не ответил за hedge delay, параллельно
+запускается следующий. Побеждает первый непустой результат, проигравшему выставляется
+событие отмены. Задержка хеджирования подстраивается по p95 времени ответа основного
+бэкенда, история задержек сохраняется в JSON между запусками.
+"""
+
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Callable, Dict, List, Optional, Tuple
+
+# Бэкенд получает текст и событие отмены, возвращает summary или None
+SummaryBackend = Callable[[str, threading.Event], Optional[str]]
+
+HEDGE_DELAY = float(os.getenv("SUMMARY_HEDGE_DELAY", "20"))  # пока нет статистики задержек
+HEDGE_MIN_DELAY = 2.0
+HEDGE_MAX_DELAY = 120.0
+HEDGE_PERCENTILE = 95
+HEDGE_MIN_SAMPLES = 5
+SUMMARY_TIMEOUT = float(os.getenv("SUMMARY_TIMEOUT", "300"))
+LATENCY_STATS_PATH = os.getenv(
+    "SUMMARY_LATENCY_STATS_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache", "summary_latency.json"),
+)
+
+
+class LatencyTracker:
+    """Последние задержки успешных ответов каждого бэкенда с сохранением в JSON"""
+
+    def __init__(self, path: str = LATENCY_STATS_PATH, window: int = 200):
+        self.path = path
+        self.window = window
+        self._samples: Dict[str, deque] = {}
+        self._lock = threading.Lock()
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                data = json.load(f)
+            for name, samples in data.items():
+                self._samples[name] = deque(samples, maxlen=self.window)
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as e:
+            print(f"⚠️ Не удалось прочитать статистику задержек {self.path}: {e}")
+
+    def _save(self):
+        try:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            # Свой временный файл на каждую запись: воркеры пишут статистику одновременно,
+            # и каждый os.replace подменяет файл целиком (последняя запись побеждает)
+            with tempfile.NamedTemporaryFile("w", encoding="utf-8", dir=directory or ".",
+                                             prefix=".summary_latency.", suffix=".tmp", delete=False) as f:
+                tmp_path = f.name
+                json.dump({name: list(samples) for name, samples in self._samples.items()}, f)
+            try:
+                os.replace(tmp_path, self.path)
+            except OSError:
+                os.unlink(tmp_path)
+                raise
+        except OSError as e:
+            print(f"⚠️ Не удалось сохранить статистику задержек: {e}")
+
+    def record(self, name: str, latency: float):
+        with self._lock:
+            self._samples.setdefault(name, deque(maxlen=self.window)).append(round(latency, 3))
+            self._save()
+
+    def percentile(self, name: str, q: float) -> Optional[float]:
+        """q-й перцентиль задержки бэкенда (None, если замеров меньше HEDGE_MIN_SAMPLES)"""
+        with self._lock:
+            samples = sorted(self._samples.get(name, ()))
+        if len(samples) < HEDGE_MIN_SAMPLES:
+            return None
+        return samples[min(len(samples) - 1, int(len(samples) * q / 100))]
+
+    def summary(self) -> Dict[str, Dict]:
+        return {
+            name: {"samples": len(self._samples[name]), "p50": self.percentile(name, 50), "p95": self.percentile(name, 95)}
+            for name in list(self._samples)
+        }
+
+
+class HedgedRouter:
+    """Маршрутизатор запросов summary с хеджированием по времени ответа"""
+
+    def __init__(self, backends: List[Tuple[str, SummaryBackend]], tracker: LatencyTracker = None,
+                 timeout: float = SUMMARY_TIMEOUT):
+        """
+        Args:
+            backends: Бэкенды (имя, функция) в порядке приоритета
+            tracker: Статистика задержек (по умолчанию - общий JSON-файл)
+            timeout: Общий лимит времени на получение summary (сек)
+        """
+        self.backends = backends
+        self.tracker = tracker or LatencyTracker()
+        self.timeout = timeout
+
+    def hedge_delay(self, name: str) -> float:
+        """Сколько ждать бэкенд до запуска следующего: p95 его задержки или значение по умолчанию"""
+        p95 = self.tracker.percentile(name, HEDGE_PERCENTILE)
+        if p95 is None:
+            return HEDGE_DELAY
+        return max(HEDGE_MIN_DELAY, min(HEDGE_MAX_DELAY, p95))
+
+    def _call(self, name: str, backend: SummaryBackend, text: str, cancel: threading.Event) -> Optional[str]:
+        start = time.time()
+        result = backend(text, cancel)
+        if result and not cancel.is_set():
+            self.tracker.record(name, time.time() - start)
+        return result
+
+    def summarize(self, text: str) -> Tuple[Optional[str], Optional[str]]:
+        """
+        Получает summary от самого быстрого бэкенда
+
+        Returns:
+            Tuple[Optional[str], Optional[str]]: summary и имя бэкенда; (None, None), если ни один не справился
+        """
+        deadline = time.time() + self.timeout
+        cancel_events = {name: threading.Event() for name, _ in self.backends}
+        executor = ThreadPoolExecutor(max_workers=len(self.backends))
+        running = {}
+        pending = list(self.backends)
+
+        def launch():
+            name, backend = pending.pop(0)
+            print(f"🚀 Запрос summary: {name}")
+            running[executor.submit(self._call, name, backend, text, cancel_events[name])] = name
+
+        try:
+            launch()
+            while running or pending:
+                # Пока есть запасные бэкенды, ждем не дольше hedge delay последнего запущенного
+                wait_for = deadline - time.time()
+                if pending and running:
+                    last_name = list(running.values())[-1]
+                    wait_for = min(wait_for, self.hedge_delay(last_name))
+                if wait_for <= 0:
+                    print(f"⏰ Summary не получено за {self.timeout:.0f} сек")
+                    break
+                done, _ = wait(list(running), timeout=wait_for, return_when=FIRST_COMPLETED)
+                if not done:
+                    if pending:
+                        print(f"⏱️ {list(running.values())[-1]} не ответил за hedge delay, запускаю резервный бэкенд")
+                        launch()
+                    continue
+                for future in done:
+                    name = running.pop(future)
+                    try:
+                        summary = future.result()
+                    except Exception as e:
+                        print(f"⚠️ Бэкенд {name} завершился с ошибкой: {e}")
+                        summary = None
+                    if summary:
+                        print(f"✅ Summary получено от {name}")
+                        return summary, name
+                    print(f"⚠️ Бэкенд {name} не вернул summary")
+                if not running and pending:
+                    launch()  # все запущенные бэкенды отказали - следующий запускается без ожидания
+            return None, None
+        finally:
+            # Проигравшие бэкенды получают сигнал отмены, результат их не ждет
+            for event in cancel_events.values():
+                event.set()
+            executor.shutdown(wait=False, cancel_futures=True)
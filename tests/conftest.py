@@ -0,0 +1,8 @@
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Модули проекта лежат в корне, модули сервиса суммаризации импортируют друг друга из summarizer/
+for path in (ROOT, os.path.join(ROOT, "summarizer")):
+    if path not in sys.path:
+        sys.path.insert(0, path)
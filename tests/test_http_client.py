@@ -0,0 +1,56 @@
+"""HttpClient: слот хоста не занят во время паузы перед повтором"""
+
+import threading
+import time
+
+import pytest
+
+pytest.importorskip("requests")
+
+from http_client import HttpClient  # noqa: E402
+
+
+class FakeResponse:
+    def __init__(self, status_code, headers=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+
+    def close(self):
+        pass
+
+
+def test_retry_pause_releases_host_slot():
+    client = HttpClient(max_per_host=1, max_retries=1)
+    first_429 = threading.Event()
+
+    def request(method, url, **kwargs):
+        if url.endswith("/throttled") and not first_429.is_set():
+            first_429.set()
+            return FakeResponse(429, {"Retry-After": "1"})
+        return FakeResponse(200)
+
+    client.session.request = request
+    throttled = threading.Thread(target=client.get, args=("http://host/throttled",))
+    throttled.start()
+    first_429.wait(1)
+    start = time.time()
+    # Единственный слот хоста свободен, пока первый поток ждет Retry-After
+    assert client.get("http://host/other").status_code == 200
+    assert time.time() - start < 0.5
+    throttled.join()
+
+    stats = client.stats()
+    assert stats["GET host/throttled"]["requests"] == 2
+    assert stats["GET host/throttled"]["errors"] == 1
+    assert stats["GET host/throttled"]["retries"] == 1
+
+
+def test_stats_are_consistent_across_threads():
+    client = HttpClient(max_per_host=4)
+    client.session.request = lambda method, url, **kwargs: FakeResponse(200)
+    threads = [threading.Thread(target=lambda: [client.get("http://host/x") for _ in range(200)]) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert client.stats()["GET host/x"]["requests"] == 1600
@@ -0,0 +1,68 @@
+"""RankStore: продолжение упавшего или брошенного запуска и защита живого"""
+
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+pytest.importorskip("sqlalchemy")
+
+from sqlalchemy import create_engine  # noqa: E402
+from sqlalchemy.orm import sessionmaker  # noqa: E402
+
+import rank_store  # noqa: E402
+from models import Base, RankingRun, Video  # noqa: E402
+from rank_store import RankRunActive, RankStore  # noqa: E402
+
+
+@pytest.fixture
+def session():
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    session = sessionmaker(bind=engine)()
+    yield session
+    session.close()
+
+
+@pytest.fixture
+def video_id(session):
+    video = Video(video_id="abc", youtube_url="https://youtu.be/abc")
+    session.add(video)
+    session.commit()
+    return video.id
+
+
+def set_progress(session, run_id, ranked, age_seconds):
+    updated_at = datetime.now(timezone.utc) - timedelta(seconds=age_seconds)
+    session.query(RankingRun).filter_by(id=run_id).update({"ranked": ranked, "updated_at": updated_at})
+    session.commit()
+
+
+def test_live_run_is_not_taken_over(session, video_id):
+    store = RankStore(session)
+    run_id = store.start_run(video_id, "llm", 100)
+    set_progress(session, run_id, 40, age_seconds=5)
+    with pytest.raises(RankRunActive):
+        store.start_run(video_id, "llm", 60)
+    assert session.query(RankingRun).count() == 1
+
+
+def test_stale_run_is_resumed(session, video_id):
+    store = RankStore(session)
+    run_id = store.start_run(video_id, "llm", 100)
+    set_progress(session, run_id, 40, age_seconds=rank_store.RANK_RUN_STALE_SECONDS + 60)
+    assert store.start_run(video_id, "heuristic", 60) == run_id
+    run = session.get(RankingRun, run_id)
+    assert (run.status, run.ranker, run.ranked) == ("running", "heuristic", 40)
+    # Продолживший процесс обновил прогресс - для остальных запуск снова живой
+    with pytest.raises(RankRunActive):
+        store.start_run(video_id, "llm", 60)
+
+
+def test_failed_run_is_resumed_and_done_run_is_not(session, video_id):
+    store = RankStore(session)
+    run_id = store.start_run(video_id, "llm", 100)
+    store.fail_run(run_id, "boom")
+    assert store.start_run(video_id, "llm", 50) == run_id
+    assert session.get(RankingRun, run_id).error is None
+    store.finish_run(run_id)
+    assert store.start_run(video_id, "llm", 10) != run_id
@@ -0,0 +1,77 @@
+"""RankingDriver: окна в порядке заметности (ключ вместо полной сортировки) и по id"""
+
+from datetime import datetime
+
+import pytest
+
+pytest.importorskip("sqlalchemy")
+
+from sqlalchemy import create_engine  # noqa: E402
+from sqlalchemy.orm import sessionmaker  # noqa: E402
+
+from models import Base, Comment, Video  # noqa: E402
+from ranking_driver import iter_unranked_windows  # noqa: E402
+
+
+@pytest.fixture
+def session():
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    session = sessionmaker(bind=engine)()
+    yield session
+    session.close()
+
+
+def add_comment(session, video_id, cid, likes=None, published_at=None, parent_id=None, rank=None):
+    comment = Comment(comment_id=cid, video_id=video_id, text=cid, likes=likes, published_at=published_at,
+                      parent_id=parent_id, comment_rank=rank)
+    session.add(comment)
+    session.flush()
+    return comment
+
+
+@pytest.fixture
+def video_id(session):
+    video = Video(video_id="abc", youtube_url="https://youtu.be/abc")
+    session.add(video)
+    session.flush()
+    day = lambda d: datetime(2024, 1, d)  # noqa: E731
+    add_comment(session, video.id, "reply-top", likes=1000, published_at=day(5), parent_id="top")
+    add_comment(session, video.id, "old", likes=50, published_at=day(1))
+    add_comment(session, video.id, "no-likes", likes=None, published_at=day(9))
+    add_comment(session, video.id, "top", likes=500, published_at=day(2))
+    add_comment(session, video.id, "new", likes=50, published_at=day(3))
+    add_comment(session, video.id, "no-time", likes=50)
+    add_comment(session, video.id, "tie-a", likes=10, published_at=day(4))
+    add_comment(session, video.id, "tie-b", likes=10, published_at=day(4))
+    add_comment(session, video.id, "ranked", likes=9999, published_at=day(6), rank=0.5)
+    session.commit()
+    return video.id
+
+
+EXPECTED = ["top", "new", "old", "no-time", "tie-a", "tie-b", "no-likes", "reply-top"]
+
+
+@pytest.mark.parametrize("window_size", [1, 3, 100])
+def test_priority_windows_follow_sort_order(session, video_id, window_size):
+    windows = list(iter_unranked_windows(session, video_id, window_size, order="priority"))
+    assert [row.text for window in windows for row in window] == EXPECTED
+    assert all(len(window) <= window_size for window in windows)
+
+
+def test_priority_windows_see_rows_added_after_key(session, video_id):
+    windows = iter_unranked_windows(session, video_id, 2, order="priority")
+    seen = [row.text for row in next(windows)]
+    # Комментарий, пришедший во время обхода, попадает в свою позицию, а не теряется
+    add_comment(session, video_id, "late", likes=20, published_at=datetime(2024, 2, 1))
+    # Уже проранжированный другим процессом комментарий пропускается
+    session.query(Comment).filter_by(comment_id="tie-a").update({"comment_rank": 0.1})
+    session.commit()
+    seen += [row.text for window in windows for row in window]
+    assert seen == ["top", "new", "old", "no-time", "late", "tie-b", "no-likes", "reply-top"]
+
+
+def test_id_windows_respect_shard_range(session, video_id):
+    ids = [c.id for c in session.query(Comment).filter_by(video_id=video_id).order_by(Comment.id)]
+    windows = list(iter_unranked_windows(session, video_id, 2, first_id=ids[1], last_id=ids[4], order="id"))
+    assert [row.text for window in windows for row in window] == ["old", "no-likes", "top", "new"]
@@ -0,0 +1,87 @@
+"""Token bucket запросов к YouTube и адаптивная частота (AIMD)"""
+
+import pytest
+
+pytest.importorskip("sqlalchemy")
+
+import rate_limit  # noqa: E402
+from rate_limit import (  # noqa: E402
+    AIMD_INCREASE_EVERY, AIMD_INCREASE_STEP, MIN_RATE, AdaptiveLimiter, TokenBucket, YouTubeThrottled,
+)
+
+
+class Clock:
+    """Модуль time для rate_limit: sleep не ждет, а сдвигает monotonic"""
+
+    def __init__(self):
+        self.now = 1000.0
+        self.slept = 0.0
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        # Настоящий sleep не возвращается раньше срока: без запаса округление float
+        # оставляет бакет в 1e-16 от токена
+        self.slept += seconds
+        self.now += seconds + 1e-6
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(rate_limit, "time", clock)
+    return clock
+
+
+def test_bucket_spends_burst_then_refills_at_rate(clock):
+    bucket = TokenBucket("comments", rate=2.0, burst=3)
+    assert [bucket.try_acquire() for _ in range(3)] == [0.0, 0.0, 0.0]
+    assert bucket.try_acquire() == pytest.approx(0.5)
+    clock.now += 0.5
+    assert bucket.try_acquire() == 0.0
+
+
+def test_throttle_halves_rate_and_pauses_bucket(clock):
+    limiter = AdaptiveLimiter("comments", rate=2.0, burst=3, max_rate=8.0, backend="local")
+    limiter.on_throttle(retry_after=10)
+    assert limiter.bucket.rate == pytest.approx(1.0)
+    # Пауза: следующий токен - через 10 сек Retry-After плюс период новой частоты
+    assert limiter.bucket.try_acquire() == pytest.approx(11.0)
+    for _ in range(10):
+        limiter.on_throttle(retry_after=1)
+    assert limiter.bucket.rate == pytest.approx(MIN_RATE)
+    assert limiter.stats()["throttled"] == 11
+
+
+def test_successes_raise_rate_additively_up_to_max(clock):
+    limiter = AdaptiveLimiter("comments", rate=1.0, burst=3, max_rate=1.1, backend="local")
+    for _ in range(AIMD_INCREASE_EVERY - 1):
+        limiter.on_success()
+    assert limiter.bucket.rate == pytest.approx(1.0)
+    limiter.on_success()
+    assert limiter.bucket.rate == pytest.approx(1.0 + AIMD_INCREASE_STEP)
+    for _ in range(10 * AIMD_INCREASE_EVERY):
+        limiter.on_success()
+    assert limiter.bucket.rate == pytest.approx(1.1)
+
+
+def test_throttled_call_raises_youtube_throttled(clock, monkeypatch):
+    limiter = AdaptiveLimiter("transcript", rate=5.0, burst=5, max_rate=5.0, backend="local")
+    monkeypatch.setattr(rate_limit, "_limiters", {"transcript": limiter})
+
+    class TooManyRequests(Exception):
+        pass
+
+    def blocked():
+        raise TooManyRequests("slow down")
+
+    with pytest.raises(YouTubeThrottled):
+        rate_limit.throttled_call("transcript", blocked)
+    assert limiter.bucket.rate == pytest.approx(2.5)
+    # Следующий вызов ждет паузу троттлинга; прочие ошибки частоту не меняют
+    with pytest.raises(ValueError):
+        rate_limit.throttled_call("transcript", int, "not a number")
+    assert clock.slept >= rate_limit.THROTTLE_PAUSE_SECONDS
+    assert limiter.stats()["throttled"] == 1
+    assert limiter.bucket.rate == pytest.approx(2.5)
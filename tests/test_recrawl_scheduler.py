@@ -0,0 +1,115 @@
+"""Планировщик повторных загрузок: оценка скорости, распределение бюджета и видео без успешных загрузок"""
+
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+pytest.importorskip("sqlalchemy")
+
+from sqlalchemy import create_engine  # noqa: E402
+from sqlalchemy.orm import sessionmaker  # noqa: E402
+
+import recrawl_scheduler  # noqa: E402
+from models import Base, CrawlHistory, Video  # noqa: E402
+from recrawl_scheduler import (  # noqa: E402
+    RECRAWL_HALF_LIFE_HOURS, RECRAWL_MAX_INTERVAL_HOURS, RECRAWL_MIN_INTERVAL_HOURS, RECRAWL_PRIOR_HOURS,
+    VideoCrawlStats, estimate_stats, load_stats, plan_crawls,
+    planned_fetch_rate, untracked_videos,
+)
+
+NOW = datetime.now(timezone.utc)
+
+
+@pytest.fixture
+def session():
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    session = sessionmaker(bind=engine)()
+    yield session
+    session.close()
+
+
+def add_video(session, youtube_id, crawls=()):
+    """crawls: (часов назад, новых комментариев, ошибка)"""
+    video = Video(video_id=youtube_id, youtube_url=f"https://youtu.be/{youtube_id}")
+    session.add(video)
+    session.flush()
+    for hours_ago, new_comments, error in crawls:
+        session.add(CrawlHistory(video_id=video.id, crawled_at=NOW - timedelta(hours=hours_ago),
+                                 new_comments=new_comments, fetched=new_comments, requests=2, error=error))
+    session.commit()
+    return video.id
+
+
+def test_plan_stays_within_budget_and_prefers_fast_videos():
+    stats = [
+        VideoCrawlStats(1, velocity=100.0, cost=2.0, last_crawled_at=NOW),
+        VideoCrawlStats(2, velocity=1.0, cost=2.0, last_crawled_at=NOW),
+        VideoCrawlStats(3, velocity=0.0, cost=2.0, last_crawled_at=NOW),
+    ]
+    plan = {item.video_id: item for item in plan_crawls(stats, budget_per_hour=10)}
+    assert planned_fetch_rate(plan.values()) <= 10 + 1e-6
+    assert plan[1].interval_hours < plan[2].interval_hours < plan[3].interval_hours
+    assert plan[3].interval_hours == pytest.approx(RECRAWL_MAX_INTERVAL_HOURS)
+    assert all(item.interval_hours >= RECRAWL_MIN_INTERVAL_HOURS - 1e-9 for item in plan.values())
+
+
+def test_capped_video_leaves_budget_to_others():
+    stats = [
+        VideoCrawlStats(1, velocity=10000.0, cost=1.0, last_crawled_at=NOW),
+        VideoCrawlStats(2, velocity=1.0, cost=10.0, last_crawled_at=NOW),
+        VideoCrawlStats(3, velocity=4.0, cost=10.0, last_crawled_at=NOW),
+    ]
+    plan = {item.video_id: item for item in plan_crawls(stats, budget_per_hour=50)}
+    # Самое быстрое видео упирается в минимальный интервал, срезанное делят остальные
+    assert plan[1].interval_hours == pytest.approx(RECRAWL_MIN_INTERVAL_HOURS)
+    assert planned_fetch_rate(plan.values()) == pytest.approx(50)
+    # Сверх минимальной частоты - пропорционально sqrt(скорость / стоимость): sqrt(4) / sqrt(1)
+    min_rate = 1 / RECRAWL_MAX_INTERVAL_HOURS
+    extra = {video_id: 1 / plan[video_id].interval_hours - min_rate for video_id in (2, 3)}
+    assert extra[3] / extra[2] == pytest.approx(2)
+
+
+def test_short_budget_is_split_by_cost():
+    stats = [VideoCrawlStats(video_id, velocity=10.0, cost=2.0, last_crawled_at=NOW) for video_id in (1, 2)]
+    plan = plan_crawls(stats, budget_per_hour=0.001)
+    assert planned_fetch_rate(plan) == pytest.approx(0.001)
+    assert plan[0].interval_hours == pytest.approx(plan[1].interval_hours)
+
+
+def test_estimate_stats_smooths_velocity_by_half_life():
+    start = NOW - timedelta(hours=2 * RECRAWL_HALF_LIFE_HOURS)
+    crawls = [
+        (start, 240, 13),  # первая загрузка читает всю ленту
+        (start + timedelta(hours=RECRAWL_HALF_LIFE_HOURS), 48, 3),
+        (start + timedelta(hours=2 * RECRAWL_HALF_LIFE_HOURS), 0, 2),
+    ]
+    stats = estimate_stats(7, crawls)
+    # Интервал в период полураспада - вес нового замера 0.5
+    velocity = 240 / RECRAWL_PRIOR_HOURS
+    velocity = 0.5 * 48 / RECRAWL_HALF_LIFE_HOURS + 0.5 * velocity
+    velocity = 0.5 * 0 + 0.5 * velocity
+    assert stats.velocity == pytest.approx(velocity)
+    # Стоимость - по повторным загрузкам, без первой полной
+    assert stats.cost == pytest.approx(2.5)
+    assert stats.last_crawled_at == crawls[-1][0]
+
+
+def test_plan_of_no_videos_is_empty():
+    assert plan_crawls([]) == []
+
+
+def test_errored_only_history_is_crawled_again(session):
+    tracked = add_video(session, "ok", [(48, 10, None), (24, 5, None)])
+    never = add_video(session, "new")
+    failed = add_video(session, "failed", [(48, 0, "HTTP 503")])
+    assert [s.video_id for s in load_stats(session)] == [tracked]
+    assert untracked_videos(session) == [never, failed]
+
+
+def test_recent_failure_waits_before_retry(session, monkeypatch):
+    monkeypatch.setattr(recrawl_scheduler, "RECRAWL_MIN_INTERVAL_HOURS", 1.0)
+    failed = add_video(session, "failed", [(0.1, 0, "HTTP 429")])
+    assert untracked_videos(session) == []
+    monkeypatch.setattr(recrawl_scheduler, "RECRAWL_MIN_INTERVAL_HOURS", 0.05)
+    assert untracked_videos(session) == [failed]
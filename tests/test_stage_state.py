@@ -0,0 +1,81 @@
+"""StageTracker: пропуск выполненных этапов и повтор после сброса результатов"""
+
+import pytest
+
+pytest.importorskip("sqlalchemy")
+
+from sqlalchemy import create_engine, event  # noqa: E402
+from sqlalchemy.orm import sessionmaker  # noqa: E402
+
+from models import Base, Comment, Video  # noqa: E402
+from stage_state import StageTracker, content_hash, reset_stages  # noqa: E402
+
+
+@pytest.fixture
+def session():
+    engine = create_engine("sqlite://")
+
+    @event.listens_for(engine, "connect")
+    def add_md5(connection, _):
+        # md5() есть в PostgreSQL; _bootstrap считает хэши текстов на стороне БД
+        connection.create_function("md5", 1, content_hash)
+
+    Base.metadata.create_all(engine)
+    session = sessionmaker(bind=engine)()
+    yield session
+    session.close()
+
+
+@pytest.fixture
+def video_id(session):
+    """Полностью обработанное видео: транскрипт, summary и проранжированные комментарии"""
+    video = Video(video_id="abc", youtube_url="https://youtu.be/abc", transcript="text", summary="summary")
+    session.add(video)
+    session.flush()
+    session.add_all([Comment(comment_id=f"c{i}", video_id=video.id, text="hi", comment_rank=0.5) for i in range(3)])
+    session.commit()
+    return video.id
+
+
+def test_processed_video_skips_all_stages(session, video_id):
+    tracker = StageTracker(session, video_id)
+    assert tracker.pending_stages() == []
+
+
+def test_invalidate_reruns_stage(session, video_id):
+    tracker = StageTracker(session, video_id)
+    tracker.invalidate("summary")
+    assert tracker.needs_run("summary")
+    assert not tracker.needs_run("transcript")
+
+
+def test_reset_stages_reruns_after_reset_script(session, video_id):
+    StageTracker(session, video_id)
+    session.query(Video).filter_by(id=video_id).update({Video.summary: None})
+    reset_stages(session, [video_id], ["summary"])
+    session.commit()
+    tracker = StageTracker(session, video_id)
+    assert tracker.states["summary"].status == "pending"
+    assert tracker.pending_stages() == ["summary", "rank"]
+
+
+def test_cleared_output_of_done_stage_is_rerun(session, video_id):
+    StageTracker(session, video_id)
+    # Сброс в обход трекера: строки этапов остались done
+    session.query(Video).filter_by(id=video_id).update({Video.summary: None})
+    session.query(Comment).filter_by(video_id=video_id).update({Comment.comment_rank: None})
+    session.commit()
+    tracker = StageTracker(session, video_id)
+    assert tracker.states["summary"].status == "done"
+    assert tracker.needs_run("summary")
+    assert tracker.needs_run("rank")
+    assert not tracker.needs_run("transcript")
+
+
+def test_stage_run_marks_done_and_keeps_downstream_fresh(session, video_id):
+    tracker = StageTracker(session, video_id)
+    tracker.invalidate("summary")
+    with tracker.run("summary") as result:
+        result.output_hash = content_hash("summary")
+    assert not tracker.needs_run("summary")
+    assert not tracker.is_stale("rank")
@@ -0,0 +1,52 @@
+"""Ранжирование в сервисе суммаризации: совместная оценка и оценка по вероятностям цифр"""
+
+import math
+import os
+import tempfile
+
+import pytest
+
+pytest.importorskip("fastapi")
+pytest.importorskip("prometheus_client")
+os.environ.setdefault("SUMMARY_CACHE_PATH", os.path.join(tempfile.mkdtemp(), "summary_cache.sqlite3"))
+
+import summarizer_api  # noqa: E402
+
+
+def fake_complete(monkeypatch, content):
+    def complete(model, kind, prompt, **params):
+        return {"content": content, "prefix_hit": False, "reused_tokens": 0, "tokens_evaluated": 10}
+    monkeypatch.setattr(summarizer_api, "complete", complete)
+
+
+def test_joint_rank_parses_array(monkeypatch):
+    fake_complete(monkeypatch, "[0.5, 1.0, 0.25]")
+    ranks, _, _, _ = summarizer_api.rank_comments_joint(None, "prefix", "key", ["a", "b", "c"])
+    assert ranks == [0.5, 1.0, 0.25]
+
+
+@pytest.mark.parametrize("content", ["[0.5, 0.", "", "[0.5]"])
+def test_joint_rank_unparsed_answer_falls_back(monkeypatch, content):
+    # Обрезанный ответ или массив не той длины - None, эндпоинт оценит комментарии по одному
+    fake_complete(monkeypatch, content)
+    ranks, _, _, _ = summarizer_api.rank_comments_joint(None, "prefix", "key", ["a", "b"])
+    assert ranks is None
+
+
+def test_score_uses_pre_sampling_digit_probabilities(monkeypatch):
+    calls = []
+
+    def complete(model, kind, prompt, **params):
+        calls.append(params)
+        # Формат llama-server b4600 при post_sampling_probs=false: logprob сырых логитов
+        top = [{"token": "7", "logprob": math.log(0.5)}, {"token": " 9", "logprob": math.log(0.3)},
+               {"token": "0", "logprob": math.log(0.1)}, {"token": "Hello", "logprob": math.log(0.1)}]
+        return {"content": "7", "completion_probabilities": [{"top_logprobs": top}],
+                "prefix_hit": True, "reused_tokens": 5, "tokens_evaluated": 10}
+    monkeypatch.setattr(summarizer_api, "complete", complete)
+
+    rank, hit, _, _ = summarizer_api.score_comment(None, "prefix", "key", "comment", "comment 1/1")
+    assert calls[0]["temperature"] == 0.0 and calls[0]["post_sampling_probs"] is False
+    # Не цифры отброшены, вероятности цифр нормированы: (7*0.5 + 9*0.3 + 0*0.1) / 0.9 / 9
+    assert rank == pytest.approx((7 * 0.5 + 9 * 0.3) / 0.9 / 9)
+    assert hit
@@ -0,0 +1,72 @@
+"""reduce_summaries: пустой ввод, одно summary и иерархическое сведение N summary"""
+
+import asyncio
+import os
+import tempfile
+
+import pytest
+
+pytest.importorskip("fastapi")
+pytest.importorskip("prometheus_client")
+os.environ.setdefault("SUMMARY_CACHE_PATH", os.path.join(tempfile.mkdtemp(), "summary_cache.sqlite3"))
+
+import summarizer_api  # noqa: E402
+
+
+class FakeScheduler:
+    """Выполняет reduce-промпты сразу: summary группы - ее первая строка"""
+
+    def __init__(self):
+        self.prompts = []
+
+    def _reduce(self, label, text):
+        self.prompts.append(label)
+        return text.split("\n")[0], False
+
+    async def submit(self, func, model, instruction, text, n_predict, label):
+        return self._reduce(label, text)
+
+    async def map(self, func, calls):
+        return [self._reduce(label, text) for _, _, text, _, label in calls]
+
+
+class FakeModel:
+    name = "fake"
+
+    def __init__(self):
+        self.scheduler = FakeScheduler()
+
+
+@pytest.fixture
+def model(monkeypatch):
+    # Каждое summary - 10 токенов: в один reduce-промпт помещаются 3 summary
+    monkeypatch.setattr(summarizer_api, "count_tokens", lambda model, text: 10)
+    monkeypatch.setattr(summarizer_api, "REDUCE_INPUT_TOKENS", 30)
+    return FakeModel()
+
+
+def reduce(model, summaries):
+    return asyncio.run(asyncio.wait_for(summarizer_api.reduce_summaries(model, summaries), timeout=5))
+
+
+def test_empty_input_returns_empty_summary(model):
+    assert reduce(model, []) == ("", 0)
+    assert model.scheduler.prompts == []
+
+
+def test_single_summary_is_returned_as_is(model):
+    assert reduce(model, ["only"]) == ("only", 0)
+    assert model.scheduler.prompts == []
+
+
+def test_many_summaries_reduce_to_final(model):
+    summary, hits = reduce(model, [f"s{i}" for i in range(10)])
+    assert summary == "s0"
+    assert hits == 0
+    assert model.scheduler.prompts[-1] == "final reduce"
+
+
+def test_level_without_progress_raises(model, monkeypatch):
+    monkeypatch.setattr(summarizer_api, "group_summaries", lambda model, summaries: [[s] for s in summaries])
+    with pytest.raises(RuntimeError):
+        reduce(model, ["a", "b"])
@@ -0,0 +1,100 @@
+"""TranscriptEngine: выбор дорожки, кэш и разделение "нет субтитров" / временная ошибка"""
+
+import pytest
+
+pytest.importorskip("youtube_transcript_api")
+pytest.importorskip("youtube_comment_downloader")
+pytest.importorskip("sqlalchemy")
+
+from youtube_transcript_api import TranscriptsDisabled  # noqa: E402
+
+import rate_limit  # noqa: E402
+import transcript_engine  # noqa: E402
+from transcript_engine import TranscriptEngine, choose_track  # noqa: E402
+
+
+class Snippet:
+    def __init__(self, text):
+        self.text = text
+
+
+class Track:
+    def __init__(self, language_code, is_generated, calls):
+        self.language_code = language_code
+        self.language = language_code
+        self.is_generated = is_generated
+        self.calls = calls
+
+    def fetch(self):
+        self.calls.append(("fetch", self.language_code, self.is_generated))
+        return [Snippet("hello"), Snippet(self.language_code)]
+
+
+@pytest.fixture
+def api(monkeypatch):
+    """Поддельный YouTubeTranscriptApi: list отдает api.tracks или бросает api.error"""
+    class FakeApi:
+        calls = []
+        tracks = []
+        error = None
+
+        def list(self, video_id):
+            FakeApi.calls.append(("list", video_id))
+            if FakeApi.error is not None:
+                raise FakeApi.error
+            return FakeApi.tracks
+
+    monkeypatch.setattr(transcript_engine, "YouTubeTranscriptApi", FakeApi)
+    # Отдельный limiter без ожиданий
+    monkeypatch.setattr(rate_limit, "_limiters", {})
+    monkeypatch.setitem(rate_limit.RATE_LIMITS, "transcript", (1000.0, 1000, 1000.0))
+    monkeypatch.setattr(rate_limit, "THROTTLE_PAUSE_SECONDS", 0.01)
+    return FakeApi
+
+
+@pytest.fixture
+def engine(tmp_path):
+    return TranscriptEngine(languages=["ru", "en"], policy="language", cache_path=str(tmp_path / "cache.sqlite3"))
+
+
+def test_choose_track_policies(api):
+    tracks = [Track("de", False, []), Track("en", True, []), Track("ru", True, []), Track("en", False, [])]
+    by_language = choose_track(tracks, ["ru", "en"], "language")
+    assert (by_language.language_code, by_language.is_generated) == ("ru", True)
+    manual = choose_track(tracks, ["ru", "en"], "manual")
+    assert (manual.language_code, manual.is_generated) == ("en", False)
+    assert choose_track([], ["ru"]) is None
+
+
+def test_repeat_run_uses_cache(api, engine):
+    api.tracks = [Track("ru", False, api.calls)]
+    assert engine.get_transcript("v1") == "hello ru"
+    assert engine.get_transcript("v1") == "hello ru"
+    assert api.calls == [("list", "v1"), ("fetch", "ru", False)]
+
+
+def test_refresh_does_not_refetch_cached_track(api, engine):
+    api.tracks = [Track("ru", False, api.calls)]
+    engine.get_transcript("v1")
+    assert engine.get_transcript("v1", refresh=True) == "hello ru"
+    assert api.calls == [("list", "v1"), ("fetch", "ru", False), ("list", "v1")]
+
+
+def test_disabled_transcripts_are_unavailable(api, engine):
+    api.error = TranscriptsDisabled("v1")
+    assert engine.get_transcript("v1") is None
+
+
+def test_network_error_propagates(api, engine):
+    api.error = ConnectionError("connection reset")
+    with pytest.raises(ConnectionError):
+        engine.get_transcript("v1")
+
+
+def test_throttling_raises_retryable_error(api, engine):
+    class TooManyRequests(Exception):
+        pass
+
+    api.error = TooManyRequests("429")
+    with pytest.raises(rate_limit.YouTubeThrottled):
+        engine.get_transcript("v1")
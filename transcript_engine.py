@@ -0,0 +1,198 @@
+"""
+Получение транскриптов YouTube с одним листингом дорожек и кэшем на диске
+
+Список дорожек видео запрашивается один раз, из него по политике выбирается лучшая
+дорожка (язык из TRANSCRIPT_LANGUAGES, ручные субтитры или автоматические), и она
+загружается одним запросом. Текст сохраняется в SQLite-кэш с ключом (видео, дорожка):
+повторная обработка и сброс транскрипта (reset_video_data.py) берут его из кэша без
+запросов к YouTube. С refresh=True список дорожек запрашивается заново, но выбранная
+дорожка, которая уже есть в кэше, повторно не загружается.
+"""
+
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from youtube_transcript_api import NoTranscriptFound, TranscriptsDisabled, YouTubeTranscriptApi
+
+from rate_limit import throttled_call
+
+# Языки по убыванию предпочтения; остальные языки - только если этих нет
+TRANSCRIPT_LANGUAGES = [code.strip() for code in os.getenv("TRANSCRIPT_LANGUAGES", "ru,en").split(",") if code.strip()]
+# language: сначала язык, внутри языка ручные субтитры раньше автоматических;
+# manual: ручные субтитры любого языка раньше автоматических
+TRANSCRIPT_POLICY = os.getenv("TRANSCRIPT_POLICY", "language")
+TRANSCRIPT_CACHE_PATH = os.getenv(
+    "TRANSCRIPT_CACHE_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache", "transcript_cache.sqlite3"),
+)
+
+
+def track_key(language_code: str, is_generated: bool) -> str:
+    """Ключ дорожки в кэше: ru:manual, en:generated"""
+    return f"{language_code}:{'generated' if is_generated else 'manual'}"
+
+
+def choose_track(tracks: Iterable, languages: List[str] = TRANSCRIPT_LANGUAGES,
+                 policy: str = TRANSCRIPT_POLICY):
+    """Лучшая дорожка списка по политике выбора или None, если список пуст"""
+    def order(track) -> Tuple[int, int]:
+        language_rank = languages.index(track.language_code) if track.language_code in languages else len(languages)
+        if policy == "manual":
+            return int(track.is_generated), language_rank
+        return language_rank, int(track.is_generated)
+
+    return min(tracks, key=order, default=None)
+
+
+class TranscriptCache:
+    """
+    Персистентный кэш транскриптов (SQLite): текст каждой загруженной дорожки видео
+    и дорожка, выбранная для видео последней
+    """
+
+    def __init__(self, path: str = TRANSCRIPT_CACHE_PATH):
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS transcripts (
+                video_id TEXT NOT NULL,
+                track TEXT NOT NULL,
+                language TEXT,
+                text TEXT NOT NULL,
+                fetched_at REAL NOT NULL,
+                chosen_at REAL NOT NULL,
+                PRIMARY KEY (video_id, track)
+            )
+        """)
+        self._conn.commit()
+
+    def get(self, video_id: str, track: Optional[str] = None) -> Optional[Tuple[str, str]]:
+        """(дорожка, текст): заданная дорожка или выбранная для видео последней"""
+        with self._lock:
+            if track is None:
+                row = self._conn.execute(
+                    "SELECT track, text FROM transcripts WHERE video_id = ? ORDER BY chosen_at DESC LIMIT 1",
+                    (video_id,),
+                ).fetchone()
+            else:
+                row = self._conn.execute(
+                    "SELECT track, text FROM transcripts WHERE video_id = ? AND track = ?", (video_id, track)
+                ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return row
+
+    def choose(self, video_id: str, track: str):
+        """Отмечает дорожку из кэша выбранной для видео"""
+        with self._lock:
+            self._conn.execute(
+                "UPDATE transcripts SET chosen_at = ? WHERE video_id = ? AND track = ?", (time.time(), video_id, track)
+            )
+            self._conn.commit()
+
+    def put(self, video_id: str, track: str, language: str, text: str):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO transcripts (video_id, track, language, text, fetched_at, chosen_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (video_id, track, language, text, now, now),
+            )
+            self._conn.commit()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            entries, videos = self._conn.execute(
+                "SELECT COUNT(*), COUNT(DISTINCT video_id) FROM transcripts"
+            ).fetchone()
+            return {"hits": self.hits, "misses": self.misses, "entries": entries, "videos": videos}
+
+
+class TranscriptEngine:
+    """Транскрипт видео: кэш, иначе один листинг дорожек и одна загрузка выбранной"""
+
+    def __init__(self, languages: List[str] = TRANSCRIPT_LANGUAGES, policy: str = TRANSCRIPT_POLICY,
+                 cache_path: str = TRANSCRIPT_CACHE_PATH):
+        self.languages = languages
+        self.policy = policy
+        self.cache = TranscriptCache(cache_path)
+
+    def get_transcript(self, video_id: str, refresh: bool = False) -> Optional[str]:
+        """
+        Текст транскрипта видео
+
+        Args:
+            video_id: YouTube ID видео
+            refresh: Заново запросить список дорожек (например, чтобы подхватить появившиеся ручные субтитры)
+
+        Returns:
+            Optional[str]: Текст или None, если у видео нет транскрипта
+
+        Raises:
+            YouTubeThrottled: YouTube ограничил частоту запросов
+            Exception: Сетевые и прочие ошибки - временные, этап транскрипта будет повторен
+        """
+        if not refresh:
+            cached = self.cache.get(video_id)
+            if cached is not None:
+                track, text = cached
+                print(f"💾 Транскрипт {video_id} ({track}) из кэша: {len(text)} символов")
+                return text
+
+        print(f"📝 Получаю список транскриптов для видео {video_id}...")
+        try:
+            # Новый экземпляр на вызов: YouTubeTranscriptApi держит свою requests.Session и не потокобезопасен
+            tracks = list(throttled_call("transcript", YouTubeTranscriptApi().list, video_id))
+        except (TranscriptsDisabled, NoTranscriptFound) as e:
+            # Только отсутствие субтитров означает "недоступен"; остальные ошибки пробрасываются
+            print(f"⚠️ Транскрипты недоступны: {type(e).__name__}")
+            return None
+
+        track = choose_track(tracks, self.languages, self.policy)
+        if track is None:
+            print("⚠️ У видео нет транскриптов")
+            return None
+        key = track_key(track.language_code, track.is_generated)
+        cached = self.cache.get(video_id, key)
+        if cached is not None:
+            self.cache.choose(video_id, key)
+            print(f"💾 Транскрипт {video_id} ({key}) не изменился, беру из кэша: {len(cached[1])} символов")
+            return cached[1]
+
+        kind = "автоматический" if track.is_generated else "ручной"
+        print(f"📝 Загружаю {kind} транскрипт на языке: {track.language} (из {len(tracks)} доступных)")
+        fetched = throttled_call("transcript", track.fetch)
+        text = ' '.join(snippet.text for snippet in fetched)
+        self.cache.put(video_id, key, track.language, text)
+        print(f"✅ Получен транскрипт длиной {len(text)} символов")
+        return text
+
+
+_engine: Optional[TranscriptEngine] = None
+_engine_lock = threading.Lock()
+
+
+def transcript_engine() -> TranscriptEngine:
+    """Общий движок процесса (одно подключение к кэшу)"""
+    global _engine
+    with _engine_lock:
+        if _engine is None:
+            _engine = TranscriptEngine()
+        return _engine
+
+
+def get_transcript(video_id: str, refresh: bool = False) -> Optional[str]:
+    return transcript_engine().get_transcript(video_id, refresh)